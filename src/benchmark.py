@@ -0,0 +1,390 @@
+""" End-to-end benchmark for the Shaderverse API and Celery workers
+
+Starts the API and the workers against a blend file or a generated synthetic scene, drives the batch and single render
+endpoints at a fixed concurrency and writes throughput and latency percentiles as JSON.
+Per-stage percentiles are estimated from the /metrics histograms recorded during each scenario.
+
+    python benchmark.py --blend-file scene.blend --items 20 --concurrency 4 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+import httpx
+
+SCRIPT_PATH = Path(__file__).parent.absolute()
+API_SCRIPT = SCRIPT_PATH.joinpath("shaderverse", "api", "main.py")
+CELERY_SCRIPT = SCRIPT_PATH.joinpath("shaderverse", "api", "run_celery.py")
+SCENE_SCRIPT = SCRIPT_PATH.joinpath("synthetic_scene.py")
+
+SCENARIOS = ["generate_batch", "render_batch", "render_glb", "render_fbx", "render_jpeg", "render_vrm", "mixed_priority"]
+INTERACTIVE_QUEUES = "render_interactive,generate_interactive"
+PERCENTILES = (50, 95, 99)
+POLL_INTERVAL = 0.25
+
+BUCKET_PATTERN = re.compile(r'^shaderverse_task_stage_seconds_bucket\{(?P<labels>.*),le="(?P<le>[^"]+)"\} (?P<count>\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+WORKERS_PATTERN = re.compile(r'^shaderverse_workers\{state="(?P<state>\w+)"\} (?P<count>\S+)$')
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the Shaderverse API and workers end to end")
+    parser.add_argument("--blend-file", dest="blend_file", type=Path, default=None,
+                        help="the blend file the API and workers open, a synthetic scene is generated when omitted")
+    parser.add_argument("--blender", dest="blender", default="blender",
+                        help="the Blender binary")
+    parser.add_argument("--port", dest="port", type=int, default=8118,
+                        help="the API port; rendered file urls assume 8118")
+    parser.add_argument("--workers", dest="workers", type=int, default=1,
+                        help="number of Blender worker processes")
+    parser.add_argument("--interactive-workers", dest="interactive_workers", type=int, default=0,
+                        help="workers out of --workers that only consume the interactive lane")
+    parser.add_argument("--concurrency", dest="concurrency", type=int, default=4,
+                        help="requests in flight for the single render scenarios")
+    parser.add_argument("--items", dest="items", type=int, default=20,
+                        help="items generated and rendered per scenario")
+    parser.add_argument("--scenarios", dest="scenarios", default="generate_batch,render_batch,render_glb",
+                        help=f"comma separated scenarios out of {','.join(SCENARIOS)}")
+    parser.add_argument("--task-timeout", dest="task_timeout", type=float, default=600.0,
+                        help="seconds to wait for a single task or batch")
+    parser.add_argument("--startup-timeout", dest="startup_timeout", type=float, default=180.0,
+                        help="seconds to wait for the API and workers to come up")
+    parser.add_argument("--url", dest="url", default=None,
+                        help="benchmark an already running API instead of starting one")
+    parser.add_argument("--output", dest="output", type=Path, default=None,
+                        help="write the JSON report here instead of stdout")
+    parser.add_argument("--log-dir", dest="log_dir", type=Path, default=Path("benchmark_logs"),
+                        help="where the API and worker output is written")
+    return parser.parse_args()
+
+
+def get_percentile(values: list[float], percentile: float) -> float:
+    """ Linearly interpolated percentile of the values """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percentile / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(latencies: list[float], errors: int, wall_seconds: float, items: int) -> dict:
+    summary = {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "items": items,
+        "wall_seconds": wall_seconds,
+        "throughput_items_per_second": items / wall_seconds if wall_seconds else None,
+        "latency_seconds": {f"p{percentile}": get_percentile(latencies, percentile) for percentile in PERCENTILES},
+    }
+    if latencies:
+        summary["latency_seconds"]["mean"] = sum(latencies) / len(latencies)
+        summary["latency_seconds"]["max"] = max(latencies)
+    return summary
+
+
+def parse_stage_buckets(text: str) -> dict[tuple[str, str], dict[float, float]]:
+    """ Read the cumulative stage histogram buckets out of the Prometheus text format """
+    buckets: dict[tuple[str, str], dict[float, float]] = {}
+    for line in text.splitlines():
+        match = BUCKET_PATTERN.match(line)
+        if not match:
+            continue
+        labels = dict(LABEL_PATTERN.findall(match["labels"]))
+        key = (labels.get("task", ""), labels.get("stage", ""))
+        buckets.setdefault(key, {})[float(match["le"])] = float(match["count"])
+    return buckets
+
+
+def get_histogram_quantile(buckets: dict[float, float], quantile: float) -> float:
+    """ Estimate a quantile from cumulative buckets the way Prometheus histogram_quantile does """
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if total <= 0:
+        return None
+    rank = quantile * total
+    previous_bound = 0.0
+    previous_count = 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if math.isinf(bound):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound = bound
+        previous_count = count
+    return previous_bound
+
+
+def get_stage_summary(before: str, after: str) -> dict:
+    """ Per task and stage percentiles of the observations made between two scrapes """
+    before_buckets = parse_stage_buckets(before)
+    summary = {}
+    for (task, stage), buckets in sorted(parse_stage_buckets(after).items()):
+        previous = before_buckets.get((task, stage), {})
+        delta = {bound: count - previous.get(bound, 0.0) for bound, count in buckets.items()}
+        count = delta[max(delta)]
+        if count <= 0:
+            continue
+        stage_summary = {"count": int(count)}
+        for percentile in PERCENTILES:
+            stage_summary[f"p{percentile}"] = get_histogram_quantile(delta, percentile / 100)
+        summary.setdefault(task, {})[stage] = stage_summary
+    return summary
+
+
+def get_idle_workers(text: str) -> int:
+    for line in text.splitlines():
+        match = WORKERS_PATTERN.match(line)
+        if match and match["state"] == "idle":
+            return int(float(match["count"]))
+    return 0
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=SCRIPT_PATH, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkServices():
+    """ The API and Celery worker processes, each running in background Blender """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.processes: dict[str, subprocess.Popen] = {}
+        self.log_files = []
+
+    def start_process(self, name: str, script: Path, script_args: list[str]):
+        self.args.log_dir.mkdir(parents=True, exist_ok=True)
+        log_file = open(self.args.log_dir.joinpath(f"{name}.log"), "wb")
+        self.log_files.append(log_file)
+        cmd = [self.args.blender, str(self.args.blend_file), "--background", "--addons", "shaderverse", "--python", str(script), "--"] + script_args
+        print(f"Running command: {cmd}", file=sys.stderr)
+        self.processes[name] = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT)
+
+    def generate_scene(self) -> Path:
+        """ Build the default synthetic scene so runs without a blend file stay comparable """
+        self.args.log_dir.mkdir(parents=True, exist_ok=True)
+        blend_file = self.args.log_dir.joinpath("synthetic.blend").absolute()
+        cmd = [self.args.blender, "--background", "--factory-startup", "--addons", "shaderverse", "--python", str(SCENE_SCRIPT), "--", "--output", str(blend_file)]
+        print(f"Running command: {cmd}", file=sys.stderr)
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        return blend_file
+
+    def start(self):
+        if self.args.blend_file is None:
+            self.args.blend_file = self.generate_scene()
+        self.start_process("fastapi", API_SCRIPT, ["--port", str(self.args.port)])
+        # the Blender workers use the solo pool, so every worker is its own process
+        for worker in range(self.args.workers):
+            script_args = ["--concurrency", "1"]
+            if worker < self.args.interactive_workers:
+                script_args += ["--queues", INTERACTIVE_QUEUES]
+            self.start_process(f"celery-{worker}", CELERY_SCRIPT, script_args)
+
+    def check(self):
+        for name, process in self.processes.items():
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with {process.returncode}, see {self.args.log_dir}")
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                if platform.system() == "Windows":
+                    process.kill()
+                else:
+                    process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log_file in self.log_files:
+            log_file.close()
+
+
+class Benchmark():
+    """ Drive the API scenarios and collect the timings of each """
+
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace):
+        self.client = client
+        self.args = args
+        self.metadata_list: list[dict] = []
+
+    async def get_metrics(self) -> str:
+        response = await self.client.get("/metrics")
+        response.raise_for_status()
+        return response.text
+
+    async def wait_until_ready(self, services: BenchmarkServices = None):
+        """ Wait until the API answers and every worker has reported itself idle """
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if services:
+                services.check()
+            try:
+                if get_idle_workers(await self.get_metrics()) >= self.args.workers:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(1)
+        raise TimeoutError("API and workers did not come up in time")
+
+    async def wait_for_batch(self, batch_id: str) -> dict:
+        deadline = time.monotonic() + self.args.task_timeout
+        while time.monotonic() < deadline:
+            response = await self.client.get(f"/batch/{batch_id}")
+            if response.status_code == 200:
+                batch = response.json()
+                if batch.get("status") in ("SUCCESS", "FAILURE", "VALUE_ERROR", "EXCEPTION"):
+                    return batch
+            await asyncio.sleep(POLL_INTERVAL)
+        raise TimeoutError(f"Batch {batch_id} did not finish in time")
+
+    async def wait_for_task(self, task_id: str) -> dict:
+        deadline = time.monotonic() + self.args.task_timeout
+        while time.monotonic() < deadline:
+            response = await self.client.get(f"/task/{task_id}")
+            if response.status_code == 200:
+                task = response.json()
+                if task.get("task_status") in ("SUCCESS", "FAILURE"):
+                    return task
+            await asyncio.sleep(POLL_INTERVAL)
+        raise TimeoutError(f"Task {task_id} did not finish in time")
+
+    async def run_batch(self, method: str, url: str, params: dict, body: dict = None) -> tuple[float, dict]:
+        start_time = time.perf_counter()
+        response = await self.client.request(method, url, params=params, json=body)
+        response.raise_for_status()
+        batch = await self.wait_for_batch(response.json()["batch_id"])
+        return time.perf_counter() - start_time, batch
+
+    async def generate_batch(self) -> dict:
+        elapsed_time, batch = await self.run_batch("POST", "/generate_batch", {"number_to_generate": self.args.items, "starting_id": 1})
+        errors = 0 if batch["status"] == "SUCCESS" else 1
+        if not errors:
+            response = await self.client.get(f"/batch_metadata/{batch['batch_id']}")
+            response.raise_for_status()
+            self.metadata_list = response.json().get("metadata_list") or []
+        return summarize([elapsed_time] if not errors else [], errors, elapsed_time, len(self.metadata_list))
+
+    async def render_batch(self) -> dict:
+        await self.ensure_metadata()
+        params = {"should_render_glb": True}
+        body = {"metadata_list": self.metadata_list}
+        elapsed_time, batch = await self.run_batch("POST", "/render_batch", params, body)
+        errors = 0 if batch["status"] == "SUCCESS" else 1
+        return summarize([elapsed_time] if not errors else [], errors, elapsed_time, len(self.metadata_list) if not errors else 0)
+
+    async def render_single(self, endpoint: str, params: dict = None) -> dict:
+        """ Render every generated item through a single render endpoint with bounded concurrency """
+        await self.ensure_metadata()
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies: list[float] = []
+        errors = 0
+
+        async def render(metadata: dict):
+            nonlocal errors
+            async with semaphore:
+                start_time = time.perf_counter()
+                try:
+                    response = await self.client.post(f"/{endpoint}", params=params, json=metadata)
+                    response.raise_for_status()
+                    task = await self.wait_for_task(response.json()["task_id"])
+                    if task["task_status"] != "SUCCESS":
+                        raise RuntimeError(f"Task {task['task_id']} failed")
+                    latencies.append(time.perf_counter() - start_time)
+                except (httpx.HTTPError, RuntimeError, TimeoutError) as e:
+                    print(f"{endpoint} failed: {e}", file=sys.stderr)
+                    errors += 1
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*[render(metadata) for metadata in self.metadata_list])
+        return summarize(latencies, errors, time.perf_counter() - start_time, len(latencies))
+
+    async def mixed_priority(self) -> dict:
+        """ Interactive GLB renders submitted while a bulk batch of the same items keeps the workers busy """
+        await self.ensure_metadata()
+        bulk = asyncio.create_task(self.render_batch())
+        # let the batch fill the queue before the interactive requests arrive
+        await asyncio.sleep(1)
+        result = await self.render_single("render_glb", {"priority": "interactive"})
+        result["bulk"] = await bulk
+        return result
+
+    async def ensure_metadata(self):
+        if not self.metadata_list:
+            await self.generate_batch()
+        if not self.metadata_list:
+            raise RuntimeError("No generated metadata to render")
+
+    async def run_scenario(self, name: str) -> dict:
+        print(f"Running {name}", file=sys.stderr)
+        before = await self.get_metrics()
+        if name == "generate_batch":
+            result = await self.generate_batch()
+        elif name == "render_batch":
+            result = await self.render_batch()
+        elif name == "mixed_priority":
+            result = await self.mixed_priority()
+        else:
+            result = await self.render_single(name)
+        result["stages"] = get_stage_summary(before, await self.get_metrics())
+        return result
+
+
+async def run(args: argparse.Namespace) -> dict:
+    scenarios = [scenario.strip() for scenario in args.scenarios.split(",") if scenario.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {scenario}")
+
+    services = None
+    if args.url is None:
+        services = BenchmarkServices(args)
+        services.start()
+    base_url = args.url or f"http://localhost:{args.port}"
+
+    report = {
+        "commit": get_commit(),
+        "blend_file": str(args.blend_file),
+        "config": {
+            "workers": args.workers,
+            "interactive_workers": args.interactive_workers,
+            "concurrency": args.concurrency,
+            "items": args.items,
+        },
+        "scenarios": {},
+    }
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.task_timeout) as client:
+            benchmark = Benchmark(client, args)
+            await benchmark.wait_until_ready(services)
+            for scenario in scenarios:
+                report["scenarios"][scenario] = await benchmark.run_scenario(scenario)
+    finally:
+        if services:
+            services.stop()
+    return report
+
+
+if __name__ == "__main__":
+    args = get_args()
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
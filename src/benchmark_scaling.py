@@ -0,0 +1,128 @@
+""" Sweep synthetic scene sizes and chart how the generator and realize scale
+
+Every point builds a scene with synthetic_scene.py in a fresh background Blender and times
+--items generated and realized items against it. One size parameter is varied at a time:
+
+    python benchmark_scaling.py --vary objects_per_collection --values 10,100,1000,5000 --items 5
+
+The JSON report lists the mean time per generated and per realized item for each point. With
+matplotlib installed a chart is written next to it; without it a table is printed instead.
+"""
+import argparse
+import json
+import math
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SCRIPT_PATH = Path(__file__).parent.absolute()
+SCENE_SCRIPT = SCRIPT_PATH.joinpath("synthetic_scene.py")
+
+SIZE_PARAMETERS = ["trait_collections", "objects_per_collection", "restriction_density", "nested_collections", "animated_collections", "value_inputs"]
+STAGES = ["generate_seconds", "restriction_seconds", "schema_seconds", "realize_seconds"]
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sweep synthetic scene sizes through the Shaderverse generator")
+    parser.add_argument("--blender", dest="blender", default="blender",
+                        help="the Blender binary")
+    parser.add_argument("--vary", dest="vary", choices=SIZE_PARAMETERS, default="objects_per_collection",
+                        help="the size parameter to sweep")
+    parser.add_argument("--values", dest="values", default="10,50,250,1000",
+                        help="comma separated values of the swept parameter")
+    parser.add_argument("--items", dest="items", type=int, default=5,
+                        help="items generated and realized per point")
+    parser.add_argument("--trait-collections", dest="trait_collections", type=int, default=4)
+    parser.add_argument("--objects-per-collection", dest="objects_per_collection", type=int, default=10)
+    parser.add_argument("--restriction-density", dest="restriction_density", type=float, default=0.2)
+    parser.add_argument("--nested-collections", dest="nested_collections", type=int, default=1)
+    parser.add_argument("--animated-collections", dest="animated_collections", type=int, default=0)
+    parser.add_argument("--value-inputs", dest="value_inputs", type=int, default=2)
+    parser.add_argument("--output", dest="output", type=Path, default=Path("scaling.json"),
+                        help="the JSON report; the chart is written next to it as .png")
+    return parser.parse_args()
+
+
+def run_point(args: argparse.Namespace, config: dict, report_path: Path) -> dict:
+    """ Build and measure one scene size in its own Blender process """
+    cmd = [args.blender, "--background", "--factory-startup", "--addons", "shaderverse", "--python", str(SCENE_SCRIPT), "--"]
+    for parameter in SIZE_PARAMETERS:
+        cmd += [f"--{parameter.replace('_', '-')}", str(config[parameter])]
+    cmd += ["--measure", str(args.items), "--report", str(report_path)]
+    print(f"Running command: {cmd}", file=sys.stderr)
+    completed = subprocess.run(cmd, capture_output=True, text=True)
+    if completed.returncode != 0 or not report_path.exists():
+        raise RuntimeError(f"Blender failed for {config}:\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}")
+    return json.loads(report_path.read_text())
+
+
+def plot(points: list[dict], vary: str, filepath: Path) -> bool:
+    """ Chart the mean time per item of every stage, returning False without matplotlib """
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return False
+
+    x_values = [point["config"][vary] for point in points]
+    figure, axis = plt.subplots(figsize=(8, 5))
+    for stage in STAGES:
+        axis.plot(x_values, [point["summary"][stage]["mean"] for point in points], marker="o", label=stage.replace("_seconds", ""))
+    axis.set_xscale("log")
+    axis.set_yscale("log")
+    axis.set_xlabel(vary)
+    axis.set_ylabel("seconds per item")
+    axis.legend()
+    axis.grid(True, which="both", alpha=0.3)
+    figure.tight_layout()
+    figure.savefig(filepath)
+    return True
+
+
+def print_table(points: list[dict], vary: str):
+    print(f"{vary:>24} {'objects':>8} " + " ".join(f"{stage.replace('_seconds', ''):>12}" for stage in STAGES))
+    for point in points:
+        means = " ".join(f"{point['summary'][stage]['mean']:12.4f}" for stage in STAGES)
+        print(f"{point['config'][vary]:>24} {point['object_count']:>8} {means}")
+
+
+def get_growth(points: list[dict], vary: str, stage: str) -> float:
+    """ Slope of log time against log size between the first and last point, 2 means quadratic """
+    first = points[0]
+    last = points[-1]
+    x_ratio = last["config"][vary] / first["config"][vary] if first["config"][vary] else 0
+    y_ratio = last["summary"][stage]["mean"] / first["summary"][stage]["mean"] if first["summary"][stage]["mean"] else 0
+    if x_ratio <= 1 or y_ratio <= 0:
+        return None
+    return math.log(y_ratio) / math.log(x_ratio)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    value_type = float if args.vary == "restriction_density" else int
+    values = [value_type(value) for value in args.values.split(",")]
+
+    points = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for value in values:
+            config = {parameter: getattr(args, parameter) for parameter in SIZE_PARAMETERS}
+            config[args.vary] = value
+            points.append(run_point(args, config, Path(temp_dir).joinpath(f"{args.vary}-{value}.json")))
+
+    report = {
+        "vary": args.vary,
+        "items": args.items,
+        "points": [{key: point[key] for key in ("config", "object_count", "build_seconds", "summary")} for point in points],
+        "growth": {stage: get_growth(points, args.vary, stage) for stage in STAGES} if len(points) > 1 else {},
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+    print_table(points, args.vary)
+    chart_path = args.output.with_suffix(".png")
+    if plot(points, args.vary, chart_path):
+        print(f"Wrote {chart_path}", file=sys.stderr)
+    else:
+        print("matplotlib is not installed, skipping the chart", file=sys.stderr)
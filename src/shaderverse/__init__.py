@@ -24,6 +24,8 @@ bl_info = {
 
 import bpy
 from . import blender
+from . import geonode_registry
+from .blender import fetch
 
 custom_icons = None
 
@@ -44,12 +46,15 @@ classes = [
     blender.SHADERVERSE_PT_rendering,
     blender.SHADERVERSE_PT_batch,
     blender.SHADERVERSE_PT_settings,
+    blender.SHADERVERSE_PT_service_logs,
+    blender.SHADERVERSE_PT_rarity_report,
     blender.SHADERVERSE_PT_restrictions,
     blender.SHADERVERSE_UL_restrictions,
     blender.SHADERVERSE_OT_restrictions_new_item,
     blender.SHADERVERSE_OT_restrictions_delete_item,
     blender.SHADERVERSE_OT_restrictions_move_item,
     blender.SHADERVERSE_OT_generate,
+    blender.SHADERVERSE_OT_compute_rarity,
     blender.SHADERVERSE_OT_realize,
     blender.SHADERVERSE_OT_live_preview,
     blender.SHADERVERSE_OT_stop_live_preview,
@@ -80,6 +85,8 @@ def register():
 
     blender.SHADERVERSE_OT_install_modules.first_install()
 
+    geonode_registry.register_handlers()
+
 
 
 #same as register but backwards, deleting references
@@ -89,6 +96,9 @@ def unregister():
     #delete the custom property pointer
     #NOTE: this is different from its accessor, as that is a read/write only
     #to delete this we have to delete its pointer, just like how we added it
+    geonode_registry.unregister_handlers()
+    fetch.stop_http_client()
+
     del bpy.types.Object.shaderverse 
     del bpy.types.Scene.shaderverse
 
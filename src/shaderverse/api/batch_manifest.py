@@ -0,0 +1,167 @@
+import json
+import sqlite3
+import time
+from enum import Enum
+from contextlib import contextmanager
+from pathlib import Path
+from celery import states
+from celery.result import AsyncResult
+from celery.signals import task_postrun
+from shaderverse.api.utils import get_temporary_directory, get_broker_reset_time
+
+METADATA_FORMAT = "metadata"
+
+
+class ItemState(str, Enum):
+    """ State of an item of a batch in its manifest """
+    queued = "queued"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batch (batch_id TEXT PRIMARY KEY, kind TEXT, params TEXT, created_at REAL, updated_at REAL);
+CREATE TABLE IF NOT EXISTS item (batch_id TEXT, item_id INTEGER, format TEXT, state TEXT, task_id TEXT, metadata TEXT, artifact TEXT, error TEXT, attempts INTEGER, updated_at REAL,
+    PRIMARY KEY (batch_id, item_id, format));
+CREATE INDEX IF NOT EXISTS item_task ON item (task_id);
+CREATE TABLE IF NOT EXISTS dead_letter (task_id TEXT PRIMARY KEY, task TEXT, exception TEXT, message TEXT, traceback TEXT, arguments TEXT, permanent INTEGER, retries INTEGER, created_at REAL);
+"""
+
+
+def get_manifest_path() -> Path:
+    """ Kept next to the broker database, which is deleted on start, so batches outlive it """
+    return get_temporary_directory().joinpath("batches.sqlite")
+
+
+is_schema_created = False
+
+@contextmanager
+def connect():
+    """ Open the batch manifests shared by the API and every worker on this machine """
+    global is_schema_created
+    connection = sqlite3.connect(str(get_manifest_path()), timeout=10)
+    connection.row_factory = sqlite3.Row
+    try:
+        if not is_schema_created:
+            connection.executescript(SCHEMA)
+            is_schema_created = True
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def get_rendered_path(rendered_file_url: str) -> Path:
+    return get_temporary_directory().joinpath(rendered_file_url.split("/")[-1])
+
+
+def create_batch(batch_id: str, kind: str, params: dict, items: list[tuple[int, str, str, dict]]):
+    """ Record a batch and its items as (item id, format, task id, metadata) """
+    now = time.time()
+    with connect() as connection:
+        connection.execute("INSERT OR REPLACE INTO batch VALUES (?, ?, ?, ?, ?)", (batch_id, kind, json.dumps(params), now, now))
+        connection.executemany(
+            "INSERT OR REPLACE INTO item VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, 1, ?)",
+            [(batch_id, item_id, item_format, ItemState.queued.value, task_id, json.dumps(metadata) if metadata else None, now)
+             for item_id, item_format, task_id, metadata in items])
+
+
+def get_batch(batch_id: str) -> dict | None:
+    with connect() as connection:
+        batch = connection.execute("SELECT * FROM batch WHERE batch_id = ?", (batch_id,)).fetchone()
+        if batch is None:
+            return None
+        items = connection.execute("SELECT * FROM item WHERE batch_id = ? ORDER BY item_id, format", (batch_id,)).fetchall()
+    manifest = dict(batch)
+    manifest["params"] = json.loads(manifest["params"])
+    manifest["items"] = [dict(item) for item in items]
+    for item in manifest["items"]:
+        item["metadata"] = json.loads(item["metadata"]) if item["metadata"] else None
+    manifest["counts"] = {}
+    for item in manifest["items"]:
+        manifest["counts"][item["state"]] = manifest["counts"].get(item["state"], 0) + 1
+    return manifest
+
+
+def get_task_states(task_ids: list[str]) -> dict[str, str]:
+    """ The manifest state of each of the tasks that belongs to a batch """
+    task_ids = list(task_ids)
+    states = {}
+    with connect() as connection:
+        # stay below SQLite's limit of host parameters per statement
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            states.update(connection.execute(
+                f"SELECT task_id, state FROM item WHERE task_id IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+    return states
+
+
+def get_result_fields(retval) -> tuple[dict, str]:
+    """ The metadata and artifact url of a task result """
+    if hasattr(retval, "dict"):
+        retval = retval.dict()
+    if not isinstance(retval, dict):
+        return None, None
+    return retval, retval.get("rendered_file_url") or retval.get("rendered_glb_url")
+
+
+def set_task_state(task_id: str, state: ItemState, retval=None):
+    """ Record the final state of a task on the manifest items it belongs to
+
+    Generated items keep the metadata the task returned, rendered items keep the metadata they
+    were submitted with so they can be rendered again.
+    """
+    metadata, artifact = get_result_fields(retval) if state == ItemState.succeeded else (None, None)
+    error = str(retval) if state == ItemState.failed and retval is not None else None
+    with connect() as connection:
+        connection.execute(
+            "UPDATE item SET state = ?, metadata = CASE WHEN format = ? THEN COALESCE(?, metadata) ELSE metadata END, artifact = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (state.value, METADATA_FORMAT, json.dumps(metadata, default=str) if metadata else None, artifact, error, time.time(), task_id))
+
+
+def is_missing(item: dict, force: bool = False) -> bool:
+    """ An item that has to be submitted again: failed, lost with the broker, or whose file is gone
+
+    A task that is still pending was lost if it was queued before the broker database was last
+    deleted. Otherwise it is still waiting in its queue, unless force submits it again anyway.
+    """
+    if item["state"] == ItemState.failed:
+        return True
+    if item["state"] == ItemState.succeeded:
+        return bool(item["artifact"]) and not get_rendered_path(item["artifact"]).exists()
+    result = AsyncResult(item["task_id"])
+    if result.state == states.SUCCESS:
+        set_task_state(item["task_id"], ItemState.succeeded, result.result)
+        return False
+    if result.state in states.PROPAGATE_STATES:
+        return True
+    if result.state not in (states.PENDING, states.STARTED, states.RETRY):
+        return False
+    return force or item["updated_at"] < get_broker_reset_time()
+
+
+def get_missing_items(batch_id: str, force: bool = False) -> list[dict]:
+    manifest = get_batch(batch_id)
+    if manifest is None:
+        raise KeyError(f"Unknown batch {batch_id}")
+    return [item for item in manifest["items"] if is_missing(item, force)]
+
+
+def requeue_items(batch_id: str, items: list[tuple[int, str, str]]):
+    """ Point items at the tasks that replace them, as (item id, format, task id) """
+    now = time.time()
+    with connect() as connection:
+        connection.executemany(
+            "UPDATE item SET state = ?, task_id = ?, error = NULL, attempts = attempts + 1, updated_at = ? WHERE batch_id = ? AND item_id = ? AND format = ?",
+            [(ItemState.queued.value, task_id, now, batch_id, item_id, item_format) for item_id, item_format, task_id in items])
+        connection.execute("UPDATE batch SET updated_at = ? WHERE batch_id = ?", (now, batch_id))
+
+
+@task_postrun.connect
+def handle_task_postrun(sender=None, task_id=None, retval=None, state=None, **kwargs):
+    if state not in (states.SUCCESS, states.FAILURE):
+        return
+    try:
+        set_task_state(task_id, ItemState.succeeded if state == states.SUCCESS else ItemState.failed, retval)
+    except sqlite3.Error as e:
+        print(f"Could not update the batch manifest: {e}")
@@ -1,14 +1,26 @@
 from typing import List
+from contextlib import contextmanager
 from celery import shared_task
 from pathlib import Path
-from fastapi import HTTPException
 import bpy
 import json
 import os
+import shutil
 import tempfile
 from shaderverse.mesh import Mesh
 from shaderverse.model import Metadata, Attribute, AttributeModel
-from shaderverse.api.utils import get_temporary_directory
+from shaderverse.api.utils import get_temporary_directory, get_rendered_file_url
+from shaderverse.api.export.glb_writer import GlbWriter, UnsupportedSceneError
+from shaderverse.api.export.preview_writer import PreviewGlbWriter
+from shaderverse.api.export.optimize import optimize_glb
+from shaderverse.api.export.texture_cache import get_texture_cache
+from shaderverse.api.model import OptimizationProfile, OptimizationResult
+from shaderverse.api import metrics, profiling, worker_memory, batch_manifest, failures, time_limits
+from shaderverse.api.config.celery_config import settings
+from shaderverse.api.failures import RETRYABLE_ERRORS, PermanentError
+from shaderverse.api.preview import preview_scene
+from shaderverse.api.outputs import Output
+from shaderverse.rarity import RarityAnalyzer
 
 def open_blend_file(filepath: str = bpy.data.filepath):
     bpy.ops.wm.open_mainfile(filepath=filepath)
@@ -28,6 +40,24 @@ def get_export_materials_option()-> str:
         option = "NONE"
     return option
 
+def apply_metadata(json_attributes: list):
+    """ Store the requested traits on the scene for the generator to read"""
+    with metrics.stage("metadata_apply"):
+        bpy.context.scene.shaderverse.generated_metadata = json.dumps(json_attributes)
+
+def revert_file():
+    print("reverting file")
+    with metrics.stage("revert"):
+        bpy.ops.wm.revert_mainfile()
+
+@contextmanager
+def reverting():
+    """ Revert the file when a task ends, also when it fails halfway, so the next task starts from a clean scene """
+    try:
+        yield
+    finally:
+        revert_file()
+
 def run_generator(mesh: Mesh):
     mesh.create_animated_objects_collection()
     mesh.reset_animated_objects()
@@ -35,6 +65,18 @@ def run_generator(mesh: Mesh):
 
 
 def export_glb_file(glb_filename: str):
+    """ Export the visible scene as GLB, using the native writer for realized, non-animated scenes"""
+    # reuse textures unpacked or re-encoded by earlier items instead of encoding them again
+    get_texture_cache().apply()
+    if bpy.context.scene.shaderverse.enable_native_glb_export:
+        try:
+            GlbWriter().write(glb_filename)
+            return
+        except UnsupportedSceneError as error:
+            print(f"Falling back to the glTF exporter: {error}")
+    export_glb_file_with_exporter(glb_filename)
+
+def export_glb_file_with_exporter(glb_filename: str):
         bpy.ops.export_scene.gltf(filepath=glb_filename, check_existing=False, export_format='GLB', ui_tab='GENERAL', export_copyright='', export_image_format='AUTO', export_texcoords=True, export_normals=True, export_draco_mesh_compression_enable=False, export_tangents=False, export_materials='EXPORT', export_colors=True, use_mesh_edges=False, use_mesh_vertices=False, export_cameras=False, use_selection=False, use_visible=True, use_renderable=True, use_active_collection=False, export_extras=False, export_yup=True, export_apply=True, export_animations=True, export_frame_range=True, export_frame_step=1, export_force_sampling=True, export_nla_strips=True, export_def_bones=False, export_current_frame=False, export_skins=True, export_all_influences=False, export_morph=True, export_morph_normal=True, export_morph_tangent=False, export_lights=False, export_anim_single_armature=True)
 
 # @app.on_event("startup")
@@ -44,36 +86,41 @@ def export_glb_file(glb_filename: str):
 #     bpy.ops.wm.open_mainfile(filepath=BLEND_FILE)
 
 
-@shared_task(bind=True,autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 5},
+@shared_task(bind=True, autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 5},
               name='generate:generate_task')
-def generate_task(self, should_open_blend_file: bool = False, id=None):
-    if should_open_blend_file:
-        open_blend_file()
-    mesh = Mesh()
-    print("NFT attributes before running generator")
-    print(mesh.attributes)
-    run_generator(mesh)
-    # print(bpy.context.active_object.name)
-
-
-    print("NFT attributes after running generator")
-    print(mesh.attributes)
-
-    generated_metadata: List[Attribute] = []
-    if len(bpy.context.scene.shaderverse.generated_metadata) > 0:
-        generated_metadata = json.loads(bpy.context.scene.shaderverse.generated_metadata)
-
-    metadata = Metadata(
-        id=id,
-        filename=bpy.data.filepath,json_attributes=generated_metadata)
+def generate_task(self, should_open_blend_file: bool = False, id=None, should_profile: bool = False):
+    with profiling.profile_task(should_profile, self.request.id) as profile, reverting():
+        if should_open_blend_file:
+            open_blend_file()
+        mesh = Mesh(item_id=id)
+        print("NFT attributes before running generator")
+        print(mesh.attributes)
+        with metrics.stage("generate"):
+            run_generator(mesh)
+        # print(bpy.context.active_object.name)
+
+
+        print("NFT attributes after running generator")
+        print(mesh.attributes)
+
+        generated_metadata: List[Attribute] = []
+        if len(bpy.context.scene.shaderverse.generated_metadata) > 0:
+            generated_metadata = json.loads(bpy.context.scene.shaderverse.generated_metadata)
+
+        metadata = Metadata(
+            id=id,
+            filename=bpy.data.filepath,json_attributes=generated_metadata)
     
-    # metadata.set_attributes_from_json()
-
-    print("reverting file")
-    bpy.ops.wm.revert_mainfile()
+        # metadata.set_attributes_from_json()
 
+        return profile.attach(metadata)
 
-    return metadata
+@shared_task(bind=True, name='generate:rarity_task')
+def rarity_task(self, max_states: int, samples: int, co_occurrence: bool = True, seed: int = None) -> dict:
+    """ Compute the rarity of every trait value in the worker's scene """
+    with metrics.stage("rarity"):
+        report = RarityAnalyzer().analyze(max_states=max_states, samples=samples, co_occurrence=co_occurrence, seed=seed)
+    return report.dict()
 
 def set_active_object(object_ref):
     bpy.context.view_layer.objects.active = object_ref
@@ -98,9 +145,12 @@ def set_object_visibility(mesh: Mesh):
     
 
 def handle_rendering(mesh: Mesh):
-    mesh.update_geonodes_from_metadata()
-    set_object_visibility(mesh)
-    bpy.ops.shaderverse.realize() 
+    with metrics.stage("update_geonodes"):
+        mesh.update_geonodes_from_metadata()
+    metrics.record_input_writes(mesh.input_writes, mesh.skipped_input_writes)
+    with metrics.stage("realize"):
+        set_object_visibility(mesh)
+        bpy.ops.shaderverse.realize() 
     
     generated_metadata: List[Attribute] = json.loads(bpy.context.scene.shaderverse.generated_metadata)
     metadata = Metadata(
@@ -109,64 +159,123 @@ def handle_rendering(mesh: Mesh):
     return (metadata)
 
 
-@shared_task(bind=True,autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 5},
-              name='render:render_glb_task')
-def render_glb_task(self, metadata: dict, should_open_blend_file: bool = False):
-    if should_open_blend_file:
-        open_blend_file()
-    mesh = Mesh()
-    id = metadata["id"]
-    # print(f"metadata: {metadata}")
-    bpy.context.scene.shaderverse.generated_metadata = json.dumps(metadata["json_attributes"])
-    
-    metadata = handle_rendering(mesh)
-    rendered_glb_file = generate_filepath("glb")
-    export_glb_file(rendered_glb_file)
-    print("reverting file")
-    bpy.ops.wm.revert_mainfile()
+def get_existing_output(output: Output, metadata: dict) -> Metadata | None:
+    """ The metadata of an item whose file was already rendered from the same traits """
+    if output.find() is None:
+        return None
+    metrics.increment("shaderverse_skipped_outputs_total", {"format": output.path.suffix.lstrip(".")})
+    return Metadata(id=metadata["id"], filename=bpy.data.filepath, json_attributes=metadata["json_attributes"], rendered_file_url=output.url)
 
-    rendered_file_name = Path(rendered_glb_file).name
-    rendered_glb_url = f"http://localhost:8118/rendered/{rendered_file_name}" 
-    metadata.rendered_glb_url = rendered_glb_url
-    metadata.rendered_file_url = rendered_glb_url
-    metadata.id = id
 
-    return metadata 
+@shared_task(bind=True, autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 5},
+              name='render:render_glb_task')
+def render_glb_task(self, metadata: dict, should_open_blend_file: bool = False, should_profile: bool = False, collection: str = None, skip_if_present: bool = False):
+    output = Output(metadata, "glb", collection)
+    if skip_if_present and (existing := get_existing_output(output, metadata)):
+        existing.rendered_glb_url = existing.rendered_file_url
+        return existing
+    with profiling.profile_task(should_profile, self.request.id) as profile, reverting():
+        if should_open_blend_file:
+            open_blend_file()
+        mesh = Mesh()
+        id = metadata["id"]
+        # print(f"metadata: {metadata}")
+        apply_metadata(metadata["json_attributes"])
+    
+        metadata = handle_rendering(mesh)
+        with metrics.stage("export"), output.write() as rendered_glb_file:
+            export_glb_file(rendered_glb_file)
+
+        rendered_glb_url = output.url
+        metadata.rendered_glb_url = rendered_glb_url
+        metadata.rendered_file_url = rendered_glb_url
+        metadata.id = id
+
+        return profile.attach(metadata)
+
+
+@shared_task(bind=True, name='preview:preview_glb_task')
+def preview_glb_task(self, json_attributes: list):
+    """ Update the resident preview scene with the changed traits and write a light GLB of it """
+    changed = preview_scene.update(json_attributes)
+    preview_file = preview_scene.get_path()
+    rendered_glb_file = str(preview_file.with_name(f"{preview_file.stem}.partial.glb"))
+    with metrics.stage("export"):
+        try:
+            PreviewGlbWriter().write(rendered_glb_file)
+        except UnsupportedSceneError as error:
+            print(f"Falling back to the glTF exporter: {error}")
+            bpy.ops.export_scene.gltf(filepath=rendered_glb_file, check_existing=False, export_format='GLB', export_image_format='AUTO', export_draco_mesh_compression_enable=False, use_visible=True, use_renderable=True, export_apply=True, export_animations=False, export_skins=False, export_morph=False)
+        os.replace(rendered_glb_file, preview_file)
+    preview_scene.previews += 1
+    # the file keeps its name, the count makes browsers load each preview instead of a cached one
+    return {"rendered_glb_url": f"{get_rendered_file_url(preview_file.name)}?preview={preview_scene.previews}", "changed": sorted(changed)}
+
+
+def get_rendered_file_path(rendered_file_url: str) -> Path:
+    """ Return the local path of a file served from /rendered"""
+    rendered_file_name = rendered_file_url.split("/")[-1]
+    return get_temporary_directory().joinpath(rendered_file_name)
+
+
+# the optimize pool is a process pool, where Celery enforces time limits itself
+@shared_task(bind=True, name='optimize:optimize_glb_task',
+             soft_time_limit=settings.task_time_limits["optimize"][0], time_limit=settings.task_time_limits["optimize"][1])
+def optimize_glb_task(self, metadata: Metadata | dict, profile: dict):
+    """ Optimize a rendered GLB in the optimize worker pool, chained after render_glb_task"""
+    if isinstance(metadata, dict):
+        metadata = Metadata(**metadata)
+    rendered_file = get_rendered_file_path(metadata.rendered_file_url)
+    # the rendered file is never changed, it may already be handed out or skipped as present by other requests
+    output = Output.derive(rendered_file, optimization=profile)
+    record = output.find()
+    if record:
+        metadata.optimization = OptimizationResult(**record["optimization"])
+    else:
+        with metrics.stage("optimize"), output.write() as optimized_file:
+            shutil.copyfile(rendered_file, optimized_file)
+            metadata.optimization = optimize_glb(optimized_file, OptimizationProfile(**profile))
+            output.details["optimization"] = metadata.optimization.dict()
+        print(f"optimized {rendered_file.name}: {metadata.optimization.original_size} -> {metadata.optimization.optimized_size} bytes")
+    metadata.rendered_file_url = output.url
+    metadata.rendered_glb_url = output.url
+    return metadata
 
 
 def export_vrm_file(rendered_file):
     bpy.ops.export_scene.vrm(filepath=rendered_file)
 
 
-@shared_task(bind=True,autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 5},
+@shared_task(bind=True, autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 5},
               name='render:render_vrm_task')
-def render_vrm_task(self, metadata: dict, should_open_blend_file: bool = False):
-    is_vrm_installed = len(dir(bpy.ops.vrm)) > 0
-    if not is_vrm_installed:
-        raise HTTPException(status_code=404, detail="VRM addon not installed")
+def render_vrm_task(self, metadata: dict, should_open_blend_file: bool = False, should_profile: bool = False, collection: str = None, skip_if_present: bool = False):
+    output = Output(metadata, "vrm", collection)
+    if skip_if_present and (existing := get_existing_output(output, metadata)):
+        return existing
+    with profiling.profile_task(should_profile, self.request.id) as profile, reverting():
+        is_vrm_installed = len(dir(bpy.ops.vrm)) > 0
+        if not is_vrm_installed:
+            raise PermanentError("VRM addon not installed")
     
-    id = metadata["id"]
-    if should_open_blend_file:
-        open_blend_file()
-    mesh = Mesh()
-    bpy.context.scene.shaderverse.generated_metadata = json.dumps(metadata["json_attributes"])
-    metadata = handle_rendering(mesh)
-    rendered_file = generate_filepath("vrm")
-    mesh.set_armature_position("REST")
-    export_vrm_file(rendered_file)
-    print("reverting file")
-    bpy.ops.wm.revert_mainfile()
-
-    rendered_file_name = Path(rendered_file).name
-    rendered_file_url = f"http://localhost:8118/rendered/{rendered_file_name}" 
-    metadata.rendered_file_url = rendered_file_url
-    metadata.id = id
-
-    return metadata 
+        id = metadata["id"]
+        if should_open_blend_file:
+            open_blend_file()
+        mesh = Mesh()
+        apply_metadata(metadata["json_attributes"])
+        metadata = handle_rendering(mesh)
+        mesh.set_armature_position("REST")
+        with metrics.stage("export"), output.write() as rendered_file:
+            export_vrm_file(rendered_file)
+
+        rendered_file_url = output.url
+        metadata.rendered_file_url = rendered_file_url
+        metadata.id = id
+
+        return profile.attach(metadata)
 
 def export_fbx_file(rendered_file):
-    # unpack all files so that textures are detected
-    bpy.ops.file.unpack_all(method='USE_LOCAL')
+    # point textures at cached files so that they are detected without unpacking them for every item
+    get_texture_cache().apply()
     # use FBX export options with best Unreal compatibility 
     bpy.ops.export_scene.fbx(filepath=rendered_file,
                             apply_scale_options='FBX_SCALE_UNITS',
@@ -183,33 +292,36 @@ def delete_all_objects():
         bpy.data.objects.remove(obj)
 
 
-@shared_task(bind=True,autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 5},
+@shared_task(bind=True, autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 5},
               name='render:render_fbx_task')
-def render_fbx_task(self, metadata: dict, should_open_blend_file: bool = False):
-    if should_open_blend_file:
-        open_blend_file()
-    mesh = Mesh()
-    id = metadata["id"]
-    bpy.context.scene.shaderverse.generated_metadata = json.dumps(metadata["json_attributes"])
+def render_fbx_task(self, metadata: dict, should_open_blend_file: bool = False, should_profile: bool = False, collection: str = None, skip_if_present: bool = False):
+    output = Output(metadata, "fbx", collection)
+    if skip_if_present and (existing := get_existing_output(output, metadata)):
+        return existing
+    with profiling.profile_task(should_profile, self.request.id) as profile, reverting():
+        if should_open_blend_file:
+            open_blend_file()
+        mesh = Mesh()
+        id = metadata["id"]
+        apply_metadata(metadata["json_attributes"])
     
-    metadata = handle_rendering(mesh)
-
-    rendered_glb_file = generate_filepath("glb")
-    export_glb_file(rendered_glb_file)
-    print (Path(rendered_glb_file))
-    delete_all_objects()
-    bpy.ops.import_scene.gltf(filepath=rendered_glb_file)
-    rendered_file = generate_filepath("fbx")
-    export_fbx_file(rendered_file)
-    print("reverting file")
-    bpy.ops.wm.revert_mainfile()
+        metadata = handle_rendering(mesh)
+
+        rendered_glb_file = generate_filepath("glb")
+        with metrics.stage("export"):
+            export_glb_file(rendered_glb_file)
+        print (Path(rendered_glb_file))
+        delete_all_objects()
+        with metrics.stage("import"):
+            bpy.ops.import_scene.gltf(filepath=rendered_glb_file)
+        with metrics.stage("export"), output.write() as rendered_file:
+            export_fbx_file(rendered_file)
 
-    rendered_file_name = Path(rendered_file).name
-    rendered_file_url = f"http://localhost:8118/rendered/{rendered_file_name}" 
-    metadata.rendered_file_url = rendered_file_url
-    metadata.id = id
+        rendered_file_url = output.url
+        metadata.rendered_file_url = rendered_file_url
+        metadata.id = id
 
-    return metadata 
+        return profile.attach(metadata)
 
 
 def render_jpeg_file(rendered_file):
@@ -218,32 +330,33 @@ def render_jpeg_file(rendered_file):
     
 
 
-@shared_task(bind=True,autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={"max_retries": 5},
+@shared_task(bind=True, autoretry_for=RETRYABLE_ERRORS, retry_backoff=True, retry_kwargs={"max_retries": 5},
               name='render:render_jpeg_task')
-def render_jpeg_task(self, metadata: dict, resolution_x: int = 720, resolution_y: int = 720, samples: int = 64, file_format: str = "JPEG", quality: int = 90, should_open_blend_file: bool = False):
-    if should_open_blend_file:
-        open_blend_file()
-    mesh = Mesh()
-    id = metadata["id"]
-    bpy.context.scene.render.resolution_x = resolution_x
-    bpy.context.scene.render.resolution_y = resolution_y
-    bpy.data.scenes["Scene"].cycles.samples = samples
-    bpy.context.scene.render.resolution_percentage = 100
-    # TODO: makeformat an enum
-    bpy.context.scene.render.image_settings.file_format = file_format
-    if file_format == 'JPEG':
-        bpy.context.scene.render.image_settings.quality = quality
-    bpy.context.scene.shaderverse.generated_metadata = json.dumps(metadata["json_attributes"])
+def render_jpeg_task(self, metadata: dict, resolution_x: int = 720, resolution_y: int = 720, samples: int = 64, file_format: str = "JPEG", quality: int = 90, should_open_blend_file: bool = False, should_profile: bool = False, collection: str = None, skip_if_present: bool = False):
+    output = Output(metadata, "jpg", collection, resolution_x=resolution_x, resolution_y=resolution_y, samples=samples, file_format=file_format, quality=quality)
+    if skip_if_present and (existing := get_existing_output(output, metadata)):
+        return existing
+    with profiling.profile_task(should_profile, self.request.id) as profile, reverting():
+        if should_open_blend_file:
+            open_blend_file()
+        mesh = Mesh()
+        id = metadata["id"]
+        bpy.context.scene.render.resolution_x = resolution_x
+        bpy.context.scene.render.resolution_y = resolution_y
+        bpy.data.scenes["Scene"].cycles.samples = samples
+        bpy.context.scene.render.resolution_percentage = 100
+        # TODO: makeformat an enum
+        bpy.context.scene.render.image_settings.file_format = file_format
+        if file_format == 'JPEG':
+            bpy.context.scene.render.image_settings.quality = quality
+        apply_metadata(metadata["json_attributes"])
     
-    metadata = handle_rendering(mesh)
-    rendered_file = generate_filepath("jpg")
-    render_jpeg_file(rendered_file)
-    print("reverting file")
-    bpy.ops.wm.revert_mainfile()
+        metadata = handle_rendering(mesh)
+        with metrics.stage("render"), output.write() as rendered_file:
+            render_jpeg_file(rendered_file)
 
-    rendered_file_name = Path(rendered_file).name
-    rendered_file_url = f"http://localhost:8118/rendered/{rendered_file_name}" 
-    metadata.rendered_file_url = rendered_file_url
-    metadata.id = id
+        rendered_file_url = output.url
+        metadata.rendered_file_url = rendered_file_url
+        metadata.id = id
   
-    return metadata  
\ No newline at end of file
+        return profile.attach(metadata)
\ No newline at end of file
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Callable
+from celery import states
+from celery.result import AsyncResult
+from shaderverse.model import Metadata
+from shaderverse.api.model import Priority
+from shaderverse.api import metrics
+
+MAX_INFLIGHT = 1024
+LANE_RANKS = {priority: rank for rank, priority in enumerate(Priority)}
+
+
+def get_render_key(render_format: str, metadata: Metadata, **params) -> str:
+    """ Identify a render by its format, its traits in any order and the render parameters """
+    attributes = sorted((attribute.trait_type, str(attribute.value)) for attribute in metadata.json_attributes or [])
+    content = json.dumps([render_format, attributes, params], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class InflightRenders():
+    """ Renders still queued or running, so identical requests share one task
+
+    A request attaches to an identical render unless that render is still waiting in a slower
+    priority lane, in which case it is submitted again in its own lane and becomes the one later
+    requests attach to. A render older than the hard time limit of its format is never attached
+    to, since a worker that died keeps its task started for good.
+    """
+
+    def __init__(self):
+        self.tasks: dict[str, tuple[str, Priority, float]] = {}
+        self.lock = threading.Lock()
+
+    def is_expired(self, expires_at: float) -> bool:
+        return time.monotonic() >= expires_at
+
+    def is_attachable(self, task_id: str, lane: Priority, expires_at: float, priority: Priority) -> bool:
+        if self.is_expired(expires_at):
+            return False
+        state = AsyncResult(task_id).state
+        if state in states.READY_STATES:
+            return False
+        return state != states.PENDING or LANE_RANKS[lane] <= LANE_RANKS[priority]
+
+    def prune(self):
+        for key, (task_id, _, expires_at) in list(self.tasks.items()):
+            if self.is_expired(expires_at) or AsyncResult(task_id).state in states.READY_STATES:
+                del self.tasks[key]
+
+    def submit(self, key: str, priority: Priority, send: Callable[[], AsyncResult], render_format: str, hard_limit: float) -> tuple[str, bool]:
+        """ Return the task id of the render and whether it was already in flight
+
+        Makes result backend queries, so it is called from a thread pool rather than the event loop.
+        """
+        with self.lock:
+            inflight = self.tasks.get(key)
+            if inflight and self.is_attachable(*inflight, priority):
+                metrics.increment("shaderverse_coalesced_requests_total", {"format": render_format})
+                return inflight[0], True
+            self.tasks.pop(key, None)
+            if len(self.tasks) >= MAX_INFLIGHT:
+                self.prune()
+            result = send()
+            self.tasks[key] = (result.id, priority, time.monotonic() + hard_limit)
+            return result.id, False
+
+
+inflight_renders = InflightRenders()
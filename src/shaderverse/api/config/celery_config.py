@@ -1,3 +1,4 @@
+import json
 import os
 from functools import lru_cache
 from kombu import Queue
@@ -5,6 +6,49 @@ from pathlib import Path
 from tempfile import gettempdir
 from shaderverse.api.utils import get_temporary_directory
 
+# interactive requests and bulk batches wait in their own queues, normal requests keep the plain queue names
+PRIORITY_LANES = ("interactive", "normal", "bulk")
+LANE_QUEUES = ("render", "generate")
+
+
+def get_lane_queue(queue: str, priority: str) -> str:
+    if queue not in LANE_QUEUES or priority == "normal":
+        return queue
+    return f"{queue}_{priority}"
+
+
+def get_lane_queues(*priorities: str) -> list[str]:
+    """ The queues of the Blender workers for the given lanes, most urgent lane first """
+    return [get_lane_queue(queue, priority) for priority in priorities for queue in LANE_QUEUES]
+
+
+# soft and hard time limits in seconds by format, past the soft limit a task fails at its next stage,
+# past the hard limit the supervisor kills its worker
+DEFAULT_TIME_LIMITS = {
+    "metadata": (120, 300),
+    "rarity": (300, 600),
+    "glb": (300, 600),
+    "vrm": (300, 600),
+    "fbx": (600, 900),
+    "jpeg": (600, 1200),
+    "optimize": (300, 600),
+    "preview": (60, 120),
+}
+
+
+def get_time_limits() -> dict[str, tuple[float, float]]:
+    """ The default limits, overridden by SHADERVERSE_TIME_LIMITS, e.g. '{"jpeg": [900, 1800]}' """
+    time_limits = dict(DEFAULT_TIME_LIMITS)
+    try:
+        overrides = json.loads(os.environ.get("SHADERVERSE_TIME_LIMITS", "{}"))
+    except ValueError as e:
+        print(f"Ignoring SHADERVERSE_TIME_LIMITS: {e}")
+        overrides = {}
+    for render_format, (soft_limit, hard_limit) in overrides.items():
+        time_limits[render_format] = (float(soft_limit), float(hard_limit))
+    return time_limits
+
+
 def route_task(name, args, kwargs, options, task=None, **kw):
     print(f"Routing task: {name}")
     if ":" in name:
@@ -49,10 +93,21 @@ class BaseConfig:
         # custom queue
         Queue("render"),
         Queue("generate"),
+        Queue("optimize"),
+        Queue("preview"),
+        # priority lanes
+        *[Queue(queue) for queue in get_lane_queues("interactive", "bulk")],
     )
 
     CELERY_TASK_ROUTES = (route_task,)
 
+    # Blender workers run the solo pool, so Celery's max tasks/memory per child don't apply to them
+    worker_recycle_max_tasks = int(os.environ.get("SHADERVERSE_WORKER_MAX_TASKS", 200))
+    worker_recycle_max_rss_mb = int(os.environ.get("SHADERVERSE_WORKER_MAX_RSS_MB", 4096))
+    worker_recycle_grace_seconds = float(os.environ.get("SHADERVERSE_WORKER_RECYCLE_GRACE", 300))
+
+    task_time_limits = get_time_limits()
+
 
 class DevelopmentConfig(BaseConfig):
     pass
@@ -1,7 +1,9 @@
 from celery import current_app as current_celery_app
 from celery.result import AsyncResult, TimeoutError, GroupResult
 
-from .celery_config import settings
+from celery import Signature
+from .celery_config import settings, route_task, get_lane_queue
+from shaderverse.api.failures import get_dead_letters
 from enum import Enum
 import logging
 
@@ -21,6 +23,16 @@ def create_celery():
     return celery_app
 
 
+def prioritize(signature: Signature, priority: str) -> Signature:
+    """
+    send the task to the queue of its priority lane
+    """
+    if isinstance(priority, Enum):
+        priority = priority.value
+    queue = route_task(signature.task, signature.args, signature.kwargs, signature.options)["queue"]
+    return signature.set(queue=get_lane_queue(queue, priority))
+
+
 def get_task_info(task_id):
     """
     return task info for the given task_id
@@ -33,7 +45,7 @@ def get_task_info(task_id):
             "task_status": task_result.status,
             "task_result": task_result.result
         }
-        task_result.get(timeout=0.1)
+        task_result.get(timeout=0.1, propagate=False)
     except TimeoutError as e:
         result = {
             "task_id": task_id,
@@ -52,12 +64,37 @@ def get_task_info(task_id):
 
     return result
 
+def get_queue_depths() -> dict[str, int]:
+    """
+    return the number of messages waiting in each configured queue
+    """
+    depths = {}
+    with current_celery_app.connection_or_acquire() as connection:
+        channel = connection.default_channel
+        for queue in settings.CELERY_TASK_QUEUES:
+            try:
+                depths[queue.name] = channel.queue_declare(queue=queue.name, passive=True).message_count
+            except Exception as e:
+                print(f"Exception: {e}")
+    return depths
+
 class BatchStatus(Enum):
     PENDING = "PENDING"
     STARTED = "STARTED"
     SUCCESS = "SUCCESS"
     WAITING = "WAITING"
     FAILURE = "FAILURE"
+    FAILING = "FAILING"
+
+def get_failures(failed_results: list[AsyncResult]) -> list[dict]:
+    """
+    return the dead letters of failed tasks, the items of a chain that failed at an earlier link only have their error
+    """
+    if not failed_results:
+        return []
+    dead_letters = {dead_letter["task_id"]: dead_letter for dead_letter in get_dead_letters([task_result.id for task_result in failed_results])}
+    return [dead_letters.get(task_result.id) or {"task_id": task_result.id, "exception": type(task_result.result).__name__, "message": str(task_result.result)}
+            for task_result in failed_results]
 
 def get_batch_info(task_id):
     """
@@ -78,7 +115,14 @@ def get_batch_info(task_id):
             "percent_complete": batch_result.completed_count() / batch_size,
         }
 
-        batch_result.get(timeout=0.1)
+        # failed items are reported while the rest of the batch is still running
+        failed_results = [task_result for task_result in batch_result.results if task_result.failed()]
+        result["failed_count"] = len(failed_results)
+        result["failures"] = get_failures(failed_results)
+        if failed_results:
+            result["status"] = BatchStatus.FAILING
+
+        batch_result.get(timeout=0.1, propagate=False)
         # print(f"task_result: {task_result}")
         result_id_list = [result.id for result in batch_result.results]
 
@@ -0,0 +1,180 @@
+import json
+import struct
+import numpy as np
+from pathlib import Path
+
+GLB_MAGIC = 0x46546C67  # b"glTF"
+GLB_VERSION = 2
+CHUNK_JSON = 0x4E4F534A  # b"JSON"
+CHUNK_BIN = 0x004E4942  # b"BIN\0"
+
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+COMPONENT_TYPES = {
+    5120: np.int8,
+    5121: np.uint8,
+    5122: np.int16,
+    5123: np.uint16,
+    5125: np.uint32,
+    5126: np.float32,
+}
+
+ACCESSOR_SIZES = {
+    "SCALAR": 1,
+    "VEC2": 2,
+    "VEC3": 3,
+    "VEC4": 4,
+    "MAT4": 16,
+}
+
+
+def get_component_type(dtype) -> int:
+    """ Return the glTF component type for a numpy dtype """
+    for component_type, component_dtype in COMPONENT_TYPES.items():
+        if np.dtype(component_dtype) == np.dtype(dtype):
+            return component_type
+    raise ValueError(f"Unsupported accessor dtype: {dtype}")
+
+
+def get_accessor_type(size: int) -> str:
+    """ Return the glTF accessor type for the number of components per element """
+    for accessor_type, accessor_size in ACCESSOR_SIZES.items():
+        if accessor_size == size:
+            return accessor_type
+    raise ValueError(f"Unsupported accessor size: {size}")
+
+
+def pad(data: bytes, fill: bytes = b"\x00") -> bytes:
+    """ Pad the data to a 4 byte boundary """
+    remainder = len(data) % 4
+    if remainder:
+        data += fill * (4 - remainder)
+    return data
+
+
+class GlbBuilder():
+    """ Accumulate glTF json and a single binary buffer for a GLB file """
+
+    def __init__(self, generator: str = "Shaderverse"):
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": generator},
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "nodes": [],
+            "meshes": [],
+            "materials": [],
+            "textures": [],
+            "images": [],
+            "samplers": [],
+            "accessors": [],
+            "bufferViews": [],
+            "buffers": [],
+        }
+        self.chunks: list[bytes] = []
+        self.byte_length = 0
+
+    def add_buffer_view(self, data: bytes, target: int = None) -> int:
+        """ Append raw bytes to the binary chunk and return the buffer view index """
+        buffer_view = {"buffer": 0, "byteOffset": self.byte_length, "byteLength": len(data)}
+        if target is not None:
+            buffer_view["target"] = target
+        padded = pad(data)
+        self.chunks.append(padded)
+        self.byte_length += len(padded)
+        self.gltf["bufferViews"].append(buffer_view)
+        return len(self.gltf["bufferViews"]) - 1
+
+    def add_accessor(self, array: np.ndarray, target: int = None, with_bounds: bool = False, normalized: bool = False) -> int:
+        """ Append a numpy array as an accessor and return its index """
+        array = np.ascontiguousarray(array)
+        size = 1 if array.ndim == 1 else array.shape[1]
+        buffer_view = self.add_buffer_view(array.tobytes(), target)
+        accessor = {
+            "bufferView": buffer_view,
+            "componentType": get_component_type(array.dtype),
+            "count": int(array.shape[0]),
+            "type": get_accessor_type(size),
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if with_bounds and len(array):
+            bounds = array.reshape(len(array), size)
+            accessor["min"] = bounds.min(axis=0).tolist()
+            accessor["max"] = bounds.max(axis=0).tolist()
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"]) - 1
+
+    def build(self) -> tuple[dict, bytes]:
+        """ Return the finished gltf json and binary chunk, dropping empty top level arrays """
+        binary = b"".join(self.chunks)
+        gltf = dict(self.gltf)
+        if binary:
+            gltf["buffers"] = [{"byteLength": len(binary)}]
+        for key in ("meshes", "materials", "textures", "images", "samplers", "accessors", "bufferViews", "buffers"):
+            if not gltf[key]:
+                del gltf[key]
+        return gltf, binary
+
+
+def pack_glb(gltf: dict, binary: bytes = b"") -> bytes:
+    """ Pack the gltf json and binary chunk into a GLB container """
+    json_chunk = pad(json.dumps(gltf, separators=(",", ":")).encode("utf-8"), b" ")
+    chunks = struct.pack("<II", len(json_chunk), CHUNK_JSON) + json_chunk
+    if binary:
+        binary = pad(binary)
+        chunks += struct.pack("<II", len(binary), CHUNK_BIN) + binary
+    header = struct.pack("<III", GLB_MAGIC, GLB_VERSION, 12 + len(chunks))
+    return header + chunks
+
+
+def unpack_glb(data: bytes) -> tuple[dict, bytes]:
+    """ Split a GLB container into the gltf json and binary chunk """
+    magic, version, length = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC or version != GLB_VERSION:
+        raise ValueError("Not a glTF 2.0 binary file")
+    gltf = None
+    binary = b""
+    offset = 12
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + 8:offset + 8 + chunk_length]
+        if chunk_type == CHUNK_JSON:
+            gltf = json.loads(chunk.decode("utf-8"))
+        elif chunk_type == CHUNK_BIN:
+            binary = bytes(chunk)
+        offset += 8 + chunk_length
+    if gltf is None:
+        raise ValueError("GLB file has no JSON chunk")
+    return gltf, binary
+
+
+def write_glb(filepath: str, gltf: dict, binary: bytes = b""):
+    """ Write a GLB file """
+    Path(filepath).write_bytes(pack_glb(gltf, binary))
+
+
+def read_glb(filepath: str) -> tuple[dict, bytes]:
+    """ Read a GLB file """
+    return unpack_glb(Path(filepath).read_bytes())
+
+
+def read_accessor(gltf: dict, binary: bytes, accessor_index: int) -> np.ndarray:
+    """ Read an accessor into a numpy array of shape (count, size) """
+    accessor = gltf["accessors"][accessor_index]
+    dtype = np.dtype(COMPONENT_TYPES[accessor["componentType"]])
+    size = ACCESSOR_SIZES[accessor["type"]]
+    count = accessor["count"]
+    if "bufferView" not in accessor:
+        return np.zeros((count, size), dtype=dtype)
+    buffer_view = gltf["bufferViews"][accessor["bufferView"]]
+    offset = buffer_view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    element_size = dtype.itemsize * size
+    stride = buffer_view.get("byteStride", element_size)
+    if stride == element_size:
+        array = np.frombuffer(binary, dtype=dtype, count=count * size, offset=offset)
+        return array.reshape(count, size).copy()
+    if count < 1:
+        return np.zeros((0, size), dtype=dtype)
+    raw = np.frombuffer(binary, dtype=np.uint8, count=stride * (count - 1) + element_size, offset=offset)
+    return np.ndarray(shape=(count, size), dtype=dtype, buffer=raw, strides=(stride, dtype.itemsize)).copy()
@@ -0,0 +1,313 @@
+import bpy
+import numpy as np
+from pathlib import Path
+from shaderverse.api import metrics
+from .glb import GlbBuilder, write_glb, ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER
+
+SUPPORTED_OBJECT_TYPES = {"MESH", "EMPTY"}
+IMAGE_MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+}
+
+# Blender is Z-up, glTF is Y-up
+AXIS_CONVERSION = np.array([
+    [1.0, 0.0, 0.0],
+    [0.0, 0.0, 1.0],
+    [0.0, -1.0, 0.0],
+], dtype=np.float32)
+
+
+class UnsupportedSceneError(Exception):
+    """ Raised when the scene uses features the native GLB writer does not cover """
+
+
+def get_exportable_objects() -> list[bpy.types.Object]:
+    """ Return the visible, renderable objects the glTF exporter would pick up """
+    objects = []
+    for obj in bpy.context.view_layer.objects:
+        if obj.visible_get() and not obj.hide_render:
+            objects.append(obj)
+    return objects
+
+
+def get_principled_node(material: bpy.types.Material):
+    """ Return the Principled BSDF node feeding the material output, if any """
+    output = material.node_tree.get_output_node("ALL")
+    if output is None or not output.inputs["Surface"].is_linked:
+        return None
+    node = output.inputs["Surface"].links[0].from_node
+    if node.type != "BSDF_PRINCIPLED":
+        return None
+    return node
+
+
+def get_base_color_image(principled) -> bpy.types.Image | None:
+    """ Return the image driving the base color of a Principled BSDF node, if any """
+    base_color = principled.inputs["Base Color"]
+    if not base_color.is_linked:
+        return None
+    node = base_color.links[0].from_node
+    if node.type != "TEX_IMAGE" or node.image is None:
+        return None
+    return node.image
+
+
+def get_input(node, *names: str):
+    """ Return the first input found by name, inputs were renamed between Blender versions """
+    return next((node.inputs[name] for name in names if name in node.inputs), None)
+
+
+def has_emission(principled) -> bool:
+    color = get_input(principled, "Emission Color", "Emission")
+    strength = get_input(principled, "Emission Strength")
+    if color is None:
+        return False
+    return max(color.default_value[:3]) * (strength.default_value if strength is not None else 1.0) > 0.0
+
+
+def check_material(material: bpy.types.Material):
+    """ Raise if the material needs more than base color, metallic and roughness """
+    if material is None or not material.use_nodes:
+        return
+    principled = get_principled_node(material)
+    if principled is None:
+        raise UnsupportedSceneError(f"Material {material.name} does not use a Principled BSDF")
+    for socket in principled.inputs:
+        if not socket.is_linked:
+            continue
+        if socket.name != "Base Color" or get_base_color_image(principled) is None:
+            raise UnsupportedSceneError(f"Material {material.name} has a linked {socket.name} input")
+    if has_emission(principled):
+        raise UnsupportedSceneError(f"Material {material.name} is emissive")
+    alpha = get_input(principled, "Alpha")
+    if alpha is not None and alpha.default_value < 1.0:
+        raise UnsupportedSceneError(f"Material {material.name} is transparent")
+    image = get_base_color_image(principled)
+    if image is not None:
+        check_image(image)
+
+
+def check_image(image: bpy.types.Image):
+    """ Raise if the image can't be embedded as is """
+    if image.file_format not in IMAGE_MIME_TYPES:
+        raise UnsupportedSceneError(f"Image {image.name} is {image.file_format}")
+    if image.packed_file is None and not Path(bpy.path.abspath(image.filepath_raw)).is_file():
+        raise UnsupportedSceneError(f"Image {image.name} has no readable source file")
+
+
+def check_scene(objects: list[bpy.types.Object]):
+    """ Raise UnsupportedSceneError if the objects can't be written by the native writer """
+    if len(objects) < 1:
+        raise UnsupportedSceneError("No visible objects to export")
+    for obj in objects:
+        if obj.type not in SUPPORTED_OBJECT_TYPES:
+            raise UnsupportedSceneError(f"{obj.name} is a {obj.type} object")
+        if obj.animation_data and obj.animation_data.action:
+            raise UnsupportedSceneError(f"{obj.name} is animated")
+        # only meshes are written, an instancer would be dropped with what it instances
+        if obj.instance_type != "NONE":
+            raise UnsupportedSceneError(f"{obj.name} instances {obj.instance_type.lower()}")
+        if obj.type != "MESH":
+            continue
+        if obj.data.shape_keys:
+            raise UnsupportedSceneError(f"{obj.name} has shape keys")
+        if len(getattr(obj.data, "color_attributes", None) or getattr(obj.data, "vertex_colors", ())) > 0:
+            raise UnsupportedSceneError(f"{obj.name} has color attributes")
+        for modifier in obj.modifiers:
+            if modifier.type == "ARMATURE":
+                raise UnsupportedSceneError(f"{obj.name} is skinned")
+        for slot in obj.material_slots:
+            check_material(slot.material)
+
+
+def get_corner_normals(mesh: bpy.types.Mesh, loop_count: int) -> np.ndarray:
+    """ Read the per corner normals of a mesh """
+    normals = np.empty(loop_count * 3, dtype=np.float32)
+    if hasattr(mesh, "corner_normals"):
+        mesh.corner_normals.foreach_get("vector", normals)
+    else:
+        mesh.calc_normals_split()
+        mesh.loops.foreach_get("normal", normals)
+    return normals.reshape(loop_count, 3)
+
+
+def get_corner_uvs(mesh: bpy.types.Mesh, loop_count: int) -> np.ndarray | None:
+    """ Read the active UV map of a mesh with V flipped for glTF """
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is None:
+        return None
+    uvs = np.empty(loop_count * 2, dtype=np.float32)
+    uv_layer.data.foreach_get("uv", uvs)
+    uvs = uvs.reshape(loop_count, 2)
+    uvs[:, 1] = 1.0 - uvs[:, 1]
+    return uvs
+
+
+class GlbWriter():
+    """ Write realized, non-animated scenes to GLB without the glTF exporter add-on
+
+    Vertex, normal, UV and index data are read with foreach_get into numpy buffers and
+    written to the binary chunk directly. Materials and images are deduplicated by datablock.
+    Scenes that need anything else raise UnsupportedSceneError so the caller can fall back
+    to bpy.ops.export_scene.gltf.
+    """
+
+    def __init__(self, export_materials: bool = True):
+        self.export_materials = export_materials
+        self.builder = GlbBuilder(generator="Shaderverse native GLB writer")
+        self.material_indices: dict[str, int] = {}
+        self.image_indices: dict[str, int] = {}
+
+    def write(self, filepath: str, objects: list[bpy.types.Object] = None):
+        """ Write the objects, or every exportable object, to a GLB file """
+        if objects is None:
+            objects = get_exportable_objects()
+        check_scene(objects)
+
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        for obj in objects:
+            if obj.type == "MESH":
+                self.add_object(obj.evaluated_get(depsgraph))
+
+        gltf, binary = self.builder.build()
+        with metrics.stage("file_write"):
+            write_glb(filepath, gltf, binary)
+
+    def add_object(self, obj_eval: bpy.types.Object):
+        """ Bake the world transform of an evaluated object into a new mesh and node """
+        mesh = obj_eval.to_mesh()
+        try:
+            primitives = self.get_primitives(obj_eval, mesh)
+        finally:
+            obj_eval.to_mesh_clear()
+
+        if len(primitives) < 1:
+            return
+        gltf = self.builder.gltf
+        gltf["meshes"].append({"name": obj_eval.name, "primitives": primitives})
+        gltf["nodes"].append({"name": obj_eval.name, "mesh": len(gltf["meshes"]) - 1})
+        gltf["scenes"][0]["nodes"].append(len(gltf["nodes"]) - 1)
+
+    def get_primitives(self, obj_eval: bpy.types.Object, mesh: bpy.types.Mesh, matrix: np.ndarray = None) -> list[dict]:
+        """ Build one primitive per material index used by the mesh, baking in the world transform unless a matrix is given """
+        mesh.calc_loop_triangles()
+        triangle_count = len(mesh.loop_triangles)
+        if triangle_count < 1:
+            return []
+        vertex_count = len(mesh.vertices)
+        loop_count = len(mesh.loops)
+
+        triangle_loops = np.empty(triangle_count * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("loops", triangle_loops)
+        triangle_materials = np.empty(triangle_count, dtype=np.int32)
+        mesh.loop_triangles.foreach_get("material_index", triangle_materials)
+
+        positions = np.empty(vertex_count * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", positions)
+        loop_vertices = np.empty(loop_count, dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vertices)
+        normals = get_corner_normals(mesh, loop_count)
+        uvs = get_corner_uvs(mesh, loop_count)
+
+        if matrix is None:
+            matrix = np.array(obj_eval.matrix_world, dtype=np.float32)
+        rotation = AXIS_CONVERSION @ matrix[:3, :3]
+        translation = AXIS_CONVERSION @ matrix[:3, 3]
+        normal_matrix = AXIS_CONVERSION @ np.linalg.inv(matrix[:3, :3]).T
+
+        loop_positions = positions.reshape(vertex_count, 3)[loop_vertices] @ rotation.T + translation
+        loop_normals = normals @ normal_matrix.T
+        lengths = np.linalg.norm(loop_normals, axis=1, keepdims=True)
+        loop_normals /= np.where(lengths > 0, lengths, 1.0)
+
+        columns = [loop_positions, loop_normals]
+        if uvs is not None:
+            columns.append(uvs)
+        corners = np.hstack(columns).astype(np.float32)
+
+        triangles = triangle_loops.reshape(triangle_count, 3)
+        if np.linalg.det(matrix[:3, :3]) < 0:
+            triangles = triangles[:, ::-1]
+
+        primitives = []
+        for material_index in np.unique(triangle_materials):
+            primitive_loops = triangles[triangle_materials == material_index].reshape(-1)
+            vertices, indices = np.unique(corners[primitive_loops], axis=0, return_inverse=True)
+            primitive = self.add_primitive(vertices, indices.reshape(-1), uvs is not None)
+            material = self.get_material(obj_eval, int(material_index))
+            if material is not None:
+                primitive["material"] = material
+            primitives.append(primitive)
+        return primitives
+
+    def add_primitive(self, vertices: np.ndarray, indices: np.ndarray, has_uvs: bool) -> dict:
+        """ Write the vertex and index buffers of a primitive """
+        builder = self.builder
+        attributes = {
+            "POSITION": builder.add_accessor(vertices[:, 0:3], ARRAY_BUFFER, with_bounds=True),
+            "NORMAL": builder.add_accessor(vertices[:, 3:6], ARRAY_BUFFER),
+        }
+        if has_uvs:
+            attributes["TEXCOORD_0"] = builder.add_accessor(vertices[:, 6:8], ARRAY_BUFFER)
+
+        index_dtype = np.uint16 if len(vertices) < 65536 else np.uint32
+        return {
+            "attributes": attributes,
+            "indices": builder.add_accessor(indices.astype(index_dtype), ELEMENT_ARRAY_BUFFER),
+            "mode": 4,
+        }
+
+    def get_material(self, obj_eval: bpy.types.Object, material_index: int) -> int | None:
+        """ Return the glTF index of a material slot, adding the material the first time it is seen """
+        if not self.export_materials or material_index >= len(obj_eval.material_slots):
+            return None
+        material = obj_eval.material_slots[material_index].material
+        if material is None:
+            return None
+        key = material.name_full
+        if key not in self.material_indices:
+            self.builder.gltf["materials"].append(self.get_material_data(material))
+            self.material_indices[key] = len(self.builder.gltf["materials"]) - 1
+        return self.material_indices[key]
+
+    def get_material_data(self, material: bpy.types.Material) -> dict:
+        """ Convert a Principled BSDF material to a glTF metallic roughness material """
+        pbr = {
+            "baseColorFactor": list(material.diffuse_color),
+            "metallicFactor": material.metallic,
+            "roughnessFactor": material.roughness,
+        }
+        principled = get_principled_node(material) if material.use_nodes else None
+        if principled is not None:
+            image = get_base_color_image(principled)
+            if image is None:
+                pbr["baseColorFactor"] = list(principled.inputs["Base Color"].default_value)
+            else:
+                pbr["baseColorFactor"] = [1.0, 1.0, 1.0, 1.0]
+                pbr["baseColorTexture"] = {"index": self.get_texture(image)}
+            pbr["metallicFactor"] = principled.inputs["Metallic"].default_value
+            pbr["roughnessFactor"] = principled.inputs["Roughness"].default_value
+
+        return {
+            "name": material.name,
+            "pbrMetallicRoughness": pbr,
+            "doubleSided": not material.use_backface_culling,
+        }
+
+    def get_texture(self, image: bpy.types.Image) -> int:
+        """ Return the glTF texture index of an image, embedding it the first time it is seen """
+        gltf = self.builder.gltf
+        key = image.name_full
+        if key not in self.image_indices:
+            if image.packed_file is not None:
+                data = image.packed_file.data
+            else:
+                data = Path(bpy.path.abspath(image.filepath_raw)).read_bytes()
+            buffer_view = self.builder.add_buffer_view(data)
+            gltf["images"].append({"name": image.name, "bufferView": buffer_view, "mimeType": IMAGE_MIME_TYPES[image.file_format]})
+            if not gltf["samplers"]:
+                gltf["samplers"].append({"magFilter": 9729, "minFilter": 9987, "wrapS": 10497, "wrapT": 10497})
+            gltf["textures"].append({"sampler": 0, "source": len(gltf["images"]) - 1})
+            self.image_indices[key] = len(gltf["textures"]) - 1
+        return self.image_indices[key]
@@ -0,0 +1,364 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from pathlib import Path
+from shaderverse.api.model import Compression, OptimizationProfile, OptimizationResult
+from .glb import read_glb, write_glb, read_accessor, pad, get_component_type, ARRAY_BUFFER
+
+GLTFPACK_PATH = os.environ.get("GLTFPACK_PATH", "gltfpack")
+GLTF_TRANSFORM_PATH = os.environ.get("GLTF_TRANSFORM_PATH", "gltf-transform")
+
+# extensions that store their data in buffer views the optimizer does not know about
+COMPRESSED_EXTENSIONS = {"KHR_draco_mesh_compression", "EXT_meshopt_compression", "KHR_texture_basisu"}
+
+QUANTIZATION_EXTENSION = "KHR_mesh_quantization"
+
+
+class GlbDocument():
+    """ A GLB file held as gltf json plus one bytes object per buffer view """
+
+    def __init__(self, gltf: dict, binary: bytes):
+        self.gltf = gltf
+        self.view_data: list[bytes] = []
+        for buffer_view in gltf.get("bufferViews", []):
+            offset = buffer_view.get("byteOffset", 0)
+            self.view_data.append(binary[offset:offset + buffer_view["byteLength"]])
+
+    def read(self, accessor_index: int) -> np.ndarray:
+        """ Read an accessor into a numpy array of shape (count, size) """
+        accessor = self.gltf["accessors"][accessor_index]
+        if "bufferView" not in accessor:
+            return read_accessor({"accessors": [accessor]}, b"", 0)
+        view_index = accessor["bufferView"]
+        buffer_view = dict(self.gltf["bufferViews"][view_index], byteOffset=0)
+        local_gltf = {"accessors": [dict(accessor, bufferView=0)], "bufferViews": [buffer_view]}
+        return read_accessor(local_gltf, self.view_data[view_index], 0)
+
+    def write(self, accessor_index: int, array: np.ndarray, accessor_type: str, normalized: bool = False, target: int = None):
+        """ Replace the data of an accessor, padding each element to a 4 byte boundary for vertex attributes """
+        array = np.ascontiguousarray(array)
+        buffer_view = {"buffer": 0, "byteLength": array.nbytes}
+        if target is not None:
+            buffer_view["target"] = target
+        if target == ARRAY_BUFFER:
+            buffer_view["byteStride"] = array.itemsize * array.shape[1]
+        self.gltf.setdefault("bufferViews", []).append(buffer_view)
+        self.view_data.append(array.tobytes())
+
+        accessor = self.gltf["accessors"][accessor_index]
+        accessor.pop("byteOffset", None)
+        accessor["bufferView"] = len(self.gltf["bufferViews"]) - 1
+        accessor["componentType"] = get_component_type(array.dtype)
+        accessor["count"] = int(array.shape[0])
+        accessor["type"] = accessor_type
+        if normalized:
+            accessor["normalized"] = True
+        else:
+            accessor.pop("normalized", None)
+
+    def get_accessor_references(self) -> list[tuple[dict, str]]:
+        """ Return every (container, key) pair that holds an accessor index """
+        references = []
+        for mesh in self.gltf.get("meshes", []):
+            for primitive in mesh["primitives"]:
+                attributes = primitive["attributes"]
+                references += [(attributes, key) for key in attributes]
+                if "indices" in primitive:
+                    references.append((primitive, "indices"))
+                for target in primitive.get("targets", []):
+                    references += [(target, key) for key in target]
+        for skin in self.gltf.get("skins", []):
+            if "inverseBindMatrices" in skin:
+                references.append((skin, "inverseBindMatrices"))
+        for animation in self.gltf.get("animations", []):
+            for sampler in animation["samplers"]:
+                references += [(sampler, "input"), (sampler, "output")]
+        return references
+
+    def remove_unused_accessors(self):
+        """ Drop accessors nothing refers to and renumber the rest """
+        references = self.get_accessor_references()
+        used = sorted({container[key] for container, key in references})
+        remap = {old: new for new, old in enumerate(used)}
+        for container, key in references:
+            container[key] = remap[container[key]]
+        self.gltf["accessors"] = [self.gltf["accessors"][index] for index in used]
+
+    def get_used_buffer_views(self) -> set[int]:
+        """ Return the buffer views referenced by accessors and images """
+        used = set()
+        for accessor in self.gltf.get("accessors", []):
+            if "bufferView" in accessor:
+                used.add(accessor["bufferView"])
+            sparse = accessor.get("sparse")
+            if sparse:
+                used.add(sparse["indices"]["bufferView"])
+                used.add(sparse["values"]["bufferView"])
+        for image in self.gltf.get("images", []):
+            if "bufferView" in image:
+                used.add(image["bufferView"])
+        return used
+
+    def build(self) -> tuple[dict, bytes]:
+        """ Repack the used buffer views into a single binary chunk """
+        used = sorted(self.get_used_buffer_views())
+        remap = {old: new for new, old in enumerate(used)}
+        buffer_views = []
+        chunks = []
+        byte_length = 0
+        for index in used:
+            buffer_view = dict(self.gltf["bufferViews"][index], buffer=0, byteOffset=byte_length)
+            data = pad(self.view_data[index])
+            buffer_views.append(buffer_view)
+            chunks.append(data)
+            byte_length += len(data)
+
+        for accessor in self.gltf.get("accessors", []):
+            if "bufferView" in accessor:
+                accessor["bufferView"] = remap[accessor["bufferView"]]
+            sparse = accessor.get("sparse")
+            if sparse:
+                sparse["indices"]["bufferView"] = remap[sparse["indices"]["bufferView"]]
+                sparse["values"]["bufferView"] = remap[sparse["values"]["bufferView"]]
+        for image in self.gltf.get("images", []):
+            if "bufferView" in image:
+                image["bufferView"] = remap[image["bufferView"]]
+
+        gltf = dict(self.gltf, bufferViews=buffer_views)
+        gltf["buffers"] = [{"byteLength": byte_length}]
+        if not buffer_views:
+            del gltf["bufferViews"]
+            del gltf["buffers"]
+        return gltf, b"".join(chunks)
+
+    def add_extension(self, name: str, required: bool = False):
+        extensions_used = self.gltf.setdefault("extensionsUsed", [])
+        if name not in extensions_used:
+            extensions_used.append(name)
+        if required:
+            extensions_required = self.gltf.setdefault("extensionsRequired", [])
+            if name not in extensions_required:
+                extensions_required.append(name)
+
+
+def get_position_meshes(gltf: dict) -> dict[int, set[int]]:
+    """ The meshes reading each POSITION accessor """
+    meshes: dict[int, set[int]] = {}
+    for mesh_index, mesh in enumerate(gltf.get("meshes", [])):
+        for primitive in mesh["primitives"]:
+            meshes.setdefault(primitive["attributes"]["POSITION"], set()).add(mesh_index)
+    return meshes
+
+
+def dedup_accessors(document: GlbDocument, separate_positions: bool = False) -> int:
+    """ Point references to identical accessors at a single copy and return the number removed
+
+    With separate_positions, positions are only shared within a mesh, since each mesh gets its own
+    dequantization transform.
+    """
+    gltf = document.gltf
+    position_meshes = get_position_meshes(gltf) if separate_positions else {}
+    first_index: dict[tuple, int] = {}
+    duplicates: dict[int, int] = {}
+    for index, accessor in enumerate(gltf.get("accessors", [])):
+        if "sparse" in accessor:
+            continue
+        data = document.read(index)
+        key = (accessor["componentType"], accessor["type"], accessor.get("normalized", False), data.tobytes(), tuple(sorted(position_meshes.get(index, ()))))
+        if key in first_index:
+            duplicates[index] = first_index[key]
+        else:
+            first_index[key] = index
+
+    for container, key in document.get_accessor_references():
+        container[key] = duplicates.get(container[key], container[key])
+    document.remove_unused_accessors()
+    return len(duplicates)
+
+
+def quantize_normals(document: GlbDocument, accessor_index: int):
+    """ Store unit normals as normalized bytes """
+    normals = document.read(accessor_index).astype(np.float32)
+    quantized = np.zeros((len(normals), 4), dtype=np.int8)
+    quantized[:, :3] = np.clip(np.round(normals * 127.0), -127, 127)
+    document.write(accessor_index, quantized, "VEC3", normalized=True, target=ARRAY_BUFFER)
+
+
+def quantize_texcoords(document: GlbDocument, accessor_index: int) -> bool:
+    """ Store texture coordinates in the unit square as normalized unsigned shorts """
+    texcoords = document.read(accessor_index).astype(np.float32)
+    if len(texcoords) and (texcoords.min() < 0.0 or texcoords.max() > 1.0):
+        return False
+    quantized = np.round(texcoords * 65535.0).astype(np.uint16)
+    document.write(accessor_index, quantized, "VEC2", normalized=True, target=ARRAY_BUFFER)
+    return True
+
+
+def quantize_positions(document: GlbDocument, mesh_index: int, skipped: set[int]) -> bool:
+    """ Store the positions of a static mesh as shorts and move the dequantization into a child node
+
+    Meshes with a POSITION accessor in skipped, already quantized or shared with another mesh, are left alone.
+    """
+    gltf = document.gltf
+    primitives = gltf["meshes"][mesh_index]["primitives"]
+    if any("targets" in primitive for primitive in primitives):
+        return False
+    if any(primitive["attributes"]["POSITION"] in skipped or gltf["accessors"][primitive["attributes"]["POSITION"]]["componentType"] != 5126
+           for primitive in primitives):
+        return False
+    nodes = [node for node in gltf.get("nodes", []) if node.get("mesh") == mesh_index]
+    if any("skin" in node for node in nodes):
+        return False
+
+    accessor_indices = sorted({primitive["attributes"]["POSITION"] for primitive in primitives})
+    positions = {index: document.read(index).astype(np.float64) for index in accessor_indices}
+    all_positions = np.vstack(list(positions.values()))
+    if len(all_positions) < 1:
+        return False
+    low = all_positions.min(axis=0)
+    high = all_positions.max(axis=0)
+    center = (low + high) / 2.0
+    extent = max(float((high - low).max()) / 2.0, 1e-8)
+    scale = extent / 32767.0
+
+    for index, values in positions.items():
+        quantized = np.zeros((len(values), 4), dtype=np.int16)
+        quantized[:, :3] = np.clip(np.round((values - center) / scale), -32767, 32767)
+        document.write(index, quantized, "VEC3", target=ARRAY_BUFFER)
+        accessor = gltf["accessors"][index]
+        accessor["min"] = quantized[:, :3].min(axis=0).tolist()
+        accessor["max"] = quantized[:, :3].max(axis=0).tolist()
+
+    for node in nodes:
+        del node["mesh"]
+        gltf["nodes"].append({
+            "name": node.get("name", ""),
+            "mesh": mesh_index,
+            "translation": center.tolist(),
+            "scale": [scale, scale, scale],
+        })
+        node.setdefault("children", []).append(len(gltf["nodes"]) - 1)
+    return True
+
+
+def quantize_attributes(document: GlbDocument) -> int:
+    """ Quantize positions, normals and texture coordinates with KHR_mesh_quantization """
+    gltf = document.gltf
+    quantized = set()
+    shared = {index for index, meshes in get_position_meshes(gltf).items() if len(meshes) > 1}
+    for mesh_index, mesh in enumerate(gltf.get("meshes", [])):
+        if quantize_positions(document, mesh_index, quantized | shared):
+            quantized.update(primitive["attributes"]["POSITION"] for primitive in mesh["primitives"])
+        for primitive in mesh["primitives"]:
+            for key, accessor_index in primitive["attributes"].items():
+                if accessor_index in quantized or gltf["accessors"][accessor_index]["componentType"] != 5126:
+                    continue
+                if key == "NORMAL":
+                    quantize_normals(document, accessor_index)
+                    quantized.add(accessor_index)
+                elif key.startswith("TEXCOORD_") and quantize_texcoords(document, accessor_index):
+                    quantized.add(accessor_index)
+    if quantized:
+        document.add_extension(QUANTIZATION_EXTENSION, required=True)
+    return len(quantized)
+
+
+def downscale_textures(document: GlbDocument, max_texture_size: int) -> int:
+    """ Downscale embedded images larger than max_texture_size and return the number resized """
+    from PIL import Image
+
+    resized = 0
+    for image in document.gltf.get("images", []):
+        if "bufferView" not in image:
+            continue
+        data = document.view_data[image["bufferView"]]
+        with Image.open(io.BytesIO(data)) as source:
+            if max(source.size) <= max_texture_size:
+                continue
+            image_format = source.format
+            target = source.copy()
+        target.thumbnail((max_texture_size, max_texture_size))
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            target.convert("RGB").save(output, format="JPEG", quality=90)
+        else:
+            target.save(output, format="PNG", optimize=True)
+        document.view_data[image["bufferView"]] = output.getvalue()
+        document.gltf["bufferViews"][image["bufferView"]]["byteLength"] = len(output.getvalue())
+        resized += 1
+    return resized
+
+
+def get_compression_command(compression: Compression, source: str, destination: str, quantize: bool) -> list[str] | None:
+    """ Return the command line for an external compressor, or None if it is not installed """
+    if compression == Compression.meshopt:
+        executable = shutil.which(GLTFPACK_PATH)
+        if executable is None:
+            return None
+        cmd = [executable, "-i", source, "-o", destination, "-c", "-kn", "-km"]
+        if not quantize:
+            cmd.append("-noq")
+        return cmd
+    if compression == Compression.draco:
+        executable = shutil.which(GLTF_TRANSFORM_PATH)
+        if executable is None:
+            return None
+        return [executable, "draco", source, destination]
+    return None
+
+
+def compress(filepath: str, profile: OptimizationProfile, result: OptimizationResult):
+    """ Compress the file in place with gltfpack (meshopt) or gltf-transform (Draco) """
+    temp_file = f"{filepath}.{profile.compression.value}.glb"
+    cmd = get_compression_command(profile.compression, filepath, temp_file, profile.quantize)
+    if cmd is None:
+        result.warnings.append(f"No {profile.compression.value} compressor installed, skipping compression")
+        return
+    completed = subprocess.run(cmd, capture_output=True)
+    if completed.returncode != 0 or not Path(temp_file).exists():
+        result.warnings.append(f"{profile.compression.value} compression failed: {completed.stderr.decode().strip()}")
+        Path(temp_file).unlink(missing_ok=True)
+        return
+    os.replace(temp_file, filepath)
+    result.applied.append(f"compression:{profile.compression.value}")
+    if profile.quantize:
+        result.applied.append("quantize")
+
+
+def optimize_glb(filepath: str, profile: OptimizationProfile) -> OptimizationResult:
+    """ Optimize a GLB file in place according to the profile """
+    result = OptimizationResult(original_size=Path(filepath).stat().st_size, optimized_size=0)
+    gltf, binary = read_glb(filepath)
+
+    if COMPRESSED_EXTENSIONS.intersection(gltf.get("extensionsUsed", [])):
+        result.warnings.append("File is already compressed, skipping optimization")
+        result.optimized_size = result.original_size
+        return result
+
+    document = GlbDocument(gltf, binary)
+    if profile.dedup_accessors:
+        removed = dedup_accessors(document, separate_positions=profile.quantize and profile.compression == Compression.none)
+        result.applied.append(f"dedup_accessors:{removed}")
+    if profile.quantize and profile.compression == Compression.none:
+        count = quantize_attributes(document)
+        result.applied.append(f"quantize:{count}")
+    if profile.max_texture_size > 0:
+        try:
+            count = downscale_textures(document, profile.max_texture_size)
+            result.applied.append(f"downscale_textures:{count}")
+        except ImportError:
+            result.warnings.append("Pillow is not installed, skipping texture downscale")
+
+    handle, temp_file = tempfile.mkstemp(suffix=".glb", dir=Path(filepath).parent)
+    os.close(handle)
+    write_glb(temp_file, *document.build())
+    os.replace(temp_file, filepath)
+
+    if profile.compression != Compression.none:
+        compress(filepath, profile, result)
+
+    result.optimized_size = Path(filepath).stat().st_size
+    return result
@@ -0,0 +1,83 @@
+import bpy
+import numpy as np
+from shaderverse.api import metrics
+from .glb import write_glb
+from .glb_writer import GlbWriter, UnsupportedSceneError, AXIS_CONVERSION, get_principled_node, get_base_color_image, check_image
+
+IDENTITY = np.identity(4, dtype=np.float32)
+
+
+def is_instance_visible(instance: bpy.types.DepsgraphObjectInstance) -> bool:
+    """ Check the object, or the object instancing it, is visible in the viewport and renderable """
+    source = instance.parent if instance.is_instance else instance.object
+    original = source.original
+    return original.visible_get() and not original.hide_render
+
+
+def get_node_matrix(matrix_world) -> list[float]:
+    """ Convert a Blender world matrix to a column major glTF node matrix """
+    conversion = np.identity(4, dtype=np.float32)
+    conversion[:3, :3] = AXIS_CONVERSION
+    matrix = conversion @ np.array(matrix_world, dtype=np.float32) @ conversion.T
+    return matrix.T.reshape(-1).tolist()
+
+
+class PreviewGlbWriter(GlbWriter):
+    """ Write the evaluated scene to GLB for the live preview, without realizing it first
+
+    Geometry node instances are read straight from the depsgraph, so each instanced mesh is
+    written once and placed by node matrices. Armature and shape key deformation is taken from
+    the evaluated mesh instead of being exported, and images are embedded as they are.
+    """
+
+    def __init__(self):
+        super().__init__(export_materials=True)
+        self.mesh_indices: dict[int, int] = {}
+
+    def write(self, filepath: str, objects: list[bpy.types.Object] = None):
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        for instance in depsgraph.object_instances:
+            if instance.object.type == "MESH" and is_instance_visible(instance):
+                self.add_instance(instance.object, instance.matrix_world.copy())
+
+        if len(self.builder.gltf["nodes"]) < 1:
+            raise UnsupportedSceneError("No visible objects to export")
+        gltf, binary = self.builder.build()
+        with metrics.stage("file_write"):
+            write_glb(filepath, gltf, binary)
+
+    def add_instance(self, obj_eval: bpy.types.Object, matrix_world):
+        """ Add a node for an evaluated object or instance, writing its mesh the first time it is seen """
+        gltf = self.builder.gltf
+        key = obj_eval.data.as_pointer()
+        if key not in self.mesh_indices:
+            mesh = obj_eval.to_mesh()
+            try:
+                primitives = self.get_primitives(obj_eval, mesh, IDENTITY)
+            finally:
+                obj_eval.to_mesh_clear()
+            if len(primitives) < 1:
+                self.mesh_indices[key] = None
+            else:
+                gltf["meshes"].append({"name": obj_eval.name, "primitives": primitives})
+                self.mesh_indices[key] = len(gltf["meshes"]) - 1
+
+        if self.mesh_indices[key] is None:
+            return
+        gltf["nodes"].append({"name": obj_eval.name, "mesh": self.mesh_indices[key], "matrix": get_node_matrix(matrix_world)})
+        gltf["scenes"][0]["nodes"].append(len(gltf["nodes"]) - 1)
+
+    def get_material_data(self, material: bpy.types.Material) -> dict:
+        """ Fall back to a flat color when the base color image can't be embedded as is """
+        principled = get_principled_node(material) if material.use_nodes else None
+        image = get_base_color_image(principled) if principled is not None else None
+        if image is not None:
+            try:
+                check_image(image)
+            except UnsupportedSceneError:
+                return {
+                    "name": material.name,
+                    "pbrMetallicRoughness": {"baseColorFactor": list(material.diffuse_color)},
+                    "doubleSided": not material.use_backface_culling,
+                }
+        return super().get_material_data(material)
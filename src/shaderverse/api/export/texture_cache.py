@@ -0,0 +1,146 @@
+import hashlib
+import os
+import shutil
+import bpy
+import numpy as np
+from pathlib import Path
+from shaderverse.api.utils import get_temporary_directory
+from shaderverse.api import metrics
+
+# formats exporters can embed without re-encoding
+PASSTHROUGH_FORMATS = {
+    "PNG": "png",
+    "JPEG": "jpg",
+}
+
+
+def get_blend_version() -> tuple[str, str]:
+    """ Return a key for the blend file path and one for its saved version """
+    filepath = bpy.data.filepath
+    path_key = hashlib.sha1(filepath.encode()).hexdigest()[:12]
+    if not filepath or not os.path.exists(filepath):
+        return path_key, "unsaved"
+    stat = os.stat(filepath)
+    version_key = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:12]
+    return path_key, version_key
+
+
+def is_cacheable(image: bpy.types.Image) -> bool:
+    """ Check whether an image is backed by a single packed or on-disk file
+
+    Float images in other formats would lose their range in an 8-bit PNG, they are left as they are.
+    """
+    if image.source != "FILE" or image.users < 1:
+        return False
+    if image.is_float and image.file_format not in PASSTHROUGH_FORMATS:
+        return False
+    if image.packed_file is not None:
+        return True
+    return Path(bpy.path.abspath(image.filepath_raw)).is_file()
+
+
+class TextureCache():
+    """ Unpacked and re-encoded textures stored once per blend version, keyed by content hash
+
+    Exports point image datablocks at the cached files instead of unpacking every packed
+    texture next to the blend file and re-encoding unsupported formats for every item.
+    """
+
+    def __init__(self, root: Path = None):
+        self.root = root or get_temporary_directory().joinpath("texture_cache")
+        self.version = None
+        self.directory: Path = None
+        self.file_hashes: dict[tuple, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def refresh_version(self):
+        """ Switch to the cache directory of the current blend version, pruning older versions of the same file """
+        path_key, version_key = get_blend_version()
+        version = f"{path_key}-{version_key}"
+        if version == self.version:
+            return
+        self.version = version
+        self.directory = self.root.joinpath(version)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.file_hashes = {}
+        for sibling in self.root.glob(f"{path_key}-*"):
+            if sibling != self.directory and version_key != "unsaved":
+                shutil.rmtree(sibling, ignore_errors=True)
+
+    def get_content_hash(self, image: bpy.types.Image) -> str:
+        """ Hash the packed data or source file of an image, once per blend version """
+        if image.packed_file is not None:
+            # packed data is reloaded with the file after every task but only changes with the blend version
+            key = (image.name, image.packed_file.size)
+            if key not in self.file_hashes:
+                self.file_hashes[key] = hashlib.sha1(image.packed_file.data).hexdigest()
+            return self.file_hashes[key]
+        filepath = Path(bpy.path.abspath(image.filepath_raw))
+        stat = filepath.stat()
+        key = (str(filepath), stat.st_mtime_ns, stat.st_size)
+        if key not in self.file_hashes:
+            self.file_hashes[key] = hashlib.sha1(filepath.read_bytes()).hexdigest()
+        return self.file_hashes[key]
+
+    def get_cached_file(self, image: bpy.types.Image) -> Path:
+        """ Return the cached file for an image, writing it on the first request """
+        content_hash = self.get_content_hash(image)
+        extension = PASSTHROUGH_FORMATS.get(image.file_format, "png")
+        cached_file = self.directory.joinpath(f"{content_hash}.{extension}")
+        if cached_file.exists():
+            self.hits += 1
+            metrics.increment("shaderverse_cache_requests_total", {"cache": "texture", "result": "hit"})
+            return cached_file
+
+        self.misses += 1
+        metrics.increment("shaderverse_cache_requests_total", {"cache": "texture", "result": "miss"})
+        # workers share the cache, so write to a private name and rename into place
+        temp_file = cached_file.with_name(f"{content_hash}.{os.getpid()}.{extension}")
+        if image.file_format not in PASSTHROUGH_FORMATS:
+            self.encode_png(image, temp_file)
+        elif image.packed_file is not None:
+            temp_file.write_bytes(image.packed_file.data)
+        else:
+            shutil.copyfile(bpy.path.abspath(image.filepath_raw), temp_file)
+        os.replace(temp_file, cached_file)
+        return cached_file
+
+    def encode_png(self, image: bpy.types.Image, filepath: Path):
+        """ Re-encode an image as PNG through a temporary datablock """
+        width, height = image.size
+        pixels = np.empty(width * height * 4, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+        temp_image = bpy.data.images.new(f"{image.name}_cache", width, height, alpha=True)
+        try:
+            temp_image.pixels.foreach_set(pixels)
+            temp_image.filepath_raw = str(filepath)
+            temp_image.file_format = "PNG"
+            temp_image.save()
+        finally:
+            bpy.data.images.remove(temp_image)
+
+    def apply(self):
+        """ Point every packed or file-backed image at its cached file """
+        self.refresh_version()
+        for image in bpy.data.images:
+            if not is_cacheable(image):
+                continue
+            cached_file = self.get_cached_file(image)
+            if image.packed_file is not None:
+                image.unpack(method="REMOVE")
+            image.filepath = str(cached_file)
+            # exporters pass the file through only when the format says it is already PNG
+            if image.file_format not in PASSTHROUGH_FORMATS:
+                image.file_format = "PNG"
+        print(f"texture cache: {self.hits} hits, {self.misses} misses")
+
+
+texture_cache: TextureCache = None
+
+def get_texture_cache() -> TextureCache:
+    """ Return the texture cache of this worker process """
+    global texture_cache
+    if texture_cache is None:
+        texture_cache = TextureCache()
+    return texture_cache
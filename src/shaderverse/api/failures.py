@@ -0,0 +1,74 @@
+import json
+import sqlite3
+import time
+from celery.signals import task_failure
+from shaderverse.api import metrics
+from shaderverse.api.batch_manifest import connect
+
+
+class PermanentError(Exception):
+    """ A task that would fail the same way however often it is retried """
+
+
+class RetryableError(Exception):
+    """ A task that failed because of its worker or machine and may succeed when retried """
+
+
+# a full disk, a locked database, a dead connection or a worker out of memory can pass, anything else
+# raised by the generator or an exporter comes from the item or the file and fails again on retry
+RETRYABLE_ERRORS = (RetryableError, OSError, MemoryError, TimeoutError, sqlite3.OperationalError)
+
+
+def is_permanent(exception: BaseException) -> bool:
+    return not isinstance(exception, RETRYABLE_ERRORS)
+
+
+def get_arguments(args, kwargs) -> str:
+    """ The arguments of a failed task, with the metadata of its item, as JSON """
+    return json.dumps({"args": list(args or ()), "kwargs": dict(kwargs or {})}, default=str)
+
+
+def record_dead_letter(task_id: str, task_name: str, exception: BaseException, traceback: str, args, kwargs, retries: int):
+    with connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO dead_letter VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task_id, task_name, type(exception).__name__, str(exception), traceback, get_arguments(args, kwargs),
+             int(is_permanent(exception)), retries, time.time()))
+
+
+def get_record(row: sqlite3.Row) -> dict:
+    record = dict(row)
+    record["arguments"] = json.loads(record["arguments"])
+    record["permanent"] = bool(record["permanent"])
+    return record
+
+
+def get_dead_letters(task_ids: list[str] = None, limit: int = 100) -> list[dict]:
+    """ The failed tasks with the given ids, or the latest ones, newest first """
+    with connect() as connection:
+        if task_ids is None:
+            rows = connection.execute("SELECT * FROM dead_letter ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = []
+            task_ids = list(task_ids)
+            # stay below SQLite's limit of host parameters per statement
+            for start in range(0, len(task_ids), 500):
+                chunk = task_ids[start:start + 500]
+                rows += connection.execute(
+                    f"SELECT * FROM dead_letter WHERE task_id IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            rows.sort(key=lambda row: -row["created_at"])
+    return [get_record(row) for row in rows]
+
+
+@task_failure.connect
+def handle_task_failure(sender=None, task_id=None, exception=None, args=None, kwargs=None, einfo=None, **kw):
+    """ Retries are over: keep the traceback and the arguments so the item can be looked at """
+    task_name = getattr(sender, "name", "none")
+    retries = getattr(getattr(sender, "request", None), "retries", 0) or 0
+    kind = "permanent" if is_permanent(exception) else "retries_exhausted"
+    print(f"Task {task_name} {task_id} failed ({kind}): {exception!r}")
+    metrics.increment("shaderverse_task_failures_total", {"task": task_name, "kind": kind})
+    try:
+        record_dead_letter(task_id, task_name, exception, str(einfo.traceback) if einfo else "", args, kwargs, retries)
+    except sqlite3.Error as e:
+        print(f"Could not record the dead letter: {e}")
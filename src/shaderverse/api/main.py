@@ -5,7 +5,7 @@ import json
 import requests
 from fastapi import Depends, FastAPI, File, BackgroundTasks, Request, Response, HTTPException
 from shaderverse.model import Metadata, Attribute, MetadataList, AttributeModel
-from shaderverse.api.model import SessionData, SessionStatus, RenderedFile
+from shaderverse.api.model import SessionData, SessionStatus, RenderedFile, OptimizationProfile, Priority, RarityReport, MetadataExportFormat
 from typing import Generator, List
 import tempfile
 import base64
@@ -16,8 +16,9 @@ from shaderverse import bl_info
 import bpy
 # import ray
 # from ray import serve
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.routing import APIRoute
+from fastapi.concurrency import run_in_threadpool
 
 from uuid import uuid4
 from pathlib import Path
@@ -28,10 +29,17 @@ sys.path.append(SCRIPT_PATH) # this is a hack to make the import work in Blender
 from celery.app import Proxy
 from config.celery_utils import create_celery
 from celery_tasks import tasks
-from config.celery_utils import get_task_info, get_batch_info
-from celery import group
+from config.celery_utils import get_task_info, get_batch_info, get_queue_depths, prioritize
+from celery import group, Signature
+from celery.exceptions import TimeoutError
 import logging
 from shaderverse.api.utils import get_temporary_directory
+from shaderverse.api import metrics, batch_manifest, failures
+from shaderverse.api.coalesce import inflight_renders, get_render_key
+from shaderverse.api.time_limits import get_format_time_limits
+from shaderverse.api.preview import preview_channel
+from shaderverse.api.metadata_export import export_batch_metadata, iter_completed, restore_batch, get_metadata, get_record
+from shaderverse.background import log_capture
 
 
 
@@ -139,10 +147,36 @@ async def shutdown_event():
 
 
 @app.post("/generate", response_class=JSONResponse, tags=["generator"])
-async def generate():
-    task = tasks.generate_task.apply_async()
+async def generate(id: int = None, profile: bool = False, priority: Priority = Priority.interactive):
+    task = prioritize(tasks.generate_task.s(id=id, should_profile=profile), priority).apply_async()
     return JSONResponse({"task_id": task.id})
 
+@app.get("/metadata/{item_id}", response_model=Metadata, tags=["generator"])
+def get_item_metadata(item_id: int, timeout: float = 60.0, priority: Priority = Priority.interactive):
+    """
+    Regenerate the metadata of a single item from the collection seed and its id, without generating the items before it
+    """
+    task = prioritize(tasks.generate_task.s(id=item_id), priority).apply_async()
+    try:
+        metadata: Metadata = task.get(timeout=timeout)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Timed out generating item {item_id}")
+    metadata.set_attributes_from_json()
+    return metadata
+
+@app.get("/rarity", response_model=RarityReport, tags=["generator"])
+def get_rarity(max_states: int = 250000, samples: int = 10000, co_occurrence: bool = True, seed: int = None, timeout: float = 300.0, priority: Priority = Priority.interactive):
+    """
+    Return the probability of every trait value, the number of valid combinations and how often trait values occur together
+
+    The trait graph is walked exactly while the combinations fit in max_states, otherwise the report is estimated from samples with 95% confidence intervals
+    """
+    task = prioritize(tasks.rarity_task.s(max_states=max_states, samples=samples, co_occurrence=co_occurrence, seed=seed), priority).apply_async()
+    try:
+        return RarityReport(**task.get(timeout=timeout))
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out computing rarity")
+
 @app.get("/task/{task_id}", tags=["task"])
 async def get_task_status(task_id: str) -> dict:
     """
@@ -150,8 +184,11 @@ async def get_task_status(task_id: str) -> dict:
     """
     task_info = get_task_info(task_id)
     metadata: Metadata = task_info["task_result"]
-    metadata.set_attributes_from_json()
-    task_info["task_result"] = metadata
+    # pending and failed tasks have no metadata yet
+    if isinstance(metadata, Metadata):
+        metadata.set_attributes_from_json()
+    else:
+        task_info["task_result"] = str(metadata) if metadata is not None else None
     return task_info
 
 @app.get("/batch/{batch_id}", tags=["task"])
@@ -196,6 +233,38 @@ async def get_batch_metadata_status(batch_id: str) -> dict:
     # return result['batch_result'][0]
     return metadata_list
 
+def get_batch_result(batch_id: str):
+    try:
+        return restore_batch(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+
+@app.get("/batch_metadata/{batch_id}/jsonl", tags=["task"])
+def stream_batch_metadata(batch_id: str):
+    """
+    Stream the metadata of a batch as JSON lines, one line per item as soon as it completes
+    """
+    batch_result = get_batch_result(batch_id)
+
+    def lines():
+        for _, state, task_result in iter_completed(batch_result):
+            if state == "SUCCESS" and task_result is not None:
+                yield json.dumps(get_record(get_metadata(task_result))) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/batch_metadata/{batch_id}/export", tags=["task"])
+def export_batch(batch_id: str, background_tasks: BackgroundTasks, format: MetadataExportFormat = MetadataExportFormat.jsonl) -> dict:
+    """
+    Write the metadata of a batch to disk while it completes, as a JSONL file or a directory of memory-mappable columns
+    """
+    batch_result = get_batch_result(batch_id)
+    export_directory = get_temporary_directory().joinpath("exports")
+    export_directory.mkdir(parents=True, exist_ok=True)
+    path = export_directory.joinpath(f"{batch_id}.jsonl" if format == MetadataExportFormat.jsonl else f"{batch_id}.columns")
+    background_tasks.add_task(export_batch_metadata, batch_result, format.value, path)
+    return {"batch_id": batch_id, "format": format, "path": str(path)}
+
 def set_active_object(object_ref):
     bpy.context.view_layer.objects.active = object_ref
     
@@ -214,6 +283,39 @@ def get_rendered_file(file_id: str):
     return FileResponse(str(file_path))
 
 
+@app.get("/health", tags=["metrics"])
+def get_health():
+    """Readiness check used by the service supervisor"""
+    return {"status": "ok"}
+
+
+@app.get("/logs", tags=["metrics"])
+def get_logs():
+    """Names of the background services with captured logs"""
+    return {"services": log_capture.get_log_names()}
+
+
+@app.get("/logs/{service}", response_class=PlainTextResponse, tags=["metrics"])
+def get_service_log(service: str, lines: int = 100):
+    """The latest lines of a background service log"""
+    if service not in log_capture.get_log_names():
+        raise HTTPException(status_code=404, detail=f"No log for {service}")
+    return PlainTextResponse("\n".join(log_capture.read_log_tail(service, lines)) + "\n")
+
+
+@app.get("/queues", tags=["metrics"])
+def get_queues():
+    """Messages waiting in each Celery queue, read by the worker autoscaler"""
+    return get_queue_depths()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["metrics"])
+def get_metrics():
+    """Prometheus metrics pushed by the workers to the local aggregator"""
+    content = metrics.render(queue_depths=get_queue_depths())
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/openapi", response_class=JSONResponse, tags=["download"])
 def get_openapi_json(request: Request):
     """Reformat the OpenAPI JSON document"""
@@ -262,66 +364,152 @@ async def handle_rendering(mesh: Mesh):
 async def make_glb_response(rendered_file: RenderedFile):
     return GlbResponse(rendered_file.file_path,media_type="model/gltf-binary")
     
+def get_render_glb_signature(metadata: Metadata, optimization: OptimizationProfile, priority: Priority, should_open_blend_file: bool = False, should_profile: bool = False, **output) -> Signature:
+    """ Render a GLB, chaining the optimizer when the profile enables any optimization"""
+    # only the render waits in a priority lane, the optimizer has its own pool
+    signature = prioritize(tasks.render_glb_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file, should_profile=should_profile, **output), priority)
+    if optimization.is_enabled():
+        signature = signature | tasks.optimize_glb_task.s(optimization.dict())
+    return signature
+
+async def submit_render(render_format: str, metadata: Metadata, priority: Priority, signature: Signature, **params) -> JSONResponse:
+    """ Send a render, or return the task of an identical render that is still in flight"""
+    key = get_render_key(render_format, metadata, **params)
+    _, hard_limit = get_format_time_limits(render_format, params)
+    task_id, is_coalesced = await run_in_threadpool(inflight_renders.submit, key, priority, signature.apply_async, render_format, hard_limit)
+    return JSONResponse({"task_id": task_id, "coalesced": is_coalesced})
+
 @app.post("/render_glb", response_class=JSONResponse, tags=["render"])
-async def render_glb(metadata: Metadata):
+async def render_glb(metadata: Metadata, optimization: OptimizationProfile = Depends(), profile: bool = False, priority: Priority = Priority.interactive, collection: str = None, skip_if_present: bool = False):
     metadata.generate_json_attributes()
-    task = tasks.render_glb_task.apply_async(args=[metadata.dict()])
-    return JSONResponse({"task_id": task.id})
+    signature = get_render_glb_signature(metadata, optimization, priority, should_profile=profile, collection=collection, skip_if_present=skip_if_present)
+    return await submit_render("glb", metadata, priority, signature, optimization=optimization.dict(), profile=profile, collection=collection, skip_if_present=skip_if_present)
+
+@app.post("/preview", response_class=JSONResponse, tags=["preview"])
+async def preview(metadata: Metadata):
+    """ Request a live preview of the traits, replacing any preview that hasn't started yet """
+    metadata.generate_json_attributes()
+    sequence = preview_channel.submit([attribute.dict() for attribute in metadata.json_attributes])
+    return JSONResponse({"sequence": sequence})
+
+@app.get("/preview/events", tags=["preview"])
+async def preview_events():
+    """ Server-sent events with the url of each preview GLB as soon as it is written """
+    return StreamingResponse(preview_channel.stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.post("/generate_batch", response_class=JSONResponse, tags=["generator"])
-def generate_batch(number_to_generate: int, starting_id: int = 1):
+def generate_batch(number_to_generate: int, starting_id: int = 1, profile: bool = False, priority: Priority = Priority.bulk):
     group_list = []
     for i in range(starting_id, number_to_generate+starting_id):
         #TODO add handle i as id in generate_task
-        task = tasks.generate_task.s(id=i)
+        task = prioritize(tasks.generate_task.s(id=i, should_profile=profile), priority)
         group_list.append(task)
          
     job = group(group_list)
     result = job.apply_async()
     result.save()
+    batch_manifest.create_batch(result.id, "generate", {"profile": profile, "priority": priority},
+                                [(i, batch_manifest.METADATA_FORMAT, task.id, None) for i, task in zip(range(starting_id, number_to_generate+starting_id), result.results)])
 
     return JSONResponse({"batch_id": result.id})
 
 
 
+def get_render_signature(render_format: str, metadata: Metadata, optimization: OptimizationProfile, priority: Priority, should_open_blend_file: bool = False, should_profile: bool = False, **output) -> Signature:
+    """ The task rendering an item to one of the batch formats """
+    if render_format == "glb":
+        return get_render_glb_signature(metadata, optimization, priority, should_open_blend_file=should_open_blend_file, should_profile=should_profile, **output)
+    render_task = {"jpeg": tasks.render_jpeg_task, "fbx": tasks.render_fbx_task, "vrm": tasks.render_vrm_task}[render_format]
+    return prioritize(render_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file, should_profile=should_profile, **output), priority)
+
 @app.post("/render_batch", response_class=JSONResponse, tags=["render"])
-def render_batch(metadata_list: MetadataList, should_render_jpeg: bool = False, should_render_fbx: bool = False, should_render_glb: bool = False, should_render_vrm: bool = False, should_open_blend_file: bool = False):
+def render_batch(metadata_list: MetadataList, should_render_jpeg: bool = False, should_render_fbx: bool = False, should_render_glb: bool = False, should_render_vrm: bool = False, should_open_blend_file: bool = False, optimization: OptimizationProfile = Depends(), profile: bool = False, priority: Priority = Priority.bulk, collection: str = None, skip_if_present: bool = False):
+    """
+    Render every item to the selected formats, skipping items whose file was already rendered for the collection when skip_if_present is on
+    """
+    render_formats = [render_format for render_format, is_enabled in (("glb", should_render_glb), ("jpeg", should_render_jpeg), ("fbx", should_render_fbx), ("vrm", should_render_vrm)) if is_enabled]
     group_list = []
-    for metadata in metadata_list.metadata_list:
+    items = []
+    for index, metadata in enumerate(metadata_list.metadata_list):
         metadata.generate_json_attributes()
-        if should_render_glb:
-            task = tasks.render_glb_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file)
-            group_list.append(task)
-        if should_render_jpeg:
-            task = tasks.render_jpeg_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file)
-            group_list.append(task)
-        if should_render_fbx:
-            task = tasks.render_fbx_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file)
-            group_list.append(task)
-        if should_render_vrm:
-            task = tasks.render_vrm_task.s(metadata.dict(), should_open_blend_file=should_open_blend_file)
-            group_list.append(task)
+        for render_format in render_formats:
+            group_list.append(get_render_signature(render_format, metadata, optimization, priority, should_open_blend_file=should_open_blend_file, should_profile=profile, collection=collection, skip_if_present=skip_if_present))
+            items.append((metadata.id if metadata.id is not None else index, render_format, metadata.dict()))
          
     job = group(group_list)
     result = job.apply_async()
     result.save()
+    batch_manifest.create_batch(result.id, "render", {"should_open_blend_file": should_open_blend_file, "optimization": optimization.dict(), "profile": profile, "priority": priority, "collection": collection, "skip_if_present": skip_if_present},
+                                [(item_id, render_format, task.id, metadata) for (item_id, render_format, metadata), task in zip(items, result.results)])
 
     return JSONResponse({"batch_id": result.id})
 
+@app.get("/batch/{batch_id}/manifest", tags=["task"])
+def get_batch_manifest(batch_id: str) -> dict:
+    """
+    Return the items of a batch with their format, state, task and rendered file
+    """
+    manifest = batch_manifest.get_batch(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+    return manifest
+
+@app.get("/dead_letters", tags=["task"])
+def get_dead_letters(batch_id: str = None, limit: int = 100) -> list[dict]:
+    """
+    Return the tasks that failed for good with their error, traceback and arguments, newest first
+
+    Errors that can't pass, like a missing trait or a broken node setup, fail on the first attempt,
+    others once their retries are used up. With batch_id, only the items of that batch are returned.
+    """
+    if batch_id is None:
+        return failures.get_dead_letters(limit=limit)
+    manifest = batch_manifest.get_batch(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+    return failures.get_dead_letters([item["task_id"] for item in manifest["items"]])[:limit]
+
+def get_item_signature(item: dict, params: dict, priority: Priority) -> Signature:
+    if item["format"] == batch_manifest.METADATA_FORMAT:
+        return prioritize(tasks.generate_task.s(id=item["item_id"], should_profile=params["profile"]), priority)
+    return get_render_signature(item["format"], Metadata(**item["metadata"]), OptimizationProfile(**params["optimization"]), priority,
+                                should_open_blend_file=params["should_open_blend_file"], should_profile=params["profile"],
+                                collection=params.get("collection"), skip_if_present=params.get("skip_if_present", False))
+
+@app.post("/batch/{batch_id}/resume", tags=["task"])
+def resume_batch(batch_id: str, priority: Priority = None, force: bool = False) -> dict:
+    """
+    Submit again the items of a batch that failed, were lost with the broker or whose rendered file is gone
+
+    Works across restarts of the API and the workers. Items still waiting in their queue are left alone unless force is set.
+    """
+    manifest = batch_manifest.get_batch(batch_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Unknown batch {batch_id}")
+    priority = priority or Priority(manifest["params"]["priority"])
+    missing = batch_manifest.get_missing_items(batch_id, force)
+    if not missing:
+        return {"batch_id": batch_id, "resumed": 0, "resume_batch_id": None}
+
+    result = group([get_item_signature(item, manifest["params"], priority) for item in missing]).apply_async()
+    result.save()
+    batch_manifest.requeue_items(batch_id, [(item["item_id"], item["format"], task.id) for item, task in zip(missing, result.results)])
+    return {"batch_id": batch_id, "resumed": len(missing), "resume_batch_id": result.id}
+
 
 async def export_vrm_file(rendered_file):
     bpy.ops.export_scene.vrm(filepath=rendered_file)
 
 
 @app.post("/render_vrm", response_class=JSONResponse, tags=["render"])
-async def render_vrm(metadata: Metadata):
+async def render_vrm(metadata: Metadata, profile: bool = False, priority: Priority = Priority.interactive, collection: str = None, skip_if_present: bool = False):
     is_vrm_installed = len(dir(bpy.ops.vrm)) > 0
     if not is_vrm_installed:
         raise HTTPException(status_code=404, detail="VRM addon not installed")
     
     metadata.generate_json_attributes()
-    task = tasks.render_vrm_task.apply_async(args=[metadata.dict()])
-    return JSONResponse({"task_id": task.id})
+    signature = prioritize(tasks.render_vrm_task.s(metadata.dict(), should_profile=profile, collection=collection, skip_if_present=skip_if_present), priority)
+    return await submit_render("vrm", metadata, priority, signature, profile=profile, collection=collection, skip_if_present=skip_if_present)
 
 
 
@@ -346,10 +534,10 @@ def delete_all_objects():
         bpy.data.objects.remove(obj)
 
 @app.post("/render_fbx", response_class=JSONResponse, tags=["render"])
-async def render_fbx(metadata: Metadata):
+async def render_fbx(metadata: Metadata, profile: bool = False, priority: Priority = Priority.interactive, collection: str = None, skip_if_present: bool = False):
     metadata.generate_json_attributes()
-    task = tasks.render_fbx_task.apply_async(args=[metadata.dict()])
-    return JSONResponse({"task_id": task.id})
+    signature = prioritize(tasks.render_fbx_task.s(metadata.dict(), should_profile=profile, collection=collection, skip_if_present=skip_if_present), priority)
+    return await submit_render("fbx", metadata, priority, signature, profile=profile, collection=collection, skip_if_present=skip_if_present)
 
 
 async def render_jpeg_file(rendered_file):
@@ -358,12 +546,11 @@ async def render_jpeg_file(rendered_file):
     
 
 @app.post("/render_jpeg", response_class=JSONResponse, tags=["render"])
-async def render_jpeg(metadata: Metadata, resolution_x: int = 720, resolution_y: int = 720, samples: int = 64, file_format: str = "JPEG", quality: int = 90):
+async def render_jpeg(metadata: Metadata, resolution_x: int = 720, resolution_y: int = 720, samples: int = 64, file_format: str = "JPEG", quality: int = 90, profile: bool = False, priority: Priority = Priority.interactive, collection: str = None, skip_if_present: bool = False):
     metadata.generate_json_attributes()
 
-    task = tasks.render_jpeg_task.apply_async(args=[metadata.dict(), resolution_x, resolution_y, samples, file_format, quality])
-    # return metadata
-    return JSONResponse({"task_id": task.id})
+    signature = prioritize(tasks.render_jpeg_task.s(metadata.dict(), resolution_x, resolution_y, samples, file_format, quality, should_profile=profile, collection=collection, skip_if_present=skip_if_present), priority)
+    return await submit_render("jpeg", metadata, priority, signature, resolution_x=resolution_x, resolution_y=resolution_y, samples=samples, file_format=file_format, quality=quality, profile=profile, collection=collection, skip_if_present=skip_if_present)
 
 
 
@@ -0,0 +1,176 @@
+import json
+import time
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+from celery.result import GroupResult
+from shaderverse.model import Metadata
+from shaderverse.api import batch_manifest
+
+POLL_INTERVAL = 0.5
+# pending tasks asked for their state directly on each pass, the others wait for their batch manifest
+RECHECK_BATCH = 200
+MANIFEST_EVERY = 1000
+MISSING_CODE = -1
+MISSING_ID = -1
+
+
+def get_metadata(task_result) -> Metadata:
+    if isinstance(task_result, dict):
+        return Metadata(**task_result)
+    return task_result
+
+
+def get_record(metadata: Metadata) -> dict:
+    """ One flat record of an item, with its traits keyed by trait type """
+    record = {"id": metadata.id, "filename": metadata.filename}
+    record["attributes"] = {attribute.trait_type: attribute.value for attribute in metadata.json_attributes or []}
+    for field in ("rendered_glb_url", "rendered_usdz_url", "rendered_file_url"):
+        if getattr(metadata, field):
+            record[field] = getattr(metadata, field)
+    return record
+
+
+def restore_batch(batch_id: str) -> GroupResult:
+    batch_result = GroupResult.restore(batch_id)
+    if batch_result is None:
+        raise KeyError(f"Unknown batch {batch_id}")
+    return batch_result
+
+
+def iter_completed(batch_result: GroupResult, poll_interval: float = POLL_INTERVAL) -> Iterator[tuple[int, str, object]]:
+    """ Yield the row, state and result of every task of a batch as soon as it is ready, in completion order
+
+    The batch manifest tells which tasks finished in one query per pass, so only those are read from
+    the result backend. A rotating window of the other pending tasks is checked directly, for batches
+    without a manifest and tasks that finished before their manifest was written.
+    """
+    pending = dict(enumerate(batch_result.results))
+    finished_states = (batch_manifest.ItemState.succeeded.value, batch_manifest.ItemState.failed.value)
+    offset = 0
+    while pending:
+        task_states = batch_manifest.get_task_states([result.id for result in pending.values()])
+        rows = list(pending)
+        offset = offset % len(rows)
+        rechecked = set(rows[offset:offset + RECHECK_BATCH])
+        offset += RECHECK_BATCH
+        for row in rows:
+            result = pending[row]
+            if task_states.get(result.id) in finished_states or (row in rechecked and result.ready()):
+                del pending[row]
+                yield row, result.state, result.result
+        if pending:
+            time.sleep(poll_interval)
+
+
+class JsonlMetadataWriter():
+    """ Append one compact JSON line per item as it completes """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.file = open(self.path, "w")
+        self.written = 0
+        self.failed = 0
+
+    def write(self, row: int, metadata: Metadata):
+        self.file.write(json.dumps(get_record(metadata)) + "\n")
+        self.file.flush()
+        self.written += 1
+
+    def skip(self, row: int):
+        self.failed += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarMetadataWriter():
+    """ One memory-mappable column per trait, dictionary-encoded, filled in as items complete
+
+    The directory holds an .npy file of item ids and one .npy file of int32 codes per trait, indexed
+    by the position of the item in its batch, and a manifest with the dictionary of every column.
+    Rows that haven't completed, or failed, keep the code -1. Only the dictionaries stay in memory.
+    """
+
+    def __init__(self, directory: Path, rows: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.rows = rows
+        self.ids = np.lib.format.open_memmap(self.directory / "id.npy", mode="w+", dtype=np.int64, shape=(rows,))
+        self.ids[:] = MISSING_ID
+        self.columns: dict[str, np.memmap] = {}
+        self.files: dict[str, str] = {}
+        self.dictionaries: dict[str, dict[str, int]] = {}
+        self.written = 0
+        self.failed = 0
+        self.write_manifest(complete=False)
+
+    def get_column(self, trait_type: str) -> np.memmap:
+        if trait_type not in self.columns:
+            file_name = f"trait_{len(self.columns):03d}.npy"
+            column = np.lib.format.open_memmap(self.directory / file_name, mode="w+", dtype=np.int32, shape=(self.rows,))
+            column[:] = MISSING_CODE
+            self.columns[trait_type] = column
+            self.files[trait_type] = file_name
+            self.dictionaries[trait_type] = {}
+        return self.columns[trait_type]
+
+    def encode(self, trait_type: str, value: str) -> int:
+        dictionary = self.dictionaries[trait_type]
+        if value not in dictionary:
+            dictionary[value] = len(dictionary)
+        return dictionary[value]
+
+    def write(self, row: int, metadata: Metadata):
+        if metadata.id is not None:
+            self.ids[row] = metadata.id
+        for attribute in metadata.json_attributes or []:
+            column = self.get_column(attribute.trait_type)
+            column[row] = self.encode(attribute.trait_type, attribute.value)
+        self.written += 1
+        if self.written % MANIFEST_EVERY == 0:
+            self.flush()
+
+    def skip(self, row: int):
+        self.failed += 1
+
+    def flush(self, complete: bool = False):
+        self.ids.flush()
+        for column in self.columns.values():
+            column.flush()
+        self.write_manifest(complete)
+
+    def write_manifest(self, complete: bool):
+        manifest = {
+            "rows": self.rows,
+            "written": self.written,
+            "failed": self.failed,
+            "complete": complete,
+            "missing_code": MISSING_CODE,
+            "id": "id.npy",
+            "columns": [{"trait_type": trait_type, "file": self.files[trait_type], "dictionary": list(self.dictionaries[trait_type])}
+                        for trait_type in self.columns],
+        }
+        manifest_path = self.directory / "manifest.json"
+        temporary_path = manifest_path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps(manifest, indent=2))
+        temporary_path.replace(manifest_path)
+
+    def close(self):
+        self.flush(complete=True)
+
+
+def export_batch_metadata(batch_result: GroupResult, export_format: str, path: Path):
+    """ Write the metadata of a batch to a JSONL file or a columnar directory while its tasks complete """
+    if export_format == "columnar":
+        writer = ColumnarMetadataWriter(path, len(batch_result.results))
+    else:
+        writer = JsonlMetadataWriter(path)
+    try:
+        for row, state, task_result in iter_completed(batch_result):
+            if state == "SUCCESS" and task_result is not None:
+                writer.write(row, get_metadata(task_result))
+            else:
+                writer.skip(row)
+    finally:
+        writer.close()
@@ -0,0 +1,334 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import psutil
+from celery import current_task
+from celery.signals import worker_ready, worker_shutdown, task_prerun, task_postrun
+from shaderverse.api.utils import get_temporary_directory
+
+HEARTBEAT_INTERVAL = 10.0
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, float("inf"))
+
+RENDERED_SUFFIXES = {".glb", ".fbx", ".vrm", ".jpg", ".png"}
+
+METRICS_HELP = {
+    "shaderverse_task_stage_seconds": ("histogram", "Time spent in each stage of a task"),
+    "shaderverse_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "shaderverse_cache_hit_ratio": ("gauge", "Fraction of cache lookups that were hits"),
+    "shaderverse_queue_depth": ("gauge", "Messages waiting in each Celery queue"),
+    "shaderverse_workers": ("gauge", "Live workers by state"),
+    "shaderverse_artifact_bytes": ("gauge", "Disk used by rendered artifacts and caches"),
+    "shaderverse_worker_rss_bytes": ("gauge", "Resident memory of each Blender worker after its last task"),
+    "shaderverse_worker_tasks": ("gauge", "Tasks run by each Blender worker since it started"),
+    "shaderverse_worker_datablocks": ("gauge", "Datablocks held by each Blender worker after its last task"),
+    "shaderverse_worker_recycles_total": ("counter", "Workers recycled by reason"),
+    "shaderverse_coalesced_requests_total": ("counter", "Render requests attached to an identical render in flight"),
+    "shaderverse_preview_seconds": ("histogram", "Time from a live preview request to its GLB being ready"),
+    "shaderverse_modifier_input_writes_total": ("counter", "Geometry node inputs written or skipped because they already held the value"),
+    "shaderverse_skipped_outputs_total": ("counter", "Renders skipped because the item's file already existed with a valid checksum"),
+    "shaderverse_task_failures_total": ("counter", "Tasks failed for good, by task and whether the error was permanent, retries ran out, the task timed out or its recycled worker was killed"),
+    "shaderverse_task_timeouts_total": ("counter", "Workers killed because their task passed its hard time limit, by task and stage"),
+    "shaderverse_requeued_tasks_total": ("counter", "Tasks held by a killed worker that were sent to their queue again"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS histogram (name TEXT, labels TEXT, le TEXT, count INTEGER, PRIMARY KEY (name, labels, le));
+CREATE TABLE IF NOT EXISTS histogram_total (name TEXT, labels TEXT, sum REAL, count INTEGER, PRIMARY KEY (name, labels));
+CREATE TABLE IF NOT EXISTS counter (name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels));
+CREATE TABLE IF NOT EXISTS worker (pid INTEGER PRIMARY KEY, hostname TEXT, state TEXT, task TEXT, updated_at REAL);
+CREATE TABLE IF NOT EXISTS worker_memory (pid INTEGER PRIMARY KEY, rss INTEGER, tasks INTEGER, datablocks TEXT, updated_at REAL);
+CREATE TABLE IF NOT EXISTS task_run (pid INTEGER PRIMARY KEY, task_id TEXT, task TEXT, stage TEXT, arguments TEXT, started_at REAL, soft_limit REAL, hard_limit REAL);
+CREATE TABLE IF NOT EXISTS task_reserved (task_id TEXT PRIMARY KEY, pid INTEGER, message TEXT, received_at REAL);
+"""
+
+
+def get_metrics_path() -> Path:
+    return get_temporary_directory().joinpath("metrics.sqlite")
+
+
+is_schema_created = False
+
+@contextmanager
+def connect():
+    """ Open the local aggregator shared by the API and every worker on this machine """
+    global is_schema_created
+    connection = sqlite3.connect(str(get_metrics_path()), timeout=10)
+    try:
+        if not is_schema_created:
+            connection.executescript(SCHEMA)
+            is_schema_created = True
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def format_labels(labels: dict) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def format_bucket(le: float) -> str:
+    return "+Inf" if le == float("inf") else repr(le)
+
+
+def observe(name: str, value: float, labels: dict, buckets: tuple = STAGE_BUCKETS):
+    """ Record a histogram observation """
+    label_string = format_labels(labels)
+    le = next(bucket for bucket in buckets if value <= bucket)
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT INTO histogram VALUES (?, ?, ?, 1) ON CONFLICT (name, labels, le) DO UPDATE SET count = count + 1",
+                (name, label_string, format_bucket(le)))
+            connection.execute(
+                "INSERT INTO histogram_total VALUES (?, ?, ?, 1) ON CONFLICT (name, labels) DO UPDATE SET sum = sum + excluded.sum, count = count + 1",
+                (name, label_string, value))
+    except sqlite3.Error as e:
+        print(f"Could not record metric {name}: {e}")
+
+
+def increment(name: str, labels: dict, value: float = 1.0):
+    """ Increment a counter """
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT INTO counter VALUES (?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                (name, format_labels(labels), value))
+    except sqlite3.Error as e:
+        print(f"Could not record metric {name}: {e}")
+
+
+def record_input_writes(written: int, skipped: int):
+    """ Count the geometry node input writes of an update """
+    increment("shaderverse_modifier_input_writes_total", {"result": "written"}, written)
+    increment("shaderverse_modifier_input_writes_total", {"result": "skipped"}, skipped)
+
+
+def get_task_name() -> str:
+    return current_task.name if current_task else "none"
+
+
+def set_task_stage(stage_name: str):
+    """ Record the stage the running task of this process is in """
+    try:
+        with connect() as connection:
+            connection.execute("UPDATE task_run SET stage = ? WHERE pid = ?", (stage_name, os.getpid()))
+    except sqlite3.Error as e:
+        print(f"Could not record the task stage: {e}")
+
+
+@contextmanager
+def stage(stage_name: str):
+    """ Time a stage of the running task, which fails instead when it passed its soft limit """
+    from shaderverse.api import time_limits
+    time_limits.check_soft_limit(stage_name)
+    set_task_stage(stage_name)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_time = time.perf_counter() - start_time
+        observe("shaderverse_task_stage_seconds", elapsed_time, {"task": get_task_name(), "stage": stage_name})
+
+
+def set_worker_state(state: str, hostname: str = "", task: str = ""):
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO worker VALUES (?, ?, ?, ?, ?)",
+                (os.getpid(), hostname, state, task, time.time()))
+    except sqlite3.Error as e:
+        print(f"Could not record worker state: {e}")
+
+
+def send_heartbeat():
+    try:
+        with connect() as connection:
+            connection.execute("UPDATE worker SET updated_at = ? WHERE pid = ?", (time.time(), os.getpid()))
+    except sqlite3.Error as e:
+        print(f"Could not send heartbeat: {e}")
+
+
+def run_heartbeat():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        send_heartbeat()
+
+
+def get_heartbeats(pids: set[int]) -> dict[int, float]:
+    """ Return the last heartbeat of each worker process in pids """
+    with connect() as connection:
+        rows = connection.execute("SELECT pid, updated_at FROM worker").fetchall()
+    return {pid: updated_at for pid, updated_at in rows if pid in pids}
+
+
+def get_worker_states(pids: set[int]) -> dict[int, str]:
+    """ Return the state of each worker process in pids """
+    with connect() as connection:
+        rows = connection.execute("SELECT pid, state FROM worker").fetchall()
+    return {pid: state for pid, state in rows if pid in pids}
+
+
+def set_worker_memory(rss: int, tasks: int, datablocks: dict[str, int]):
+    """ Record the memory of this worker after a task """
+    try:
+        with connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO worker_memory VALUES (?, ?, ?, ?, ?)",
+                (os.getpid(), rss, tasks, json.dumps(datablocks), time.time()))
+    except sqlite3.Error as e:
+        print(f"Could not record worker memory: {e}")
+
+
+@worker_ready.connect
+def handle_worker_ready(sender=None, **kwargs):
+    set_worker_state("idle", hostname=getattr(sender, "hostname", ""))
+    # the supervisor in Blender treats a worker without recent heartbeats as hung
+    threading.Thread(target=run_heartbeat, daemon=True).start()
+
+
+def remove_workers(pids: set[int]):
+    """ Forget workers that shut down or were killed """
+    try:
+        with connect() as connection:
+            for pid in pids:
+                connection.execute("DELETE FROM worker WHERE pid = ?", (pid,))
+                connection.execute("DELETE FROM worker_memory WHERE pid = ?", (pid,))
+    except sqlite3.Error as e:
+        print(f"Could not remove worker: {e}")
+
+
+@worker_shutdown.connect
+def handle_worker_shutdown(sender=None, **kwargs):
+    remove_workers({os.getpid()})
+
+
+@task_prerun.connect
+def handle_task_prerun(sender=None, task=None, **kwargs):
+    set_worker_state("busy", hostname=task.request.hostname or "", task=task.name)
+
+
+@task_postrun.connect
+def handle_task_postrun(sender=None, task=None, **kwargs):
+    set_worker_state("idle", hostname=task.request.hostname or "")
+
+
+def get_directory_size(path: Path) -> int:
+    if not path.exists():
+        return 0
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+def get_artifact_usage() -> dict[str, int]:
+    """ Disk used by rendered files and the caches kept next to them """
+    temp_dir = get_temporary_directory()
+    texture_cache_dir = temp_dir.joinpath("texture_cache")
+    rendered = sum(file.stat().st_size for file in temp_dir.iterdir() if file.is_file() and file.suffix in RENDERED_SUFFIXES)
+    return {
+        "rendered": rendered,
+        "texture_cache": get_directory_size(texture_cache_dir),
+    }
+
+
+def render_header(lines: list[str], name: str):
+    metric_type, help_text = METRICS_HELP[name]
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def render_histograms(connection: sqlite3.Connection, lines: list[str]):
+    totals = connection.execute("SELECT name, labels, sum, count FROM histogram_total ORDER BY name, labels").fetchall()
+    rendered_names = set()
+    for name, labels, total_sum, total_count in totals:
+        if name not in rendered_names:
+            render_header(lines, name)
+            rendered_names.add(name)
+        rows = connection.execute("SELECT le, count FROM histogram WHERE name = ? AND labels = ?", (name, labels)).fetchall()
+        counts = {float(le): count for le, count in rows}
+        cumulative = 0
+        for bucket in STAGE_BUCKETS:
+            cumulative += counts.get(bucket, 0)
+            lines.append(f'{name}_bucket{{{labels},le="{format_bucket(bucket)}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {total_sum}")
+        lines.append(f"{name}_count{{{labels}}} {total_count}")
+
+
+def render_counters(connection: sqlite3.Connection, lines: list[str]):
+    rows = connection.execute("SELECT name, labels, value FROM counter ORDER BY name, labels").fetchall()
+    rendered_names = set()
+    cache_results: dict[str, dict[str, float]] = {}
+    for name, labels, value in rows:
+        if name not in rendered_names:
+            render_header(lines, name)
+            rendered_names.add(name)
+        lines.append(f"{name}{{{labels}}} {value}")
+        if name == "shaderverse_cache_requests_total":
+            label_dict = dict(label.split("=", 1) for label in labels.split(","))
+            cache_results.setdefault(label_dict["cache"].strip('"'), {})[label_dict["result"].strip('"')] = value
+
+    if cache_results:
+        render_header(lines, "shaderverse_cache_hit_ratio")
+        for cache, results in sorted(cache_results.items()):
+            total = sum(results.values())
+            ratio = results.get("hit", 0) / total if total else 0.0
+            lines.append(f'shaderverse_cache_hit_ratio{{cache="{cache}"}} {ratio}')
+
+
+def render_workers(connection: sqlite3.Connection, lines: list[str]):
+    rows = connection.execute("SELECT pid, state FROM worker").fetchall()
+    states = {"busy": 0, "idle": 0}
+    for pid, state in rows:
+        if psutil.pid_exists(pid):
+            states[state] = states.get(state, 0) + 1
+        else:
+            connection.execute("DELETE FROM worker WHERE pid = ?", (pid,))
+    render_header(lines, "shaderverse_workers")
+    for state, count in sorted(states.items()):
+        lines.append(f'shaderverse_workers{{state="{state}"}} {count}')
+
+
+def render_worker_memory(connection: sqlite3.Connection, lines: list[str]):
+    rows = connection.execute("SELECT pid, rss, tasks, datablocks FROM worker_memory ORDER BY pid").fetchall()
+    live_rows = []
+    for row in rows:
+        if psutil.pid_exists(row[0]):
+            live_rows.append(row)
+        else:
+            connection.execute("DELETE FROM worker_memory WHERE pid = ?", (row[0],))
+    if not live_rows:
+        return
+    render_header(lines, "shaderverse_worker_rss_bytes")
+    for pid, rss, tasks, datablocks in live_rows:
+        lines.append(f'shaderverse_worker_rss_bytes{{pid="{pid}"}} {rss}')
+    render_header(lines, "shaderverse_worker_tasks")
+    for pid, rss, tasks, datablocks in live_rows:
+        lines.append(f'shaderverse_worker_tasks{{pid="{pid}"}} {tasks}')
+    render_header(lines, "shaderverse_worker_datablocks")
+    for pid, rss, tasks, datablocks in live_rows:
+        for kind, count in sorted(json.loads(datablocks).items()):
+            lines.append(f'shaderverse_worker_datablocks{{kind="{kind}",pid="{pid}"}} {count}')
+
+
+def render(queue_depths: dict[str, int]) -> str:
+    """ Render every metric in the Prometheus text exposition format """
+    lines: list[str] = []
+    with connect() as connection:
+        render_histograms(connection, lines)
+        render_counters(connection, lines)
+        render_workers(connection, lines)
+        render_worker_memory(connection, lines)
+
+    render_header(lines, "shaderverse_queue_depth")
+    for queue, depth in sorted(queue_depths.items()):
+        lines.append(f'shaderverse_queue_depth{{queue="{queue}"}} {depth}')
+
+    render_header(lines, "shaderverse_artifact_bytes")
+    for kind, size in sorted(get_artifact_usage().items()):
+        lines.append(f'shaderverse_artifact_bytes{{kind="{kind}"}} {size}')
+
+    return "\n".join(lines) + "\n"
@@ -19,6 +19,17 @@ class SessionStatus(str, Enum):
 class Action(str, Enum):
     render_glb = 'render_glb'
 
+class Priority(str, Enum):
+    """ Lane a request waits in, interactive requests skip ahead of bulk batches """
+    interactive = 'interactive'
+    normal = 'normal'
+    bulk = 'bulk'
+
+class MetadataExportFormat(str, Enum):
+    """ JSON lines, or one dictionary-encoded .npy column per trait """
+    jsonl = 'jsonl'
+    columnar = 'columnar'
+
 class RenderedFile(BaseModel):
     id: UUID4
     file_path: str
@@ -28,4 +39,61 @@ class SessionData(BaseModel):
     status: SessionStatus = "ready"
     total_count: int = 0
     current_count: int = 0
-    current_id: int = 0
\ No newline at end of file
+    current_id: int = 0
+
+class Compression(str, Enum):
+    none = 'none'
+    draco = 'draco'
+    meshopt = 'meshopt'
+
+class OptimizationProfile(BaseModel):
+    """ Post-export optimization settings for a GLB render """
+    compression: Compression = Compression.none
+    quantize: bool = False
+    dedup_accessors: bool = False
+    max_texture_size: int = 0
+
+    def is_enabled(self) -> bool:
+        return self.compression != Compression.none or self.quantize or self.dedup_accessors or self.max_texture_size > 0
+
+class OptimizationResult(BaseModel):
+    original_size: int
+    optimized_size: int
+    applied: list[str] = []
+    warnings: list[str] = []
+
+class RarityMethod(str, Enum):
+    exact = 'exact'
+    monte_carlo = 'monte_carlo'
+
+class TraitValueProbability(BaseModel):
+    """ Probability of a trait value among the items that generate, with a 95% interval when sampled """
+    value: str
+    probability: float
+    lower: float = None
+    upper: float = None
+
+class TraitRange(BaseModel):
+    """ An INT or VALUE trait no restriction depends on, uniform over its values at generator precision """
+    min_value: float
+    max_value: float
+    step: float
+    count: int
+
+class CoOccurrence(BaseModel):
+    trait_a: str
+    value_a: str
+    trait_b: str
+    value_b: str
+    probability: float
+
+class RarityReport(BaseModel):
+    method: RarityMethod
+    failure_probability: float = 0.0
+    valid_combinations: int = None
+    distinct_combinations_observed: int = None
+    samples: int = None
+    states: int = None
+    marginals: dict[str, list[TraitValueProbability]] = {}
+    ranges: dict[str, TraitRange] = {}
+    co_occurrence: list[CoOccurrence] = []
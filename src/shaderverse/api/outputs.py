@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+import bpy
+from shaderverse.api.utils import get_temporary_directory, get_rendered_file_url
+
+RECORD_SUFFIX = ".json"
+CHUNK_SIZE = 1024 * 1024
+# enough of the content key to tell renders of the same item apart in the file name
+NAME_KEY_LENGTH = 12
+
+
+def get_collection_name() -> str:
+    """ Name the collection of the open file, whose items are reproducible from its seed and their ids """
+    stem = Path(bpy.data.filepath).stem or "untitled"
+    return f"{stem}-{bpy.context.scene.shaderverse.seed}"
+
+
+def get_safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", name).strip("-") or "collection"
+
+
+def get_content_key(json_attributes: list[dict], **params) -> str:
+    """ Identify what an output holds by its traits in any order and the render parameters """
+    attributes = sorted((attribute["trait_type"], str(attribute["value"])) for attribute in json_attributes or [])
+    content = json.dumps([attributes, params], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_record_path(path: Path) -> Path:
+    return path.with_name(path.name + RECORD_SUFFIX)
+
+
+def read_record(path: Path) -> dict | None:
+    try:
+        return json.loads(get_record_path(path).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_record(path: Path, record: dict):
+    """ Checksum the file and write its record next to it, atomically """
+    record = dict(record, size=path.stat().st_size, sha256=get_checksum(path))
+    record_path = get_record_path(path)
+    temporary_path = record_path.with_name(f"{record_path.name}.{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(record))
+    os.replace(temporary_path, record_path)
+
+
+def is_intact(path: Path, record: dict) -> bool:
+    """ Check the file still has the size and checksum it was recorded with """
+    try:
+        return path.stat().st_size == record["size"] and get_checksum(path) == record["sha256"]
+    except (OSError, KeyError):
+        return False
+
+
+class Output():
+    """ Where a rendered item is written
+
+    Items with an id get a stable name from the collection, the item id, what the item was rendered
+    from and the format, so a retry or a resubmission can tell that the file already exists, while
+    rendering the item with other traits or parameters never replaces a file already handed out.
+    Files are written under a temporary name and renamed when complete, and a record next to them
+    holds their checksum and what they were rendered from. Items without an id keep a random name.
+    A file made from another one, like an optimized GLB, is an output of its own and leaves its
+    source unchanged.
+    """
+
+    def __init__(self, metadata: dict, extension: str, collection: str = None, **params):
+        self.item_id = metadata.get("id")
+        self.content_key = get_content_key(metadata.get("json_attributes"), **params)
+        self.details = {}
+        temp_dir = get_temporary_directory()
+        if self.item_id is None:
+            self.path = temp_dir.joinpath(f"{next(tempfile._get_candidate_names())}.{extension}")
+        else:
+            self.path = temp_dir.joinpath(f"{get_safe_name(collection or get_collection_name())}_{self.item_id}_{self.content_key[:NAME_KEY_LENGTH]}.{extension}")
+
+    @classmethod
+    def derive(cls, source: Path, **params) -> "Output":
+        """ The output made from a rendered file with the given parameters, named after it """
+        output = cls.__new__(cls)
+        record = read_record(source) or {}
+        output.item_id = record.get("item_id")
+        output.content_key = get_content_key([], source=record.get("content_key") or source.name, **params)
+        output.details = {}
+        output.path = source.with_name(f"{source.stem}_{output.content_key[:NAME_KEY_LENGTH]}{source.suffix}")
+        return output
+
+    @property
+    def url(self) -> str:
+        return get_rendered_file_url(self.path.name)
+
+    def find(self) -> dict | None:
+        """ The record of a complete, unchanged file made from the same traits and parameters """
+        if self.item_id is None:
+            return None
+        record = read_record(self.path)
+        if record is None or record.get("content_key") != self.content_key:
+            return None
+        if not is_intact(self.path, record):
+            print(f"{self.path.name} doesn't match its checksum, rendering it again")
+            return None
+        return record
+
+    @contextmanager
+    def write(self):
+        """ Yield a temporary path with the same extension and move it in place once it is written
+
+        What is put in details while writing is kept in the record of the file.
+        """
+        temporary_path = self.path.with_name(f"{self.path.stem}.{os.getpid()}.partial{self.path.suffix}")
+        try:
+            yield str(temporary_path)
+            os.replace(temporary_path, self.path)
+        finally:
+            if temporary_path.exists():
+                temporary_path.unlink()
+        if self.item_id is not None:
+            write_record(self.path, dict(self.details, item_id=self.item_id, content_key=self.content_key))
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+import bpy
+from celery import current_app
+from celery.result import AsyncResult
+from shaderverse.mesh import Mesh
+from shaderverse.api import metrics
+from shaderverse.api.utils import get_temporary_directory
+
+DECIMATE_MODIFIER_NAME = "Shaderverse Preview Decimate"
+DECIMATE_RATIO = 0.25
+POLL_INTERVAL = 0.05
+
+
+class PreviewScene():
+    """ The scene kept resident by the preview worker between trait changes
+
+    Nothing is realized or reverted: only the geometry node inputs of traits that changed since the
+    last preview are set, objects are shown and hidden by difference, and the depsgraph re-evaluates
+    just what depends on them. Every mesh gets a decimate modifier once so previews stay light.
+    Each preview replaces the one before in a single file per worker.
+    """
+
+    def __init__(self, decimate_ratio: float = DECIMATE_RATIO):
+        self.decimate_ratio = decimate_ratio
+        self.is_prepared = False
+        self.applied: dict[str, str] = {}
+        self.visible_objects: set[str] = set()
+        self.previews = 0
+
+    def prepare(self):
+        for obj in bpy.data.objects:
+            if obj.type == "MESH" and DECIMATE_MODIFIER_NAME not in obj.modifiers:
+                modifier = obj.modifiers.new(DECIMATE_MODIFIER_NAME, "DECIMATE")
+                modifier.ratio = self.decimate_ratio
+        # the objects visible in the file are hidden by the first update unless they belong to its traits
+        self.visible_objects = {obj.name for obj in bpy.data.objects if obj.visible_get()}
+        self.is_prepared = True
+
+    def get_path(self) -> Path:
+        return get_temporary_directory().joinpath(f"preview_{os.getpid()}.glb")
+
+    def get_changed_traits(self, json_attributes: list[dict]) -> set[str]:
+        return {attribute["trait_type"] for attribute in json_attributes
+                if self.applied.get(attribute["trait_type"]) != str(attribute["value"])}
+
+    def update(self, json_attributes: list[dict]) -> set[str]:
+        """ Apply the traits that changed and return their trait types """
+        if not self.is_prepared:
+            with metrics.stage("preview_prepare"):
+                self.prepare()
+        changed = self.get_changed_traits(json_attributes)
+        bpy.context.scene.shaderverse.generated_metadata = json.dumps(json_attributes)
+        if not changed:
+            return changed
+
+        mesh = Mesh()
+        with metrics.stage("update_geonodes"):
+            mesh.update_geonodes_from_metadata(trait_types=changed)
+        metrics.record_input_writes(mesh.input_writes, mesh.skipped_input_writes)
+        with metrics.stage("visibility"):
+            visible_objects = {obj.name for obj in mesh.get_objects() if obj}
+            for name in self.visible_objects - visible_objects:
+                bpy.data.objects[name].hide_set(True)
+            for name in visible_objects - self.visible_objects:
+                bpy.data.objects[name].hide_set(False)
+                bpy.data.objects[name].hide_render = False
+            self.visible_objects = visible_objects
+
+        self.applied = {attribute["trait_type"]: str(attribute["value"]) for attribute in json_attributes}
+        return changed
+
+
+preview_scene = PreviewScene()
+
+
+class PreviewChannel():
+    """ Latest-wins preview requests in the API and the results pushed to the browsers
+
+    Only one preview renders at a time. Traits submitted meanwhile replace each other, so a burst
+    of changes costs one more preview instead of a queue of stale ones.
+    """
+
+    def __init__(self):
+        self.sequence = 0
+        self.pending: tuple[int, list[dict], float] = None
+        self.running: tuple[int, str, float] = None
+        self.latest: dict = None
+        self.updated = asyncio.Event()
+        self.poller: asyncio.Task = None
+
+    def submit(self, json_attributes: list[dict]) -> int:
+        self.sequence += 1
+        self.pending = (self.sequence, json_attributes, time.perf_counter())
+        if self.poller is None or self.poller.done():
+            self.poller = asyncio.get_running_loop().create_task(self.run())
+        return self.sequence
+
+    def send_pending(self):
+        sequence, json_attributes, submitted_at = self.pending
+        self.pending = None
+        task = current_app.send_task("preview:preview_glb_task", args=[json_attributes])
+        self.running = (sequence, task.id, submitted_at)
+
+    def publish(self, preview: dict):
+        self.latest = preview
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def collect_running(self):
+        sequence, task_id, submitted_at = self.running
+        result = AsyncResult(task_id)
+        if not result.ready():
+            return
+        self.running = None
+        preview = {"sequence": sequence, "seconds": time.perf_counter() - submitted_at}
+        if result.successful():
+            preview.update(result.result)
+        else:
+            preview["error"] = str(result.result)
+        metrics.observe("shaderverse_preview_seconds", preview["seconds"], {"result": "error" if "error" in preview else "ok"})
+        self.publish(preview)
+
+    async def run(self):
+        while self.pending or self.running:
+            if self.running:
+                self.collect_running()
+            if self.pending and not self.running:
+                self.send_pending()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def stream(self):
+        """ Server-sent events with every preview from the latest one on """
+        if self.latest:
+            yield f"data: {json.dumps(self.latest)}\n\n"
+        while True:
+            await self.updated.wait()
+            yield f"data: {json.dumps(self.latest)}\n\n"
+
+
+preview_channel = PreviewChannel()
@@ -0,0 +1,83 @@
+import cProfile
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from shaderverse.api.utils import get_temporary_directory, get_rendered_file_url
+
+SAMPLE_INTERVAL = 0.005
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """ Sample the stack of another thread at a fixed interval and count collapsed stacks """
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(format_frame(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write_collapsed(self, filepath: Path):
+        """ Write the samples in the collapsed stack format read by flamegraph.pl and speedscope """
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        filepath.write_text("\n".join(lines) + "\n")
+
+
+class TaskProfile():
+    """ Profile artifacts of a single task, named after the task id """
+
+    def __init__(self, enabled: bool, task_id: str):
+        self.enabled = enabled
+        self.pstats_name = f"{task_id}.pstats"
+        self.collapsed_name = f"{task_id}.collapsed.txt"
+
+    def attach(self, metadata):
+        """ Link the profile artifacts from the task result """
+        if self.enabled:
+            metadata.profile_pstats_url = get_rendered_file_url(self.pstats_name)
+            metadata.profile_collapsed_url = get_rendered_file_url(self.collapsed_name)
+        return metadata
+
+
+@contextmanager
+def profile_task(enabled: bool, task_id: str):
+    """ Run the body under cProfile and a stack sampler when enabled, writing both artifacts to the rendered files directory """
+    profile = TaskProfile(enabled, task_id)
+    if not enabled:
+        yield profile
+        return
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    profiler.enable()
+    try:
+        yield profile
+    finally:
+        profiler.disable()
+        sampler.stop()
+        temp_dir = get_temporary_directory()
+        profiler.dump_stats(str(temp_dir.joinpath(profile.pstats_name)))
+        sampler.write_collapsed(temp_dir.joinpath(profile.collapsed_name))
+        print(f"wrote profile {profile.pstats_name} with {sum(sampler.stacks.values())} samples")
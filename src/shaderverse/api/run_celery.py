@@ -16,6 +16,26 @@ def get_args() -> argparse.Namespace:
                         help='number of workers', 
                         dest='concurrency', type=int, required=False,
                         default=4)
+
+    parser.add_argument('--queues',
+                        help='comma separated queues to consume',
+                        dest='queues', type=str, required=False,
+                        default="celery,render_interactive,generate_interactive,render,generate,render_bulk,generate_bulk")
+
+    parser.add_argument('--hostname',
+                        help='node name of the worker, unique per worker process',
+                        dest='hostname', type=str, required=False,
+                        default=None)
+
+    parser.add_argument('--polling-interval',
+                        help='seconds between broker polls, lower for the live preview worker',
+                        dest='polling_interval', type=float, required=False,
+                        default=None)
+
+    parser.add_argument('--pool',
+                        help='worker pool implementation',
+                        dest='pool', type=str, required=False,
+                        default="solo")
     
     python_args = sys.argv[sys.argv.index("--")+1:]
     args, unknown = parser.parse_known_args(args=python_args)
@@ -39,10 +59,15 @@ if __name__ == '__main__':
     #     logfile=str(temp_file_path)
     # )
 
+    if args.polling_interval is not None:
+        app.conf.broker_transport_options = {"polling_interval": args.polling_interval}
+
     worker = app.Worker(
         loglevel='INFO',
         concurrency=args.concurrency,
-        pool='solo'
+        pool=args.pool,
+        queues=args.queues.split(","),
+        hostname=args.hostname
     )
     
 
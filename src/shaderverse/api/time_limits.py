@@ -0,0 +1,166 @@
+import inspect
+import json
+import os
+import sqlite3
+import time
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import task_received, task_prerun, task_postrun, worker_shutdown
+from shaderverse.api import metrics
+from shaderverse.api.config.celery_config import settings, route_task
+
+TASK_FORMATS = {
+    "generate:generate_task": "metadata",
+    "generate:rarity_task": "rarity",
+    "render:render_glb_task": "glb",
+    "render:render_vrm_task": "vrm",
+    "render:render_fbx_task": "fbx",
+    "render:render_jpeg_task": "jpeg",
+    "optimize:optimize_glb_task": "optimize",
+    "preview:preview_glb_task": "preview",
+}
+DEFAULT_FORMAT = "glb"
+# the render the jpeg limits are meant for, bigger renders get proportionally more time
+JPEG_REFERENCE_COST = 720 * 720 * 64
+# stages that clean up after a task, which still run once it passed its soft limit
+CLEANUP_STAGES = {"revert"}
+
+# name, start and soft limit of the task this process runs, kept in memory so that the limit
+# holds when the metrics database can't be written
+running_task: tuple[str, float, float] = None
+
+
+def get_arguments(task, args, kwargs) -> dict:
+    """ The arguments of a task call, with the defaults of the ones left out """
+    try:
+        bound = inspect.signature(task.run).bind(*(args or ()), **(kwargs or {}))
+    except (TypeError, ValueError):
+        return dict(kwargs or {})
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+
+def get_format_time_limits(render_format: str, arguments: dict = None) -> tuple[float, float]:
+    """ The soft and hard time limits of a format and, for jpeg, of its resolution and samples """
+    soft_limit, hard_limit = settings.task_time_limits.get(render_format, settings.task_time_limits[DEFAULT_FORMAT])
+    if render_format == "jpeg":
+        arguments = arguments or {}
+        cost = arguments.get("resolution_x", 720) * arguments.get("resolution_y", 720) * arguments.get("samples", 64)
+        scale = max(1.0, cost / JPEG_REFERENCE_COST)
+        soft_limit, hard_limit = soft_limit * scale, hard_limit * scale
+    return soft_limit, hard_limit
+
+
+def get_time_limits(task, args=None, kwargs=None) -> tuple[float, float]:
+    """ The soft and hard time limits of a task call """
+    return get_format_time_limits(TASK_FORMATS.get(task.name, DEFAULT_FORMAT), get_arguments(task, args, kwargs))
+
+
+def get_message(request) -> dict:
+    """ What it takes to send a received task again with the same id, chain and group """
+    payload = request.message.payload
+    embed = payload[2] if isinstance(payload, (list, tuple)) and len(payload) == 3 else {}
+    request_dict = request.request_dict
+    queue = request.delivery_info.get("routing_key") or route_task(request.name, request.args, request.kwargs, {})["queue"]
+    return {
+        "task": request.name,
+        "args": list(request.args or ()),
+        "kwargs": dict(request.kwargs or {}),
+        "queue": queue,
+        "options": {
+            "group_id": request_dict.get("group"),
+            "group_index": request_dict.get("group_index"),
+            "root_id": request_dict.get("root_id"),
+            "parent_id": request_dict.get("parent_id"),
+            "retries": request_dict.get("retries") or 0,
+            "eta": request_dict.get("eta"),
+            "chain": embed.get("chain"),
+            "link": embed.get("callbacks"),
+            "link_error": embed.get("errbacks"),
+            "chord": embed.get("chord"),
+        },
+    }
+
+
+@task_received.connect
+def handle_task_received(sender=None, request=None, **kwargs):
+    """ Keep the tasks a worker holds before running them, the broker forgets them once delivered """
+    try:
+        with metrics.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO task_reserved VALUES (?, ?, ?, ?)",
+                               (request.id, os.getpid(), json.dumps(get_message(request), default=str), time.time()))
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Could not record the received task: {e}")
+
+
+@task_prerun.connect
+def handle_task_prerun(sender=None, task_id=None, task=None, args=None, kwargs=None, **kw):
+    global running_task
+    soft_limit, hard_limit = get_time_limits(task, args, kwargs)
+    running_task = (task.name, time.time(), soft_limit)
+    try:
+        with metrics.connect() as connection:
+            connection.execute("DELETE FROM task_reserved WHERE task_id = ?", (task_id,))
+            connection.execute(
+                "INSERT OR REPLACE INTO task_run VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.getpid(), task_id, task.name, "started", json.dumps({"args": list(args or ()), "kwargs": dict(kwargs or {})}, default=str),
+                 time.time(), soft_limit, hard_limit))
+    except sqlite3.Error as e:
+        print(f"Could not record the running task: {e}")
+
+
+@task_postrun.connect
+def handle_task_postrun(sender=None, task_id=None, **kwargs):
+    global running_task
+    running_task = None
+    try:
+        with metrics.connect() as connection:
+            connection.execute("DELETE FROM task_run WHERE pid = ? AND task_id = ?", (os.getpid(), task_id))
+    except sqlite3.Error as e:
+        print(f"Could not clear the running task: {e}")
+
+
+def check_soft_limit(stage_name: str):
+    """ Fail the running task before it starts a stage once it passed its soft limit """
+    if running_task is None or stage_name in CLEANUP_STAGES:
+        return
+    task_name, started_at, soft_limit = running_task
+    if soft_limit and time.time() - started_at > soft_limit:
+        raise SoftTimeLimitExceeded(f"{task_name} passed its soft limit of {soft_limit:.0f}s before {stage_name}")
+
+
+@worker_shutdown.connect
+def handle_worker_shutdown(sender=None, **kwargs):
+    """ A warm shutdown returns the held tasks to the broker itself """
+    try:
+        forget_processes({os.getpid()})
+    except sqlite3.Error as e:
+        print(f"Could not clear the held tasks: {e}")
+
+
+def get_task_runs(pids: set[int]) -> list[dict]:
+    """ The tasks run by the given processes """
+    with metrics.connect() as connection:
+        connection.row_factory = sqlite3.Row
+        rows = connection.execute("SELECT * FROM task_run").fetchall()
+    return [dict(row) for row in rows if row["pid"] in pids]
+
+
+def get_expired_runs(pids: set[int]) -> list[dict]:
+    """ The tasks run by the given processes that passed their hard limit """
+    now = time.time()
+    return [run for run in get_task_runs(pids) if now - run["started_at"] > run["hard_limit"]]
+
+
+def get_reserved_messages(pids: set[int]) -> list[dict]:
+    """ The tasks received by the given processes that haven't started """
+    with metrics.connect() as connection:
+        rows = connection.execute("SELECT task_id, pid, message FROM task_reserved").fetchall()
+    return [dict(json.loads(message), task_id=task_id) for task_id, pid, message in rows if pid in pids]
+
+
+def forget_processes(pids: set[int]):
+    """ Remove the running and held tasks of killed processes """
+    with metrics.connect() as connection:
+        for pid in pids:
+            connection.execute("DELETE FROM task_run WHERE pid = ?", (pid,))
+            connection.execute("DELETE FROM task_reserved WHERE pid = ?", (pid,))
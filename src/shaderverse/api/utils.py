@@ -10,4 +10,19 @@ def get_temporary_directory(directory_name: str = 'tmp') -> Path:
 
     temp_dir.mkdir(parents=True, exist_ok=True)
 
-    return temp_dir
\ No newline at end of file
+    return temp_dir
+
+def get_rendered_file_url(file_name: str) -> str:
+    """ Return the url the API serves a file in the temporary directory from """
+    return f"http://localhost:8118/rendered/{file_name}"
+
+def get_broker_reset_path() -> Path:
+    """ Return the file holding the time the broker database was last deleted """
+    return get_temporary_directory().joinpath("broker_reset")
+
+def get_broker_reset_time() -> float:
+    """ Return when queued messages were last lost with the broker database, 0 if never """
+    try:
+        return float(get_broker_reset_path().read_text())
+    except (OSError, ValueError):
+        return 0.0
@@ -0,0 +1,101 @@
+import os
+import signal
+import threading
+import time
+import bpy
+import psutil
+from celery.signals import worker_ready, task_postrun
+from shaderverse.api import metrics
+from shaderverse.api.config.celery_config import settings
+
+DATABLOCK_TYPES = ("objects", "meshes", "materials", "images", "collections", "node_groups", "actions", "armatures")
+
+consumer = None
+consumer_thread = None
+task_count = 0
+is_recycling = False
+
+
+def get_rss() -> int:
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def get_datablock_counts() -> dict[str, int]:
+    """ Count the datablocks of the types that pile up between items """
+    return {datablock_type: len(getattr(bpy.data, datablock_type)) for datablock_type in DATABLOCK_TYPES}
+
+
+def purge_orphans() -> int:
+    """ Remove datablocks without users, including ones only used by other orphans """
+    if hasattr(bpy.data, "orphans_purge"):
+        return bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+    before = sum(get_datablock_counts().values())
+    bpy.ops.outliner.orphans_purge(do_recursive=True)
+    return before - sum(get_datablock_counts().values())
+
+
+def get_recycle_reason(rss: int) -> tuple[str, str] | None:
+    """ The metric label and the description of why the worker should be recycled """
+    max_tasks = settings.worker_recycle_max_tasks
+    max_rss = settings.worker_recycle_max_rss_mb * 1024 * 1024
+    if max_tasks and task_count >= max_tasks:
+        return "tasks", f"ran {task_count} tasks"
+    if max_rss and rss >= max_rss:
+        return "rss", f"uses {rss // (1024 * 1024)} MB"
+    return None
+
+
+def shutdown():
+    """ Warm shutdown, returning anything still reserved to the queue """
+    print("Recycled worker was not replaced in time, shutting down")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def request_recycle(label: str, reason: str):
+    """ Stop consuming and ask the supervisor for a fresh worker
+
+    The supervisor starts the replacement and asks this worker for a warm shutdown once the
+    replacement is healthy, so the running task finishes and queued tasks keep waiting in the broker.
+    """
+    global is_recycling
+    is_recycling = True
+    print(f"Recycling worker {os.getpid()}: {reason}")
+    metrics.set_worker_state("recycling", hostname=consumer.hostname)
+    metrics.increment("shaderverse_worker_recycles_total", {"reason": label})
+    for queue in list(consumer.task_consumer.queues):
+        consumer.cancel_task_queue(queue.name)
+    timer = threading.Timer(settings.worker_recycle_grace_seconds, shutdown)
+    timer.daemon = True
+    timer.start()
+
+
+@worker_ready.connect
+def handle_worker_ready(sender=None, **kwargs):
+    global consumer, consumer_thread
+    consumer = sender
+    consumer_thread = (os.getpid(), threading.get_ident())
+    # operators registered with UNDO would otherwise keep a copy of the scene per step
+    bpy.context.preferences.edit.undo_steps = 0
+
+
+@task_postrun.connect
+def handle_task_postrun(sender=None, task=None, **kwargs):
+    """ Purge orphan datablocks after every task and recycle the worker when it has grown too much """
+    global task_count
+    # only solo pool workers run tasks in the process and thread that got worker_ready
+    if consumer_thread != (os.getpid(), threading.get_ident()) or is_recycling:
+        return
+    task_count += 1
+
+    start_time = time.perf_counter()
+    purged = purge_orphans()
+    metrics.observe("shaderverse_task_stage_seconds", time.perf_counter() - start_time, {"task": task.name, "stage": "orphans_purge"})
+
+    rss = get_rss()
+    datablocks = get_datablock_counts()
+    metrics.set_worker_memory(rss, task_count, datablocks)
+    print(f"memory after {task.name}: {rss // (1024 * 1024)} MB, purged {purged} orphans, {datablocks}")
+
+    recycle_reason = get_recycle_reason(rss)
+    if recycle_reason:
+        request_recycle(*recycle_reason)
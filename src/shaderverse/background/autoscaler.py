@@ -0,0 +1,160 @@
+import json
+import math
+import os
+import time
+import urllib.request
+from typing import Callable
+import psutil
+from shaderverse.api.config.celery_config import get_lane_queues
+from .supervisor import Supervisor, SupervisedService, ServiceHealth
+
+# queues consumed by the Blender workers, the optimize queue has its own pool
+INTERACTIVE_QUEUES = get_lane_queues("interactive")
+WORKER_QUEUES = ["celery"] + get_lane_queues("interactive", "normal", "bulk")
+
+SCALE_INTERVAL = 10.0
+IDLE_COOLDOWN = 120.0
+MAX_STEP = 2
+CPU_SATURATION = 90.0
+MEMORY_RESERVE = 1024 * 1024 * 1024
+DEFAULT_WORKER_RSS = 1024 * 1024 * 1024
+
+
+def get_default_max_workers() -> int:
+    """ One worker per two cores, capped by one worker per 2 GB of memory """
+    cores = os.cpu_count() or 1
+    memory_workers = psutil.virtual_memory().total // (2 * 1024 * 1024 * 1024)
+    return max(1, min(cores // 2, memory_workers))
+
+
+def get_queue_depths(url: str, timeout: float = 2.0) -> dict[str, int] | None:
+    """ Read the queue depths from the API, or None while it is unavailable """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+class Autoscaler():
+    """ Grow and shrink the Blender worker pool between min and max workers
+
+    Workers are added while tasks are queued and every worker is busy, limited by the memory
+    free for another worker and by CPU saturation. A worker that has been idle for the
+    cooldown with nothing queued is shut down gracefully, down to the minimum.
+
+    The first reserved workers only consume the interactive lane and are never scaled down,
+    so a preview never waits behind a bulk batch that keeps every other worker busy.
+    """
+
+    def __init__(self, supervisor: Supervisor, start_worker: Callable[[int, list[str]], SupervisedService], queues_url: str,
+                 min_workers: int = 1, max_workers: int = 0, reserved_workers: int = 1, cooldown: float = IDLE_COOLDOWN, interval: float = SCALE_INTERVAL):
+        self.supervisor = supervisor
+        self.start_worker = start_worker
+        self.queues_url = queues_url
+        self.max_workers = max_workers or get_default_max_workers()
+        # leave at least one worker for the other lanes
+        self.reserved_workers = min(max(reserved_workers, 0), self.max_workers - 1)
+        self.min_workers = min(max(min_workers, self.reserved_workers), self.max_workers)
+        self.cooldown = cooldown
+        self.interval = interval
+        self.workers: list[SupervisedService] = []
+        self.idle_since: dict[SupervisedService, float] = {}
+        self.next_check = 0.0
+        self.detail = ""
+        # prime cpu_percent so the first reading covers the time since start
+        psutil.cpu_percent(interval=None)
+
+    def start(self):
+        for _ in range(self.min_workers):
+            self.add_worker()
+
+    def add_worker(self):
+        used = {worker.index for worker in self.workers}
+        index = next(index for index in range(1, len(self.workers) + 2) if index not in used)
+        worker = self.start_worker(index, self.get_worker_queues(index))
+        worker.index = index
+        self.supervisor.add_service(worker)
+        self.workers.append(worker)
+
+    def get_worker_queues(self, index: int) -> list[str]:
+        if index <= self.reserved_workers:
+            return INTERACTIVE_QUEUES
+        return WORKER_QUEUES
+
+    def remove_worker(self, worker: SupervisedService):
+        print(f"Scaling down {worker.name}")
+        self.supervisor.remove_service(worker)
+        self.workers.remove(worker)
+        self.idle_since.pop(worker, None)
+
+    def get_worker_state(self, worker: SupervisedService) -> str:
+        """ busy, idle or starting """
+        from shaderverse.api import metrics
+        if worker.health != ServiceHealth.healthy:
+            return "starting"
+        states = metrics.get_worker_states(worker.service.get_pids())
+        return "busy" if "busy" in states.values() else "idle"
+
+    def get_worker_rss(self) -> int:
+        """ Average resident memory of the running workers """
+        sizes = []
+        for worker in self.workers:
+            for pid in worker.service.get_pids():
+                try:
+                    sizes.append(psutil.Process(pid).memory_info().rss)
+                except psutil.NoSuchProcess:
+                    pass
+        largest = [size for size in sizes if size > 100 * 1024 * 1024]
+        return sum(largest) // len(largest) if largest else DEFAULT_WORKER_RSS
+
+    def get_memory_headroom(self) -> int:
+        """ Number of workers that fit in the free memory """
+        available = psutil.virtual_memory().available - MEMORY_RESERVE
+        return max(0, math.floor(available / self.get_worker_rss()))
+
+    def refresh(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + self.interval
+
+        depths = get_queue_depths(self.queues_url)
+        if depths is None:
+            return
+        backlog = sum(depths.get(queue, 0) for queue in WORKER_QUEUES)
+        states = {worker: self.get_worker_state(worker) for worker in self.workers}
+        busy = len([worker for worker, state in states.items() if state == "busy" and worker.index > self.reserved_workers])
+
+        for worker, state in states.items():
+            if state == "idle":
+                self.idle_since.setdefault(worker, now)
+            else:
+                self.idle_since.pop(worker, None)
+
+        wanted = min(self.max_workers, max(self.min_workers, self.reserved_workers + busy + backlog))
+        missing = wanted - len(self.workers)
+        if backlog > 0 and missing > 0:
+            cpu_percent = psutil.cpu_percent(interval=None)
+            headroom = self.get_memory_headroom()
+            step = min(missing, headroom, MAX_STEP)
+            if cpu_percent >= CPU_SATURATION:
+                self.detail = f"{backlog} queued, CPU saturated at {cpu_percent:.0f}%"
+            elif step < 1:
+                self.detail = f"{backlog} queued, no memory for another worker"
+            else:
+                print(f"Scaling up by {step} for {backlog} queued tasks")
+                for _ in range(step):
+                    self.add_worker()
+                self.detail = f"{backlog} queued, scaling up"
+            return
+
+        self.detail = f"{backlog} queued" if backlog else ""
+        if backlog == 0 and len(self.workers) > self.min_workers:
+            idle_workers = [worker for worker, since in self.idle_since.items()
+                            if now - since >= self.cooldown and worker.index > self.reserved_workers]
+            if idle_workers:
+                self.remove_worker(max(idle_workers, key=lambda worker: worker.index))
+
+    def get_status(self) -> str:
+        return f"{len(self.workers)} of {self.min_workers}-{self.max_workers} workers {self.detail}".strip()
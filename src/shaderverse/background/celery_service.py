@@ -3,14 +3,19 @@ from .service import Service
 from pathlib import Path
 
 class CeleryService(Service):
+    log_name = "celery"
     blender_binary_path = bpy.app.binary_path
     blend_file = bpy.data.filepath
     script_path = Path(__file__).parent.absolute()
     api_path = Path(Path(script_path).parent.absolute(), "api", "run_celery.py")
 
-    def __init__(self, workers: int = 1):
+    def __init__(self, workers: int = 1, hostname: str = None, queues: list[str] = None):
         self.workers = workers
         print(f"Starting Celery with {self.workers} workers")
         self.cmd = [self.blender_binary_path, self.blend_file, "--background",  "--python", str(self.api_path), "--", "--concurrency", str(self.workers)]
+        if hostname:
+            self.cmd += ["--hostname", hostname]
+        if queues:
+            self.cmd += ["--queues", ",".join(queues)]
         super().__init__(self.cmd)
         self.execute()
\ No newline at end of file
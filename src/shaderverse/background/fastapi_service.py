@@ -5,6 +5,7 @@ from pathlib import Path
 
 class FastapiService(Service):
     port = "8118"  # you don't need to generate this from ID or anything - just make sure the port is valid and unoccupied
+    log_name = "fastapi"
     blender_binary_path = bpy.app.binary_path
     blend_file = bpy.data.filepath
     script_path = Path(__file__).parent.absolute()
@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import IO
+from shaderverse.api.utils import get_temporary_directory
+
+MAX_LOG_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+TAIL_LINES = 500
+
+
+def get_log_path(name: str) -> Path:
+    """ Return the current log file of a background service """
+    log_dir = get_temporary_directory().joinpath("logs")
+    log_dir.mkdir(parents=True, exist_ok=True)
+    return log_dir.joinpath(f"{name}.log")
+
+
+def get_log_names() -> list[str]:
+    """ Return the names of the services that have written logs """
+    return sorted(path.stem for path in get_temporary_directory().joinpath("logs").glob("*.log"))
+
+
+def read_log_tail(name: str, lines: int = 100, block_size: int = 8192) -> list[str]:
+    """ Read the last lines of a service log from the end of the file, without loading all of it """
+    log_path = get_log_path(name)
+    if not log_path.exists():
+        return []
+    with open(log_path, "rb") as log_file:
+        log_file.seek(0, os.SEEK_END)
+        position = log_file.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            log_file.seek(position)
+            data = log_file.read(read_size) + data
+    return data.decode("utf-8", errors="replace").splitlines()[-lines:]
+
+
+def get_service_logger(name: str) -> logging.Logger:
+    """ Return a logger writing raw lines to the size rotated log file of a service """
+    logger = logging.getLogger(f"shaderverse.service.{name}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if not logger.handlers:
+        handler = RotatingFileHandler(get_log_path(name), maxBytes=MAX_LOG_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    return logger
+
+
+class LogCapture(threading.Thread):
+    """ Drain the output of a process continuously into rotated log files and a bounded in-memory tail
+
+    The pipe is read as fast as the process writes it, so a chatty service never blocks on a full pipe.
+    """
+
+    def __init__(self, name: str, stream: IO[bytes], tail_lines: int = TAIL_LINES):
+        super().__init__(daemon=True, name=f"log-{name}")
+        self.stream = stream
+        self.logger = get_service_logger(name)
+        self.tail: deque[str] = deque(maxlen=tail_lines)
+        self.lock = threading.Lock()
+
+    def run(self):
+        for raw_line in iter(self.stream.readline, b""):
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\r\n")
+            with self.lock:
+                self.tail.append(line)
+            self.logger.info(line)
+        self.stream.close()
+
+    def get_tail(self, lines: int = TAIL_LINES) -> list[str]:
+        with self.lock:
+            return list(self.tail)[-lines:]
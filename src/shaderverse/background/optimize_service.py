@@ -0,0 +1,22 @@
+import os
+import platform
+import bpy
+from .service import Service
+from pathlib import Path
+
+class OptimizeService(Service):
+    """ Celery worker with a process pool that consumes the optimize queue, so Blender workers are freed right after export """
+    log_name = "optimize"
+    blender_binary_path = bpy.app.binary_path
+    blend_file = bpy.data.filepath
+    script_path = Path(__file__).parent.absolute()
+    api_path = Path(Path(script_path).parent.absolute(), "api", "run_celery.py")
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        # billiard can't spawn Blender's embedded interpreter on Windows
+        pool = "threads" if platform.system() == "Windows" else "prefork"
+        print(f"Starting optimizer with {self.workers} {pool} workers")
+        self.cmd = [self.blender_binary_path, self.blend_file, "--background",  "--python", str(self.api_path), "--", "--concurrency", str(self.workers), "--queues", "optimize", "--pool", pool]
+        super().__init__(self.cmd)
+        self.execute()
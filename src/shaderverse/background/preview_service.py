@@ -0,0 +1,18 @@
+import bpy
+from .service import Service
+from pathlib import Path
+
+class PreviewService(Service):
+    """ Celery worker that keeps the scene resident for the live preview and polls its queue often """
+    log_name = "preview"
+    blender_binary_path = bpy.app.binary_path
+    blend_file = bpy.data.filepath
+    script_path = Path(__file__).parent.absolute()
+    api_path = Path(Path(script_path).parent.absolute(), "api", "run_celery.py")
+    polling_interval = 0.05
+
+    def __init__(self):
+        print("Starting live preview worker")
+        self.cmd = [self.blender_binary_path, self.blend_file, "--background",  "--python", str(self.api_path), "--", "--concurrency", "1", "--queues", "preview", "--hostname", "preview@%h", "--polling-interval", str(self.polling_interval)]
+        super().__init__(self.cmd)
+        self.execute()
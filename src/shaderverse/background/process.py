@@ -2,6 +2,7 @@ import subprocess
 from enum import Enum   
 from pathlib import Path
 import platform
+from .log_capture import LogCapture
 
 class Status(str, Enum):
     """Status of the fetch"""
@@ -19,6 +20,8 @@ class Process:
  
     status: status = Status.pending
     process: subprocess.Popen[bytes] = None
+    log_name: str = "process"
+    log_capture: LogCapture = None
      
     def __init__(self, cmd: list[str] = None):
 
@@ -34,9 +37,12 @@ class Process:
 
         print(f"Running command: {self.cmd}")
         if platform.system() == "Windows":
-            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, shell=True)
+            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
         else:
-            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE)
+            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # drain the output in the background so the process never waits on a full pipe
+        self.log_capture = LogCapture(self.log_name, self.process.stdout)
+        self.log_capture.start()
         self.result = ""       
 
 
@@ -63,23 +69,18 @@ class Process:
     
 
     def refresh_result(self):
-        """ Refresh the result of the process"""
-        outs = None
-        errs = None
-        try:
-            outs, errs = self.process.communicate(timeout=0.1)
-            self.status = Status.completed
-            if outs:
-                self.result = outs.decode().strip()
-            if errs:
-                self.result = errs.decode().strip()
-        except subprocess.TimeoutExpired:
+        """ Refresh the status and the latest output of the process without waiting on it"""
+        if self.process.poll() is None:
             self.status = Status.running
-            if outs:
-                self.result = outs.decode().strip()
-            if errs:
-                self.result = errs.decode().strip()
-            # outs, errs = self.process.communicate()
+        else:
+            self.status = Status.completed
+        self.result = "\n".join(self.get_tail(20))
+
+    def get_tail(self, lines: int = 100) -> list[str]:
+        """ Return the latest lines written by the process"""
+        if self.log_capture is None:
+            return []
+        return self.log_capture.get_tail(lines)
         
 
     @property
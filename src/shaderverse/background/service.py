@@ -12,5 +12,29 @@ class Service(Process):
 
     def kill(self):
         global is_initialized
-        process = psutil.Process(self.process.pid)
-        self.kill_process_recursively(process)
\ No newline at end of file
+        try:
+            process = psutil.Process(self.process.pid)
+            self.kill_process_recursively(process)
+        except psutil.NoSuchProcess:
+            pass
+
+    def terminate(self):
+        """ Ask the process and the processes it started to shut down gracefully"""
+        try:
+            process = psutil.Process(self.process.pid)
+            for proc in [process] + process.children(recursive=True):
+                proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+    def is_alive(self) -> bool:
+        """ Check whether the process is still running without waiting on its output"""
+        return self.process is not None and self.process.poll() is None
+
+    def get_pids(self) -> set[int]:
+        """ The pid of the process and of every process it started"""
+        try:
+            process = psutil.Process(self.process.pid)
+            return {process.pid} | {child.pid for child in process.children(recursive=True)}
+        except psutil.NoSuchProcess:
+            return set()
\ No newline at end of file
@@ -0,0 +1,255 @@
+import threading
+import time
+import urllib.request
+from enum import Enum
+from typing import Callable
+from shaderverse.api.config.celery_config import settings
+from .service import Service
+from .watchdog import kill_recycled_worker
+
+CHECK_INTERVAL = 2.0
+STARTUP_GRACE = 180.0
+HEARTBEAT_TIMEOUT = 300.0
+RESTART_BACKOFF_BASE = 1.0
+RESTART_BACKOFF_MAX = 60.0
+STABLE_AFTER = 60.0
+
+
+class ServiceHealth(str, Enum):
+    """Health of a supervised service"""
+    starting="starting"
+    healthy="healthy"
+    unhealthy="unhealthy"
+    restarting="restarting"
+    stopped="stopped"
+
+
+def check_http(url: str, timeout: float = 2.0) -> bool:
+    """ Check that a url answers with a 2xx status """
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except OSError:
+        return False
+
+
+def check_heartbeat(service: Service, timeout: float = HEARTBEAT_TIMEOUT) -> bool:
+    """ Check that a worker started by the service has sent a heartbeat recently """
+    from shaderverse.api import metrics
+    try:
+        heartbeats = metrics.get_heartbeats(service.get_pids())
+    except Exception as e:
+        print(f"Could not read heartbeats: {e}")
+        return True
+    return any(time.time() - updated_at < timeout for updated_at in heartbeats.values())
+
+
+def check_recycle(service: Service) -> bool:
+    """ Check whether a worker started by the service asked to be replaced """
+    from shaderverse.api import metrics
+    try:
+        states = metrics.get_worker_states(service.get_pids())
+    except Exception as e:
+        print(f"Could not read worker states: {e}")
+        return False
+    return "recycling" in states.values()
+
+
+class SupervisedService():
+    """ A service, how to start it again and how to tell that it works """
+
+    def __init__(self, name: str, start: Callable[[], Service], check: Callable[[Service], bool], recycle: Callable[[Service], bool] = None, group: str = None,
+                 timeout: Callable[[Service], str | None] = None):
+        self.name = name
+        self.group = group or name
+        self.index = 0
+        self.start = start
+        self.check = check
+        self.recycle = recycle
+        self.timeout = timeout
+        self.service: Service = None
+        self.retiring: list[Service] = []
+        # recycled or drained instances asked to shut down, with the time they get killed if they haven't
+        self.draining: dict[Service, float] = {}
+        self.health = ServiceHealth.stopped
+        self.started_at = 0.0
+        self.healthy_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+        self.detail = ""
+
+    def launch(self):
+        self.service = self.start()
+        self.started_at = time.monotonic()
+        self.healthy_at = 0.0
+        self.health = ServiceHealth.starting
+        self.detail = ""
+
+    def fail(self, reason: str):
+        """ Kill the service and schedule a restart with exponential backoff """
+        print(f"{self.name} failed: {reason}")
+        if self.service:
+            self.service.kill()
+        delay = min(RESTART_BACKOFF_BASE * 2 ** self.failures, RESTART_BACKOFF_MAX)
+        self.failures += 1
+        self.restart_at = time.monotonic() + delay
+        self.health = ServiceHealth.restarting
+        self.detail = f"{reason}, restarting in {delay:.0f}s"
+
+    def refresh(self):
+        """ Check the service once, restarting it when its backoff has elapsed """
+        now = time.monotonic()
+        self.reap()
+        if self.health == ServiceHealth.restarting:
+            if now >= self.restart_at:
+                print(f"Restarting {self.name} (attempt {self.failures})")
+                self.launch()
+            return
+
+        if not self.service.is_alive():
+            self.fail(f"exited with {self.service.process.returncode}")
+            return
+
+        # a hung task can keep the heartbeat thread from running, so time limits are checked first
+        reason = self.timeout(self.service) if self.timeout else None
+        if reason:
+            self.fail(reason)
+            return
+
+        if self.check(self.service):
+            if self.health != ServiceHealth.healthy:
+                self.healthy_at = now
+            self.health = ServiceHealth.healthy
+            self.detail = ""
+            self.retire()
+            if self.recycle and self.recycle(self.service):
+                self.replace()
+                return
+            if self.failures and now - self.healthy_at > STABLE_AFTER:
+                self.failures = 0
+        elif self.health == ServiceHealth.starting and now - self.started_at < STARTUP_GRACE:
+            self.detail = f"waiting {now - self.started_at:.0f}s"
+        else:
+            self.fail("health check failed")
+
+    def replace(self):
+        """ Start a fresh instance next to one that asked to be recycled """
+        print(f"Replacing {self.name}")
+        self.retiring.append(self.service)
+        self.launch()
+        self.detail = "replacing a recycled worker"
+
+    def retire(self):
+        """ Ask recycled instances to shut down once their replacement is healthy
+
+        A warm shutdown lets the running task finish and returns the tasks the worker held to the broker.
+        """
+        for service in self.retiring:
+            service.terminate()
+            self.draining[service] = time.monotonic() + settings.worker_recycle_grace_seconds
+        self.retiring = []
+
+    def reap(self):
+        """ Forget instances asked to shut down that exited, kill the ones still running after the grace period """
+        now = time.monotonic()
+        for service, deadline in list(self.draining.items()):
+            if not service.is_alive():
+                del self.draining[service]
+            elif now >= deadline:
+                print(f"Killing a {self.name} that didn't shut down")
+                kill_recycled_worker(service)
+                del self.draining[service]
+
+    def get_tail(self, lines: int) -> list[str]:
+        if self.service is None:
+            return []
+        return self.service.get_tail(lines)
+
+    def stop(self):
+        if self.service and self.health != ServiceHealth.restarting:
+            self.service.kill()
+        for service in self.retiring + list(self.draining):
+            service.kill()
+        self.retiring = []
+        self.draining = {}
+        self.health = ServiceHealth.stopped
+        self.detail = ""
+
+    def drain(self):
+        """ Let the service finish what it is doing and exit, it is killed like a recycled one if it doesn't """
+        if self.service and self.health != ServiceHealth.restarting:
+            self.retiring.append(self.service)
+        self.service = None
+        self.retire()
+        self.health = ServiceHealth.stopped
+        self.detail = ""
+
+
+class Supervisor(threading.Thread):
+    """ Watch the background services off the UI thread and restart only the ones that fail """
+
+    def __init__(self, services: list[SupervisedService], interval: float = CHECK_INTERVAL):
+        super().__init__(daemon=True)
+        self.services = services
+        self.interval = interval
+        self.autoscaler = None
+        self.stopped = threading.Event()
+        self.lock = threading.RLock()
+        # removed services whose instances haven't exited yet
+        self.draining: list[SupervisedService] = []
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                for supervised in list(self.services):
+                    try:
+                        supervised.refresh()
+                    except Exception as e:
+                        print(f"Could not check {supervised.name}: {e}")
+                for supervised in list(self.draining):
+                    try:
+                        supervised.reap()
+                    except Exception as e:
+                        print(f"Could not check {supervised.name}: {e}")
+                    if not supervised.draining:
+                        self.draining.remove(supervised)
+                if self.autoscaler:
+                    try:
+                        self.autoscaler.refresh()
+                    except Exception as e:
+                        print(f"Could not autoscale: {e}")
+
+    def add_service(self, supervised: SupervisedService):
+        with self.lock:
+            supervised.launch()
+            self.services.append(supervised)
+
+    def remove_service(self, supervised: SupervisedService):
+        with self.lock:
+            supervised.drain()
+            self.services.remove(supervised)
+            self.draining.append(supervised)
+
+    def start_services(self):
+        for supervised in self.services:
+            supervised.launch()
+        self.start()
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            for supervised in self.services + self.draining:
+                supervised.stop()
+            self.draining = []
+
+    def get_status(self) -> list[tuple[str, ServiceHealth, str]]:
+        """ Name, health and detail of every service, for the panel """
+        return [(supervised.name, supervised.health, supervised.detail) for supervised in self.services]
+
+    def get_tail(self, name: str, lines: int = 100) -> list[str]:
+        """ The latest output of a service or a group of services, for the panel """
+        tail = []
+        for supervised in list(self.services):
+            if supervised.name == name or supervised.group == name:
+                tail += supervised.get_tail(lines)
+        return tail[-lines:]
@@ -0,0 +1,94 @@
+import json
+import time
+from typing import Callable
+from .service import Service
+
+celery_app = None
+
+
+def get_celery_app():
+    """ The Celery app, configured on first use so that the supervisor can talk to the broker and result backend """
+    global celery_app
+    if celery_app is None:
+        from shaderverse.api.config.celery_utils import create_celery
+        celery_app = create_celery()
+    return celery_app
+
+
+def fail_lost_task(run: dict, exception: Exception, kind: str):
+    """ Store the task of a killed worker as failed, it never reaches the signals that would record it """
+    from shaderverse.api import metrics, failures, batch_manifest
+    get_celery_app().backend.mark_as_failure(run["task_id"], exception)
+    arguments = json.loads(run["arguments"])
+    failures.record_dead_letter(run["task_id"], run["task"], exception, "", arguments["args"], arguments["kwargs"], 0)
+    batch_manifest.set_task_state(run["task_id"], batch_manifest.ItemState.failed, exception)
+    metrics.increment("shaderverse_task_failures_total", {"task": run["task"], "kind": kind})
+
+
+def requeue(message: dict):
+    """ Send a task a killed worker held back to its queue, with the same id so its batch still finds it """
+    from shaderverse.api import metrics
+    get_celery_app().send_task(message["task"], args=message["args"], kwargs=message["kwargs"], task_id=message["task_id"],
+                               queue=message["queue"], **message["options"])
+    metrics.increment("shaderverse_requeued_tasks_total", {"task": message["task"]})
+
+
+def kill_worker(service: Service, get_exception: Callable[[dict], Exception], kind: str):
+    """ Kill a worker, fail the task it was running and send the tasks it held back to their queue
+
+    The broker drops a message once it is delivered, so the tasks a worker had received but not
+    started are lost with it unless they are sent again.
+    """
+    from shaderverse.api import metrics, time_limits
+    pids = service.get_pids()
+    runs = time_limits.get_task_runs(pids)
+    service.kill()
+    for run in runs:
+        exception = get_exception(run)
+        print(f"{run['task']} {run['task_id']} failed: {exception}")
+        try:
+            fail_lost_task(run, exception, kind)
+        except Exception as e:
+            print(f"Could not mark {run['task_id']} as failed: {e}")
+    for message in time_limits.get_reserved_messages(pids):
+        print(f"Requeueing {message['task']} {message['task_id']} to {message['queue']}")
+        try:
+            requeue(message)
+        except Exception as e:
+            print(f"Could not requeue {message['task_id']}: {e}")
+    time_limits.forget_processes(pids)
+    metrics.remove_workers(pids)
+
+
+def get_timeout_error(run: dict) -> Exception:
+    from celery.exceptions import TimeLimitExceeded
+    elapsed_time = time.time() - run["started_at"]
+    return TimeLimitExceeded(f"{run['task']} passed its hard limit of {run['hard_limit']:.0f}s in stage {run['stage']} after {elapsed_time:.0f}s")
+
+
+def get_recycle_error(run: dict) -> Exception:
+    from celery.exceptions import WorkerLostError
+    return WorkerLostError(f"{run['task']} was still in stage {run['stage']} when its worker was killed for not shutting down")
+
+
+def kill_recycled_worker(service: Service):
+    """ Kill a recycled or scaled down worker that didn't shut down within its grace period """
+    kill_worker(service, get_recycle_error, "recycled")
+
+
+def enforce_time_limits(service: Service) -> str | None:
+    """ Kill a worker whose task passed its hard limit and return why
+
+    A Blender worker runs its task in the process that consumes the queue, so an export or a render
+    that never returns blocks it for good and can't be interrupted from inside. The task is stored
+    as failed with the stage it was in.
+    """
+    from shaderverse.api import metrics, time_limits
+    expired_runs = time_limits.get_expired_runs(service.get_pids())
+    if not expired_runs:
+        return None
+    for run in expired_runs:
+        metrics.increment("shaderverse_task_timeouts_total", {"task": run["task"], "stage": run["stage"]})
+    kill_worker(service, get_timeout_error, "timeout")
+    run = expired_runs[0]
+    return f"{run['task']} passed its hard limit of {run['hard_limit']:.0f}s in stage {run['stage']}"
@@ -297,6 +297,7 @@ class SHADERVERSE_PG_render(bpy.types.PropertyGroup):
     range_end: bpy.props.IntProperty(name="End Number", default=20)
     batch_name: bpy.props.StringProperty(name="Batch Name", default="batch-01")
     basepath: bpy.props.StringProperty(name="Base Path", subtype="FILE_PATH")
+    status: bpy.props.StringProperty(name="Batch Status", description="Progress of the running batch render")
   
 class SHADERVERSE_PG_scene(bpy.types.PropertyGroup):
     generated_metadata: bpy.props.StringProperty(name="Generated Meta Data")
@@ -305,6 +306,7 @@ class SHADERVERSE_PG_scene(bpy.types.PropertyGroup):
 
     render: bpy.props.PointerProperty(type=SHADERVERSE_PG_render)
     main_geonodes_object: bpy.props.PointerProperty(type=bpy.types.Object, name="Main Geometry Nodes Object")
+    seed: bpy.props.IntProperty(name="Collection Seed", description="Seed combined with each item id so that generated items can be reproduced from their id", default=0, min=0)
     
     enable_pre_generation_script: bpy.props.BoolProperty(name="Run Custom Script Before Generation", default=False)
     pre_generation_script: bpy.props.PointerProperty(name="Pre-generation Script", type=bpy.types.Text)
@@ -316,6 +318,23 @@ class SHADERVERSE_PG_scene(bpy.types.PropertyGroup):
 
     enable_materials_export: bpy.props.BoolProperty(name="Run Custom Script Before Generation", default=True)
 
+    log_service: bpy.props.EnumProperty(name="Service", description="Background service whose output is shown", items=[
+        ("API", "API", "FastAPI server"),
+        ("Workers", "Workers", "Celery workers"),
+        ("Optimizer", "Optimizer", "GLB optimization workers"),
+        ("Preview", "Preview", "Live preview worker"),
+    ])
+    log_lines: bpy.props.IntProperty(name="Lines", description="Number of log lines to show", default=15, min=1, max=200)
+
+    enable_native_glb_export: bpy.props.BoolProperty(name="Use Native GLB Writer", description="Write realized, non-animated results without the glTF exporter and fall back to it for anything else", default=True)
+
+    min_workers: bpy.props.IntProperty(name="Min Workers", description="Blender workers kept running while the API is idle", default=1, min=0)
+    max_workers: bpy.props.IntProperty(name="Max Workers", description="Most Blender workers started for queued tasks, 0 picks a limit from the cores and memory of this machine", default=0, min=0)
+    interactive_workers: bpy.props.IntProperty(name="Interactive Workers", description="Workers reserved for interactive requests, so previews don't wait behind bulk batches", default=1, min=0)
+
+    rarity_report: bpy.props.StringProperty(name="Rarity Report", description="Last computed rarity report as JSON")
+    rarity_values: bpy.props.IntProperty(name="Values", description="Most likely values shown per trait", default=5, min=1, max=50)
+
 class SHADERVERSE_PG_preferences(bpy.types.PropertyGroup):
     modules_installed: bpy.props.BoolProperty(name="Python Modules Installed", default=False)
 
@@ -374,8 +393,11 @@ class SHADERVERSE_OT_render(bpy.types.Operator):
 
     def execute(self, context):
         from ..model import GenRange
-        from ..render import Render
+        from ..render import Render, is_running
         from . import server     
+        if is_running():
+            self.report({'WARNING'}, "A batch is already rendering")
+            return {'CANCELLED'}
         range_start = context.scene.shaderverse.render.range_start
         range_end = context.scene.shaderverse.render.range_end
         basepath = context.scene.shaderverse.render.basepath
@@ -538,6 +560,14 @@ class SHADERVERSE_PT_metadata(bpy.types.Panel):
         row2.enabled = False
 
 
+SERVICE_HEALTH_ICONS = {
+    "starting": "TIME",
+    "healthy": "CHECKMARK",
+    "unhealthy": "ERROR",
+    "restarting": "FILE_REFRESH",
+    "stopped": "CANCEL",
+}
+
 class SHADERVERSE_PT_generated_metadata(bpy.types.Panel):
     bl_space_type = 'VIEW_3D'
     bl_region_type = 'UI'
@@ -552,7 +582,7 @@ class SHADERVERSE_PT_generated_metadata(bpy.types.Panel):
         if context.preferences.addons["shaderverse"].preferences.modules_installed:
             
             from .. import custom_icons
-            from .server import is_initialized
+            from .server import is_initialized, get_service_status, get_autoscaler_status
 
             
             layout.separator(factor=1.0) 
@@ -574,6 +604,13 @@ class SHADERVERSE_PT_generated_metadata(bpy.types.Panel):
                 shaderverse_stop_api = SHADERVERSE_OT_stop_api
                 layout.operator(shaderverse_stop_api.bl_idname, text= shaderverse_stop_api.bl_label, icon="CONSOLE", emboss=True)
 
+                box = layout.box()
+                for name, health, detail in get_service_status():
+                    row = box.row()
+                    row.label(text=name, icon=SERVICE_HEALTH_ICONS.get(health, "QUESTION"))
+                    row.label(text=f"{health.value} {detail}".strip())
+                box.label(text=get_autoscaler_status(), icon="MOD_ARRAY")
+
             
 
 
@@ -608,6 +645,73 @@ class SHADERVERSE_PT_generated_metadata(bpy.types.Panel):
             layout.label(text="Waiting for modules to install...")
 
 
+class SHADERVERSE_PT_service_logs(bpy.types.Panel):
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "Shaderverse"
+    bl_label = "Service Logs"
+    bl_idname = "SHADERVERSE_PT_service_logs"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    @classmethod
+    def poll(cls, context):
+        from .server import is_initialized
+        return is_initialized
+
+    def draw(self, context):
+        from .server import get_service_log_tail
+        layout = self.layout
+        scene_properties = context.scene.shaderverse
+        row = layout.row()
+        row.prop(scene_properties, 'log_service', text="")
+        row.prop(scene_properties, 'log_lines')
+
+        box = layout.box()
+        col = box.column(align=True)
+        lines = get_service_log_tail(scene_properties.log_service, scene_properties.log_lines)
+        if not lines:
+            col.label(text="No output yet")
+        for line in lines:
+            col.label(text=line)
+
+
+class SHADERVERSE_PT_rarity_report(bpy.types.Panel):
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "Shaderverse"
+    bl_label = "Rarity Analytics"
+    bl_idname = "SHADERVERSE_PT_rarity_report"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context):
+        layout = self.layout
+        scene_properties = context.scene.shaderverse
+        row = layout.row()
+        row.operator("shaderverse.compute_rarity")
+        row.prop(scene_properties, 'rarity_values')
+        if not scene_properties.rarity_report:
+            return
+
+        report = json.loads(scene_properties.rarity_report)
+        box = layout.box()
+        col = box.column(align=True)
+        if report["method"] == "exact":
+            col.label(text=f"Exact, {report['valid_combinations']} valid combinations")
+        else:
+            col.label(text=f"Estimated from {report['samples']} samples, {report['distinct_combinations_observed']} combinations seen")
+        col.label(text=f"Failing items: {report['failure_probability']:.2%}")
+
+        for trait_type, values in report["marginals"].items():
+            box = layout.box()
+            col = box.column(align=True)
+            col.label(text=trait_type)
+            for value in values[:scene_properties.rarity_values]:
+                interval = f" ({value['lower']:.2%} - {value['upper']:.2%})" if value["lower"] is not None else ""
+                col.label(text=f"{value['value']}: {value['probability']:.2%}{interval}")
+        for trait_type, trait_range in report["ranges"].items():
+            layout.label(text=f"{trait_type}: {trait_range['count']} values from {trait_range['min_value']:g} to {trait_range['max_value']:g}")
+
+
 class SHADERVERSE_PT_settings(bpy.types.Panel):
     bl_space_type = 'VIEW_3D'
     bl_region_type = 'UI'
@@ -629,6 +733,7 @@ class SHADERVERSE_PT_settings(bpy.types.Panel):
 
         box = col.box()
         box.prop(this_context.shaderverse, 'main_geonodes_object')
+        box.prop(this_context.shaderverse, 'seed')
 
 
         
@@ -644,6 +749,13 @@ class SHADERVERSE_PT_settings(bpy.types.Panel):
             box = col.box()
             box.prop(this_context.shaderverse, 'post_generation_script', text="Python Script")
 
+        col.prop(this_context.shaderverse, 'enable_native_glb_export')
+
+        box = col.box()
+        box.prop(this_context.shaderverse, 'min_workers')
+        box.prop(this_context.shaderverse, 'max_workers')
+        box.prop(this_context.shaderverse, 'interactive_workers')
+
 
 class SHADERVERSE_PT_rendering(bpy.types.Panel):
     bl_space_type = 'VIEW_3D'
@@ -687,6 +799,10 @@ class SHADERVERSE_PT_batch(bpy.types.Panel):
         row = layout.row()
         row.prop(this_context.shaderverse.render, 'range_end')
 
+        if this_context.shaderverse.render.status:
+            box = layout.box()
+            box.label(text=this_context.shaderverse.render.status)
+
 
 
 
@@ -959,6 +1075,23 @@ class SHADERVERSE_OT_generate(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class SHADERVERSE_OT_compute_rarity(bpy.types.Operator):
+    """Compute the probability of every trait value from the weights and restrictions"""
+    bl_idname = "shaderverse.compute_rarity"
+    bl_label = "Compute Rarity"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        from shaderverse.rarity import RarityAnalyzer
+        try:
+            report = RarityAnalyzer().analyze(co_occurrence=False)
+        except Exception as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        context.scene.shaderverse.rarity_report = report.json()
+        return {'FINISHED'}
+
+
 class SHADERVERSE_OT_live_preview(bpy.types.Operator):
     
     """ Live preview """
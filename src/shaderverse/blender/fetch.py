@@ -1,7 +1,13 @@
-import subprocess
+import asyncio
+import json
 import os
+import threading
+from concurrent.futures import Future
 from enum import Enum   
 
+MAX_CONNECTIONS = 8
+REQUEST_TIMEOUT = 60.0
+
 class Status(str, Enum):
     """Status of the fetch"""
     pending="pending"
@@ -15,6 +21,61 @@ class Method(str, Enum):
     PUT="PUT"
     DELETE="DELETE"
 
+class HttpClient(threading.Thread):
+    """ One event loop on a background thread with a keep-alive connection pool shared by every request
+
+    Requests return futures, so timers on the UI thread can poll them without blocking.
+    """
+
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, timeout: float = REQUEST_TIMEOUT):
+        super().__init__(daemon=True)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.client = None
+
+    def run(self):
+        import httpx
+        asyncio.set_event_loop(self.loop)
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.client.aclose())
+        self.loop.close()
+
+    def request(self, method: str, url: str, data: dict = None) -> Future:
+        """ Send a request from any thread and return a future of its response """
+        self.ready.wait()
+        return asyncio.run_coroutine_threadsafe(self.client.request(method, url, json=data), self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+http_client: HttpClient = None
+http_client_lock = threading.Lock()
+
+
+def get_http_client() -> HttpClient:
+    """ Start the shared client on first use """
+    global http_client
+    with http_client_lock:
+        if http_client is None or not http_client.is_alive():
+            http_client = HttpClient()
+            http_client.start()
+        return http_client
+
+
+def stop_http_client():
+    global http_client
+    with http_client_lock:
+        if http_client is not None and http_client.is_alive():
+            http_client.stop()
+        http_client = None
+
+
 class Fetch:
     """Fetch class to make requests in the backend 
     Parameters 
@@ -29,25 +90,28 @@ class Fetch:
     
     url: str = None
     status: status = Status.pending
-    process = None
+    future: Future = None
      
     def __init__(self, url: str = None, method: Method = "POST", json_file: str = None):
         self.method = method
         self.json_file = json_file
         self.result = None
+        self.error = None
         self.status = Status.pending
 
         if url is not None:
             self.url = url
 
     def make_request(self):
-        """Make the request to the backend using the http_request.py script"""
+        """Send the request through the shared http client without waiting for the response"""
         if self.url is None:
             raise ValueError("Url not set")
-        cmd = ["python", "http_request.py", "--url", self.url, "--method", self.method]
-        data_cmd = [] if  self.json_file is None else ["--json", self.json_file]
-        cmd = cmd + data_cmd
-        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
+        data = None
+        if self.json_file is not None:
+            with open(self.json_file, "r") as f:
+                data = json.load(f)
+        self.future = get_http_client().request(self.method, self.url, data)
+        self.status = Status.running
         self.result = ""       
 
     @property
@@ -96,21 +160,21 @@ class Fetch:
         self._json_file = value
 
     def refresh_result(self):
-        """ Refresh the result of the fetch from the subprocess"""
-        outs = None
-        try:
-            outs, errs = self.process.communicate(timeout=0.1)
-            self.status = Status.completed
-            if outs:
-                self.result = outs.decode().strip()
-        except subprocess.TimeoutExpired:
+        """ Refresh the result of the fetch from its future, without blocking"""
+        if not self.future.done():
             self.status = Status.running
-            # outs, errs = self.process.communicate()
+            return
+        self.status = Status.completed
+        try:
+            self.result = json.dumps(self.future.result().json())
+        except Exception as e:
+            print(f"Request to {self.url} failed: {e}")
+            self.error = str(e)
         
 
     @property
     def result(self):
-        if self.process:
+        if self.future and self.status != Status.completed:
             self.refresh_result()
         return self._result
     
@@ -22,7 +22,7 @@ def handle_module_install_process():
 def install_modules():
     python_path = sys.executable
 
-    required = {'psutil', 'uvicorn[standard]', 'fastapi', 'pydantic', 'pyngrok', 'celery', 'httpx', 'sqlalchemy==1.4.48'}
+    required = {'psutil', 'uvicorn[standard]', 'fastapi', 'pydantic', 'pyngrok', 'celery', 'httpx', 'sqlalchemy==1.4.48', 'pillow'}
 
     # subprocess.run([python_path, "-m", "ensurepip"], capture_output=True)
     # subprocess.run([python_path, "-m", "pip", "install", "--upgrade", "pip",])
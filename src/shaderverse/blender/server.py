@@ -1,32 +1,69 @@
+import time
 import webbrowser
 import bpy
 from ..background.celery_service import CeleryService
 from ..background.fastapi_service import FastapiService
+from ..background.optimize_service import OptimizeService
+from ..background.preview_service import PreviewService
+from ..background.supervisor import Supervisor, SupervisedService, check_http, check_heartbeat, check_recycle
+from ..background.autoscaler import Autoscaler
+from ..background.watchdog import enforce_time_limits
 from shaderverse.blender.tunnel import Tunnel
 from pathlib import Path
 # from tempfile import gettempdir
-from shaderverse.api.utils import get_temporary_directory
+from shaderverse.api.utils import get_temporary_directory, get_broker_reset_path
 
 
-celery_workers = 6
-celery_service: CeleryService
-fastapi_service: FastapiService
+supervisor: Supervisor
+autoscaler: Autoscaler
 tunnel: Tunnel
 is_initialized = False
 
-def handle_server_keep_alive():
-    """Check the status of the server every 30 seconds"""
+def handle_status_redraw():
+    """Redraw the Shaderverse panel so it shows the status kept by the supervisor"""
     if is_initialized == False:
         print("Server shut down")
         return None
-    print(f"fastapi_service: {fastapi_service.status}\n{fastapi_service.result}")
-    print(f"celery_service: {celery_service.status}\n{celery_service.result}")
-    # print(f"flower_service: {flower_service.status}\n{flower_service.result}")
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+    return 2.0
 
-    if fastapi_service.status == "completed" or celery_service.status == "completed":
-        print("Restarting server")
-        start_server()
-    return 60.0
+def check_fastapi(service: FastapiService) -> bool:
+    return check_http(f"http://localhost:{service.port}/health")
+
+def get_supervised_services(live_preview: bool = False) -> list[SupervisedService]:
+    services = [
+        SupervisedService("API", FastapiService, check_fastapi),
+        SupervisedService("Optimizer", OptimizeService, check_heartbeat),
+    ]
+    if live_preview:
+        services.append(SupervisedService("Preview", PreviewService, check_heartbeat, timeout=enforce_time_limits))
+    return services
+
+def start_worker(index: int, queues: list[str]) -> SupervisedService:
+    """One solo pool Blender worker, added and removed by the autoscaler"""
+    return SupervisedService(f"Worker {index}", lambda: CeleryService(hostname=f"worker{index}@%h", queues=queues), check_heartbeat, check_recycle, group="Workers",
+                             timeout=enforce_time_limits)
+
+def get_autoscaler_status() -> str:
+    """Number of workers and why the autoscaler is or isn't scaling"""
+    if not is_initialized:
+        return ""
+    return autoscaler.get_status()
+
+def get_service_status() -> list:
+    """Name, health and detail of each background service"""
+    if not is_initialized:
+        return []
+    return supervisor.get_status()
+
+def get_service_log_tail(name: str, lines: int = 100) -> list[str]:
+    """Latest output of a background service"""
+    if not is_initialized:
+        return []
+    return supervisor.get_tail(name, lines)
 
 def delete_temp_db():
     """Delete the temp db file"""
@@ -34,17 +71,25 @@ def delete_temp_db():
     db_path = tempdir.joinpath("celerydb.sqlite")
     if db_path.exists():
         db_path.unlink()
+        # queued tasks are gone, resumed batches submit them again
+        get_broker_reset_path().write_text(str(time.time()))
 
 def start_server(live_preview: bool = False):
-    global is_initialized, fastapi_service, celery_service, tunnel
+    global is_initialized, supervisor, autoscaler, tunnel
     if not is_initialized:
         delete_temp_db()
-        celery_service = CeleryService(workers=celery_workers)
-        fastapi_service = FastapiService()
-        api_url = f"http://localhost:{fastapi_service.port}/docs"
-        print(f"Starting API on port {fastapi_service.port}")
-        print(f"Blend File: {fastapi_service.blend_file} ")
-        bpy.app.timers.register(handle_server_keep_alive)
+        scene_properties = bpy.context.scene.shaderverse
+        supervisor = Supervisor(get_supervised_services(live_preview))
+        autoscaler = Autoscaler(supervisor, start_worker, queues_url=f"http://localhost:{FastapiService.port}/queues",
+                                min_workers=scene_properties.min_workers, max_workers=scene_properties.max_workers,
+                                reserved_workers=scene_properties.interactive_workers)
+        supervisor.start_services()
+        autoscaler.start()
+        supervisor.autoscaler = autoscaler
+        api_url = f"http://localhost:{FastapiService.port}/docs"
+        print(f"Starting API on port {FastapiService.port}")
+        print(f"Blend File: {FastapiService.blend_file} ")
+        bpy.app.timers.register(handle_status_redraw)
         if live_preview:
             tunnel = Tunnel()
             preview_url = f"https://shaderverse.com/preview/{tunnel.subdomain}"
@@ -62,8 +107,7 @@ def start_server(live_preview: bool = False):
 
 def kill_fastapi():
     global is_initialized
-    celery_service.kill()
-    fastapi_service.kill()
+    supervisor.stop()
     is_initialized = False
     
     
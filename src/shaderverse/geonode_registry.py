@@ -0,0 +1,158 @@
+import bpy
+from bpy.app.handlers import persistent
+
+
+def get_main_object_name() -> str | None:
+    main_geonodes_object = bpy.context.scene.shaderverse.main_geonodes_object
+    return main_geonodes_object.name if main_geonodes_object else None
+
+
+def get_modifier_signature(object_ref: bpy.types.Object) -> tuple:
+    """ identify the modifier stack of an object, so a changed stack can be told from a changed input """
+    return tuple((modifier.name, modifier.type, getattr(getattr(modifier, "node_group", None), "name_full", None))
+                 for modifier in object_ref.modifiers)
+
+
+def find_geometry_nodes(object_ref: bpy.types.Object, main_object_name: str | None) -> list[dict]:
+    """find all geonodes in an object and return a list of node objects"""
+
+    geometry_node_objects = []
+    object_name = object_ref.name
+    is_parent_node = object_name == main_object_name
+
+    try:
+        object_modifiers = object_ref.modifiers.items()
+    except AttributeError as error:
+        raise Exception(f"{error}: for {object_name}")
+
+    for modifier_name, modifier_ref in object_modifiers:
+        if hasattr(modifier_ref, "node_group"):
+            node_group = modifier_ref.node_group
+
+            try:
+                if node_group.type == "GEOMETRY":
+                    node_object = {
+                        "object_name": object_name,
+                        "object_ref": object_ref,
+                        "modifier_name": modifier_name,
+                        "modifier_ref": modifier_ref,
+                        "node_group": node_group,
+                        "is_parent_node": is_parent_node
+                    }
+                    geometry_node_objects.append(node_object)
+            except AttributeError as error:
+                raise Exception(f"{error}: Could not find a Node Group type in object: {object_name}. Did you add an empty geometry node modifier?")
+
+    return geometry_node_objects
+
+
+class GeometryNodeRegistry():
+    """ The geometry node objects of the open file, the main node group and the socket identifiers of each node group
+
+    Built on first use and kept until the file is loaded again, an undo step is taken, or a depsgraph
+    update adds or removes objects, changes a modifier stack or edits a node group. Writing modifier
+    inputs doesn't invalidate it, so repeated lookups while rendering don't scan the scene again.
+    """
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self.node_objects: list[dict] = None
+        self.main_node_object: dict = None
+        self.modifier_signatures: dict[str, tuple] = {}
+        self.sockets: dict[str, dict[str, tuple[str, str]]] = {}
+        self.filepath = None
+        self.main_object_name = None
+        self.object_count = 0
+
+    def is_stale(self) -> bool:
+        return (self.node_objects is None
+                or self.filepath != bpy.data.filepath
+                or self.main_object_name != get_main_object_name()
+                or self.object_count != len(bpy.data.objects))
+
+    def build(self):
+        self.invalidate()
+        self.filepath = bpy.data.filepath
+        self.main_object_name = get_main_object_name()
+        self.object_count = len(bpy.data.objects)
+        self.node_objects = []
+        for object_ref in bpy.data.objects:
+            self.modifier_signatures[object_ref.name] = get_modifier_signature(object_ref)
+            self.node_objects += find_geometry_nodes(object_ref, self.main_object_name)
+        self.main_node_object = next((node_object for node_object in self.node_objects if node_object["is_parent_node"]), None)
+
+    def get_node_objects(self) -> list[dict]:
+        if self.is_stale():
+            self.build()
+        return self.node_objects
+
+    def get_main_node_object(self) -> dict | None:
+        if self.is_stale():
+            self.build()
+        return self.main_node_object
+
+    def get_sockets(self, node_group: bpy.types.GeometryNodeTree) -> dict[str, tuple[str, str]]:
+        """ map the input names of a node group to their socket identifier and type """
+        key = node_group.name_full
+        if key not in self.sockets:
+            self.sockets[key] = {name: (socket.identifier, socket.type) for name, socket in node_group.inputs.items()}
+        return self.sockets[key]
+
+    def handle_depsgraph_update(self, depsgraph: bpy.types.Depsgraph):
+        if self.node_objects is None:
+            return
+        for update in depsgraph.updates:
+            updated_id = update.id.original
+            if isinstance(updated_id, bpy.types.Collection):
+                self.invalidate()
+                return
+            if isinstance(updated_id, bpy.types.NodeTree):
+                self.sockets.pop(updated_id.name_full, None)
+                if updated_id.type == "GEOMETRY":
+                    self.invalidate()
+                    return
+            if isinstance(updated_id, bpy.types.Object):
+                if self.modifier_signatures.get(updated_id.name) != get_modifier_signature(updated_id):
+                    self.invalidate()
+                    return
+
+
+registry = GeometryNodeRegistry()
+
+
+@persistent
+def handle_depsgraph_update_post(scene, depsgraph):
+    registry.handle_depsgraph_update(depsgraph)
+
+
+@persistent
+def handle_file_change(*args):
+    registry.invalidate()
+
+
+HANDLERS = (
+    (bpy.app.handlers.depsgraph_update_post, handle_depsgraph_update_post),
+    (bpy.app.handlers.load_post, handle_file_change),
+    (bpy.app.handlers.undo_post, handle_file_change),
+    (bpy.app.handlers.redo_post, handle_file_change),
+)
+
+
+def register_handlers():
+    for handlers, handler in HANDLERS:
+        if handler not in handlers:
+            handlers.append(handler)
+
+
+def unregister_handlers():
+    for handlers, handler in HANDLERS:
+        if handler in handlers:
+            handlers.remove(handler)
+
+
+def get_registry() -> GeometryNodeRegistry:
+    """ return the registry, making sure it is invalidated in processes that never registered the add-on """
+    register_handlers()
+    return registry
@@ -1,7 +1,9 @@
 import bpy
 import json
 import random
+import hashlib
 import shaderverse
+from shaderverse.geonode_registry import get_registry, find_geometry_nodes, get_main_object_name
 from typing import List
 from enum import Enum
 from pydantic import BaseModel
@@ -22,6 +24,14 @@ class NodeInput(BaseModel):
     min_value: Optional[float|int] = None
     max_value: Optional[float|int] = None
 
+# step of the values generated for number inputs
+RANGE_PRECISION = {"VALUE": 0.01, "INT": 1}
+
+def get_item_seed(collection_seed: int, item_id: int) -> int:
+    """ derive a stable seed for an item from the collection seed and the item id """
+    digest = hashlib.sha256(f"{collection_seed}:{item_id}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
 class Mesh():
     """Mesh class to generate metadata and update mesh"""
 
@@ -33,12 +43,19 @@ class Mesh():
     node_group_attributes = {}
     
 
-    def __init__(self):
+    def __init__(self, item_id: int = None):
         # run a custom script before intialization
-        self.all_objects = bpy.data.objects.values()
         self.geometry_node_objects = []
         self.collection = []
         self.attributes = []
+        self.item_id = item_id
+        self.input_writes = 0
+        self.skipped_input_writes = 0
+        # items with an id are reproducible from (collection seed, item id), anything else stays unseeded
+        if item_id is None:
+            self.random = random.Random()
+        else:
+            self.random = random.Random(get_item_seed(bpy.context.scene.shaderverse.seed, item_id))
 
     def generate_random_range(self, item_ref: bpy.types.NodeSocketInterfaceFloat, precision):
         """ generate a random value based on the min and max values of a node socket """
@@ -46,57 +63,44 @@ class Mesh():
         stop = item_ref.max_value
         start = round(start / precision)
         stop = round(stop / precision)
-        generated_int = random.randint(start, stop)
+        generated_int = self.random.randint(start, stop)
         return generated_int * precision
 
 
     def find_geometry_nodes(self, object_ref: bpy.types.Object):
         """find all geonodes in an object and return a list of node objects"""
-
-        geometry_node_objects = []
-        object_name = object_ref.name
-
-        try:
-            object_modifiers = object_ref.modifiers.items()
-        except AttributeError as error:
-            raise Exception(f"{error}: for {object_name}")
-
-        for modifier in object_modifiers:
-            modifier_name = modifier[0]
-            modifier_ref = modifier[1]
-            if hasattr(modifier_ref, "node_group"):
-                node_group = modifier_ref.node_group
-
-                try:
-                    if node_group.type == "GEOMETRY":
-                        node_object = {
-                            "object_name": object_name,
-                            "object_ref": object_ref,
-                            "modifier_name": modifier_name,
-                            "modifier_ref": modifier_ref, 
-                            "node_group": node_group,
-                            "is_parent_node": self.is_parent_node(current_node_object_name=object_name)
-                        }
-                        geometry_node_objects.append(node_object)
-                except AttributeError as error:
-                    raise Exception(f"{error}: Could not find a Node Group type in object: {object_name}. Did you add an empty geometry node modifier?")
-
-        return geometry_node_objects
+        return find_geometry_nodes(object_ref, get_main_object_name())
     
     def refresh_geometry_node_objects(self):
-        """find all geonodes then update the node object based on the generated metadata"""
-        self.geometry_node_objects = []
-        for object_ref in self.all_objects:
-            self.geometry_node_objects += self.find_geometry_nodes(object_ref)
+        """get the geonodes of the scene from the registry, which only scans the scene again after it changed"""
+        self.geometry_node_objects = get_registry().get_node_objects()
+
+    def update_geonodes_from_metadata(self, trait_types: set[str] = None):
+        """find all geonodes then update the node object based on the generated metadata, only for the given trait types if any
 
-    def update_geonodes_from_metadata(self):
-        """find all geonodes then update the node object based on the generated metadata"""
+        Inputs that already hold the requested value are skipped. Every write is made before any
+        mesh is tagged, so the next depsgraph evaluation picks all of them up at once.
+        """
 
         self.refresh_geometry_node_objects()
+        metadata = json.loads(bpy.context.scene.shaderverse.generated_metadata)
 
-        # update all geonodes with metadata
+        changes = []
         for node_object in self.geometry_node_objects:
-            self.update_mesh(node_object)
+            changed = self.get_changed_node_inputs(node_object, metadata, trait_types)
+            if changed:
+                changes.append((node_object, changed))
+
+        for node_object, changed in changes:
+            self.write_node_inputs(node_object, changed)
+
+        # tag each changed mesh once, even when it carries several geometry node modifiers
+        updated_meshes = set()
+        for node_object, _ in changes:
+            mesh = node_object["object_ref"].data
+            if mesh.name_full not in updated_meshes:
+                mesh.update()
+                updated_meshes.add(mesh.name_full)
 
     
 
@@ -145,7 +149,7 @@ class Mesh():
                 collection_object_weights.append(shaderverse_properties.weight)
 
         try:    
-            selected_object_name = random.choices(collection_object_names, weights=tuple(collection_object_weights), k=1)[0]
+            selected_object_name = self.random.choices(collection_object_names, weights=tuple(collection_object_weights), k=1)[0]
         except IndexError as error:
             raise Exception(f"{error}: Could not find at least one valid object in {collection.name}")
         return bpy.data.objects[selected_object_name]
@@ -174,7 +178,7 @@ class Mesh():
                 collection_object_weights.append(shaderverse_properties.weight)
         
         collection_object_names = [d['object_name'] for d in collection_objects]
-        selected_object_name = random.choices(collection_object_names, weights=tuple(collection_object_weights), k=1)[0]
+        selected_object_name = self.random.choices(collection_object_names, weights=tuple(collection_object_weights), k=1)[0]
         selected_collection_name = next(item["collection_name"] for item in collection_objects if item["object_name"] == selected_object_name)
         return bpy.data.collections[selected_collection_name]
 
@@ -218,12 +222,12 @@ class Mesh():
 
 
             if item_type == "VALUE":
-                precision = 0.01
+                precision = RANGE_PRECISION["VALUE"]
                 generated_value = self.generate_random_range(item_ref=item_ref, precision=precision)
                 self.node_group_attributes["attributes"][item_name] = generated_value
 
             if item_type == "INT":
-                precision = 1
+                precision = RANGE_PRECISION["INT"]
                 generated_value = self.generate_random_range(item_ref=item_ref, precision=precision)
                 self.node_group_attributes["attributes"][item_name] = generated_value
                 
@@ -292,11 +296,7 @@ class Mesh():
   
     def get_main_node_group(self):
         """ get the main node group in the scene """
-        self.refresh_geometry_node_objects()
-
-        for node_object in self.geometry_node_objects:
-            if self.is_parent_node(node_object["object_name"]):
-                return node_object
+        return get_registry().get_main_node_object()
 
     def get_objects(self) -> List[bpy.types.Object]:
         """Returns a list of objects that are passed into main node group"""
@@ -310,6 +310,7 @@ class Mesh():
 
         modifier: bpy.types.Modifier = main_node_group["modifier_ref"]
         node_group: bpy.types.GeometryNodeTree = modifier.node_group
+        sockets = get_registry().get_sockets(node_group)
 
         metadata = json.loads(bpy.context.scene.shaderverse.generated_metadata)
 
@@ -318,11 +319,9 @@ class Mesh():
             trait_value = attribute['value']
 
             # is this attribute in our node group?
-            if trait_type in node_group.inputs.keys():
-
-                item_ref = node_group.inputs[trait_type]
+            if trait_type in sockets:
 
-                item_type = item_ref.type
+                _, item_type = sockets[trait_type]
 
 
                 if item_type == "OBJECT":
@@ -338,50 +337,57 @@ class Mesh():
         return objects
 
 
-    def set_node_inputs_from_metadata(self, node_object):
-        """ set the node inputs from the generated metadata"""
-        modifier_name = node_object["modifier_name"]
+    def get_node_input_values(self, node_object, metadata: list[dict], trait_types: set[str] = None) -> dict:
+        """ get the node input values requested by the generated metadata, keyed by socket identifier"""
         modifier = node_object["modifier_ref"]
-        node_group = modifier.node_group
-        node_group_name = node_group.name
-        object_name = node_object["object_name"]
-        object_ref = bpy.data.objects[object_name]
-
-        metadata = json.loads(bpy.context.scene.shaderverse.generated_metadata)
+        sockets = get_registry().get_sockets(modifier.node_group)
+        values = {}
 
         for attribute in metadata:
             trait_type = attribute['trait_type']
             trait_value = attribute['value']
 
-            # is this attribute in our node group?
-            if trait_type in node_group.inputs.keys():
+            if trait_types is not None and trait_type not in trait_types:
+                continue
 
-                item_ref = node_group.inputs[trait_type]
+            # is this attribute in our node group?
+            if trait_type in sockets:
 
-                item_type = item_ref.type
-                item_input_id = item_ref.identifier 
+                item_input_id, item_type = sockets[trait_type]
 
                 if item_type == "VALUE":
-                    modifier[item_input_id] = float(trait_value)
+                    values[item_input_id] = float(trait_value)
 
                 if item_type == "INT":
-                    modifier[item_input_id] = int(trait_value)
+                    values[item_input_id] = int(trait_value)
                         
                 if item_type == "MATERIAL":
-                    modifier[item_input_id] = bpy.data.materials[trait_value]
+                    values[item_input_id] = bpy.data.materials[trait_value]
 
                 if item_type == "OBJECT":
-                    object_ref = self.match_object_from_metadata(trait_type, trait_value)
-                    modifier[item_input_id] = object_ref
+                    values[item_input_id] = self.match_object_from_metadata(trait_type, trait_value)
                 
                 if item_type == "COLLECTION":
-                    collection_ref = self.match_collection_from_metadata(trait_type, trait_value)
-                    modifier[item_input_id] = collection_ref
+                    values[item_input_id] = self.match_collection_from_metadata(trait_type, trait_value)
 
                 if item_type == "STRING":
-                    modifier[item_input_id] = str(trait_value)
-            
-                        
+                    values[item_input_id] = str(trait_value)
+
+        return values
+
+    def get_changed_node_inputs(self, node_object, metadata: list[dict], trait_types: set[str] = None) -> dict:
+        """ keep only the node input values that differ from the ones already on the modifier"""
+        modifier = node_object["modifier_ref"]
+        values = self.get_node_input_values(node_object, metadata, trait_types)
+        changed = {input_id: value for input_id, value in values.items() if modifier.get(input_id) != value}
+        self.skipped_input_writes += len(values) - len(changed)
+        return changed
+
+    def write_node_inputs(self, node_object, values: dict):
+        modifier = node_object["modifier_ref"]
+        for input_id, value in values.items():
+            modifier[input_id] = value
+        self.input_writes += len(values)
 
     def format_value(self, item: bpy.types.Object):
         """ format the value of an item for the metadata"""
@@ -428,16 +434,6 @@ class Mesh():
         self.set_attributes()
 
 
-    def update_mesh(self, node_object):
-        """ update the mesh of a node object """
-        self.set_node_inputs_from_metadata(node_object)
-        object_name = node_object["object_name"]
-        object_ref = bpy.data.objects[object_name]
-        mesh_name = object_ref.data.name
-        mesh = bpy.data.meshes[mesh_name]
-        mesh.update()
-
-    
     def create_animated_objects_collection(self):
         """ create a collection for animated objects """
         is_animated_objects_created = bpy.data.collections.find("Animated Objects") >= 0
@@ -1,6 +1,7 @@
 from pydantic import BaseModel, Json, create_model, Field
 from typing import Optional, List, Literal, Set
 from shaderverse.mesh import Mesh, NodeInput
+from shaderverse.api.model import OptimizationResult
 import logging
 #class Attribute(BaseModel):
     # trait_type: str
@@ -60,6 +61,9 @@ class Metadata(BaseModel):
     rendered_glb_url: str = None
     rendered_usdz_url: str = None
     rendered_file_url: str = None
+    optimization: OptimizationResult = None
+    profile_pstats_url: str = None
+    profile_collapsed_url: str = None
 
     def generate_json_attributes(self):
 
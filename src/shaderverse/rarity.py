@@ -0,0 +1,266 @@
+import itertools
+import math
+import random
+import bpy
+from shaderverse.mesh import Mesh, RANGE_PRECISION
+from shaderverse.api.model import RarityMethod, RarityReport, TraitValueProbability, TraitRange, CoOccurrence
+
+MAX_STATES = 250000
+SAMPLES = 10000
+MAX_SAMPLES = 100000
+Z_95 = 1.96
+MISSING = object()
+INVALID = object()
+
+
+class RarityBudgetExceeded(Exception):
+    """ The exact computation needs more states than it is allowed """
+
+
+def get_value_key(value):
+    """ hashable identity of a generated value """
+    return getattr(value, "name_full", value)
+
+
+def wilson_interval(successes: int, total: int, z: float = Z_95) -> tuple[float, float]:
+    """ confidence interval of a sampled proportion """
+    if total == 0:
+        return 0.0, 1.0
+    p = successes / total
+    denominator = 1 + z ** 2 / total
+    center = (p + z ** 2 / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z ** 2 / (4 * total ** 2)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class Trait():
+    """ An input of the main node group and the values the generator can pick for it """
+
+    def __init__(self, name: str, input_type: str):
+        self.name = name
+        self.input_type = input_type
+        self.candidates: list[tuple] = []
+        self.values: list = []
+        self.probabilities: list[float] = []
+        self.range: TraitRange = None
+        self.referenced: tuple[str] = ()
+
+    def is_numeric(self) -> bool:
+        return self.input_type in RANGE_PRECISION
+
+
+class RarityAnalyzer():
+    """ Compute the rarity of every trait value by walking the trait graph instead of generating items
+
+    The inputs of the main node group are visited in the order the generator reads them. Objects,
+    materials and collections are weighted choices filtered by their restrictions, which only look
+    at earlier traits, so the joint distribution is built one trait at a time. Number inputs that no
+    restriction reads are independent and reported as uniform ranges. When the joint distribution
+    outgrows the state budget, items are sampled from the same choices instead.
+    """
+
+    def __init__(self):
+        self.mesh = Mesh()
+        self.traits: list[Trait] = []
+        self.outcomes: dict[tuple, tuple[list, list[float]]] = {}
+        self.formatted: dict = {}
+
+    def add_candidates(self, trait: Trait, collection: bpy.types.Collection):
+        """ the objects or collections the generator chooses from, with their restrictions, weight and value """
+        if trait.input_type == "COLLECTION":
+            for child_collection in collection.children:
+                obj = self.mesh.get_metadata_object_from_collection(child_collection)
+                value = "None" if self.mesh.is_collection_none(child_collection) else child_collection
+                trait.candidates.append((obj.shaderverse.restrictions, obj.shaderverse.weight, value))
+            return
+        for obj in collection.objects:
+            value = obj
+            if trait.input_type == "MATERIAL":
+                value = bpy.data.materials[obj.material_slots[0].name] if len(obj.material_slots) > 0 else INVALID
+            trait.candidates.append((obj.shaderverse.restrictions, obj.shaderverse.weight, value))
+
+    def add_range(self, trait: Trait, item_ref: bpy.types.NodeSocketInterfaceFloat):
+        precision = RANGE_PRECISION[trait.input_type]
+        start = round(item_ref.min_value / precision)
+        stop = round(item_ref.max_value / precision)
+        if stop < start:
+            raise Exception(f"{trait.name} has a minimum above its maximum")
+        trait.values = [step * precision for step in range(start, stop + 1)]
+        trait.probabilities = [1 / len(trait.values)] * len(trait.values)
+        trait.range = TraitRange(min_value=start * precision, max_value=stop * precision, step=precision, count=len(trait.values))
+
+    def build(self):
+        """ read the traits of the main node group """
+        main_node_object = self.mesh.get_main_node_group()
+        if not main_node_object:
+            raise Exception("No main geometry nodes object found")
+        node_group: bpy.types.GeometryNodeTree = main_node_object["modifier_ref"].node_group
+
+        for item_name, item_ref in node_group.inputs.items():
+            trait = Trait(item_name, item_ref.type)
+            if trait.is_numeric():
+                self.add_range(trait, item_ref)
+            elif trait.input_type in ("OBJECT", "MATERIAL", "COLLECTION"):
+                try:
+                    collection = bpy.data.collections[item_name]
+                except KeyError as error:
+                    raise Exception(f"{error}: Could not find a value for {item_name}. Is {item_name} added as an input in your root geometry node?")
+                self.add_candidates(trait, collection)
+                trait.referenced = tuple(sorted({restriction.trait for restrictions, _, _ in trait.candidates for restriction in restrictions}))
+            else:
+                continue
+            self.traits.append(trait)
+
+        referenced = {name for trait in self.traits for name in trait.referenced}
+        self.expanded = [trait for trait in self.traits if not trait.is_numeric() or trait.name in referenced]
+        self.independent = [trait for trait in self.traits if trait.is_numeric() and trait.name not in referenced]
+
+    def get_outcomes(self, trait: Trait, attributes: dict) -> tuple[list, list[float]] | None:
+        """ the values a trait can take after the given earlier traits and their probabilities, None when generation fails """
+        if trait.is_numeric():
+            return trait.values, trait.probabilities
+
+        key = (trait.name,) + tuple(get_value_key(attributes.get(name, MISSING)) for name in trait.referenced)
+        if key in self.outcomes:
+            return self.outcomes[key]
+
+        self.mesh.node_group_attributes = {"attributes": attributes}
+        weights = {}
+        values = {}
+        try:
+            for restrictions, weight, value in trait.candidates:
+                if (len(restrictions) < 1) or self.mesh.is_item_restriction_found(restrictions):
+                    value_key = get_value_key(value)
+                    weights[value_key] = weights.get(value_key, 0.0) + weight
+                    values[value_key] = value
+        except KeyError:
+            # a restriction reads a trait that isn't generated yet
+            weights = {}
+
+        total = sum(weights.values())
+        outcome = None
+        if total > 0 and all(weight >= 0 for weight in weights.values()):
+            outcome = ([values[value_key] for value_key in weights], [weight / total for weight in weights.values()])
+        self.outcomes[key] = outcome
+        return outcome
+
+    def format(self, value) -> str:
+        value_key = (type(value), get_value_key(value))
+        if value_key not in self.formatted:
+            self.formatted[value_key] = str(self.mesh.format_value(value))
+        return self.formatted[value_key]
+
+    def enumerate_states(self, max_states: int) -> tuple[dict[tuple, tuple[float, tuple]], float]:
+        """ the joint distribution of the expanded traits and the probability that generation fails """
+        names = [trait.name for trait in self.expanded]
+        states = {(): (1.0, ())}
+        failure = 0.0
+        for index, trait in enumerate(self.expanded):
+            expanded_states = {}
+            for key, (probability, values) in states.items():
+                outcomes = self.get_outcomes(trait, dict(zip(names[:index], values)))
+                if outcomes is None:
+                    failure += probability
+                    continue
+                for value, value_probability in zip(*outcomes):
+                    if value is INVALID:
+                        failure += probability * value_probability
+                        continue
+                    state_key = key + (get_value_key(value),)
+                    previous = expanded_states.get(state_key, (0.0, values + (value,)))
+                    expanded_states[state_key] = (previous[0] + probability * value_probability, previous[1])
+                if len(expanded_states) > max_states:
+                    raise RarityBudgetExceeded(f"More than {max_states} combinations after {trait.name}")
+            states = expanded_states
+        return states, failure
+
+    def compute_exact(self, max_states: int, co_occurrence: bool) -> RarityReport:
+        states, failure = self.enumerate_states(max_states)
+        success = sum(probability for probability, _ in states.values())
+        report = RarityReport(method=RarityMethod.exact, failure_probability=min(1.0, failure), states=len(states),
+                              ranges={trait.name: trait.range for trait in self.independent})
+        if success <= 0:
+            report.valid_combinations = 0
+            return report
+
+        marginals = [{} for _ in self.expanded]
+        pairs = {}
+        combinations = set()
+        for probability, values in states.values():
+            formatted = tuple(self.format(value) for value in values)
+            combinations.add(formatted)
+            for index, value in enumerate(formatted):
+                marginals[index][value] = marginals[index].get(value, 0.0) + probability
+            if co_occurrence:
+                for (index_a, value_a), (index_b, value_b) in itertools.combinations(enumerate(formatted), 2):
+                    pair = (index_a, value_a, index_b, value_b)
+                    pairs[pair] = pairs.get(pair, 0.0) + probability
+
+        report.valid_combinations = len(combinations) * math.prod(trait.range.count for trait in self.independent)
+        report.marginals = {trait.name: sorted((TraitValueProbability(value=value, probability=probability / success)
+                                                for value, probability in marginals[index].items()), key=lambda item: -item.probability)
+                            for index, trait in enumerate(self.expanded)}
+        report.co_occurrence = self.get_co_occurrence(pairs, success)
+        return report
+
+    def sample(self, rng: random.Random) -> tuple | None:
+        """ generate the expanded traits of one item, None when generation fails """
+        attributes = {}
+        values = []
+        for trait in self.expanded:
+            outcomes = self.get_outcomes(trait, attributes)
+            if outcomes is None:
+                return None
+            value = rng.choices(outcomes[0], weights=outcomes[1], k=1)[0]
+            if value is INVALID:
+                return None
+            attributes[trait.name] = value
+            values.append(self.format(value))
+        return tuple(values)
+
+    def compute_monte_carlo(self, samples: int, co_occurrence: bool, seed: int = None) -> RarityReport:
+        rng = random.Random(seed)
+        samples = max(1, min(samples, MAX_SAMPLES))
+        counts = {}
+        failures = 0
+        for _ in range(samples):
+            combination = self.sample(rng)
+            if combination is None:
+                failures += 1
+            else:
+                counts[combination] = counts.get(combination, 0) + 1
+
+        successes = samples - failures
+        marginals = [{} for _ in self.expanded]
+        pairs = {}
+        for combination, count in counts.items():
+            for index, value in enumerate(combination):
+                marginals[index][value] = marginals[index].get(value, 0) + count
+            if co_occurrence:
+                for (index_a, value_a), (index_b, value_b) in itertools.combinations(enumerate(combination), 2):
+                    pair = (index_a, value_a, index_b, value_b)
+                    pairs[pair] = pairs.get(pair, 0) + count
+
+        report = RarityReport(method=RarityMethod.monte_carlo, failure_probability=failures / samples, samples=samples,
+                              distinct_combinations_observed=len(counts),
+                              ranges={trait.name: trait.range for trait in self.independent})
+        if successes == 0:
+            return report
+        report.marginals = {trait.name: sorted((TraitValueProbability(value=value, probability=count / successes, **dict(zip(("lower", "upper"), wilson_interval(count, successes))))
+                                                for value, count in marginals[index].items()), key=lambda item: -item.probability)
+                            for index, trait in enumerate(self.expanded)}
+        report.co_occurrence = self.get_co_occurrence(pairs, successes)
+        return report
+
+    def get_co_occurrence(self, pairs: dict, total: float) -> list[CoOccurrence]:
+        return [CoOccurrence(trait_a=self.expanded[index_a].name, value_a=value_a, trait_b=self.expanded[index_b].name, value_b=value_b, probability=weight / total)
+                for (index_a, value_a, index_b, value_b), weight in sorted(pairs.items(), key=lambda item: (item[0][0], item[0][2], -item[1]))]
+
+    def analyze(self, max_states: int = MAX_STATES, samples: int = SAMPLES, co_occurrence: bool = True, seed: int = None) -> RarityReport:
+        """ exact rarity when the joint distribution fits in max_states, a sampled estimate otherwise """
+        self.build()
+        try:
+            return self.compute_exact(max_states, co_occurrence)
+        except RarityBudgetExceeded as error:
+            print(f"{error}, estimating rarity from {samples} samples")
+            return self.compute_monte_carlo(samples, co_occurrence, seed)
@@ -1,16 +1,58 @@
 import argparse
-from email.charset import BASE64
+import asyncio
 import os 
 import json
+import threading
+import time
 import bpy
-from .model import Metadata, Attribute, GenRange
-from typing import List
-import tempfile
-import base64
+from .model import GenRange
 import datetime
-import sys
 from pathlib import Path
-import requests
+import httpx
+
+API_URL = "http://localhost:8118"
+CHUNK_SIZE = 50
+MAX_DOWNLOADS = 8
+MAX_WATCHED_CHUNKS = 4
+PROGRESS_INTERVAL = 1.0
+STARTUP_TIMEOUT = 180.0
+
+active_render = None
+
+
+def is_running() -> bool:
+    return active_render is not None and not active_render.progress.finished
+
+
+class RenderProgress():
+    """ Counters written by the batch client thread and read by the UI timer """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.generated = 0
+        self.rendered = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.started_at = time.monotonic()
+        self.finished = False
+        self.error: str = None
+
+    def get_eta(self) -> datetime.timedelta | None:
+        done = self.downloaded + self.failed
+        if done < 1:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return datetime.timedelta(seconds=round(elapsed / done * (self.total - done)))
+
+    def get_status(self) -> str:
+        if self.error:
+            return f"Failed: {self.error}"
+        status = f"{self.downloaded}/{self.total} saved, {self.generated} generated, {self.rendered} rendered, {self.failed} failed"
+        if self.finished:
+            return f"Done: {status} in {datetime.timedelta(seconds=round(time.monotonic() - self.started_at))}"
+        eta = self.get_eta()
+        return status if eta is None else f"{status}, ETA {eta}"
+
 
 
 class Render():
@@ -135,147 +177,122 @@ class Render():
     #     print(preferences.get_devices())
 
 
-    def write_json(self, metadata, file_path):
-        with open(file_path, 'w') as outfile:
-            outfile.write(json.dumps(metadata, indent=2))
-
     def make_path_if_not_exist(self, path):
         isExist = os.path.exists(path)
         if not isExist:
             # Create a new directory because it does not exist 
             os.makedirs(path)
 
-    def generate_metadata(self)-> str:
-        request_url = f"http://localhost:8118/generate"
-        
-        try: 
-            response = requests.post(request_url)
-        
-        except requests.exceptions.RequestException as e:
-            print(e)
+    def get_item_path(self, item_id: int, extension: str) -> Path:
+        return Path(self.basepath, self.batch_name, f"{item_id}.{extension}")
+
+    async def wait_for_api(self, client: httpx.AsyncClient):
+        """ Wait for the API the operator may just have started """
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(1)
+        raise TimeoutError("The Shaderverse API did not start in time")
+
+    async def stream_batch(self, client: httpx.AsyncClient, batch_id: str):
+        """ Yield the metadata of every item of a batch as soon as it completes """
+        async with client.stream("GET", f"/batch_metadata/{batch_id}/jsonl") as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    async def download(self, client: httpx.AsyncClient, record: dict, downloads: asyncio.Semaphore):
+        rendered_file_url = record["rendered_file_url"]
+        rendered_file = self.get_item_path(record["id"], rendered_file_url.split(".")[-1])
+        async with downloads:
+            try:
+                async with client.stream("GET", rendered_file_url) as response:
+                    response.raise_for_status()
+                    with open(rendered_file, "wb") as outfile:
+                        async for content in response.aiter_bytes():
+                            outfile.write(content)
+                self.progress.downloaded += 1
+            except httpx.HTTPError as e:
+                print(f"Could not download item {record['id']}: {e}")
+                self.progress.failed += 1
+
+    async def render_chunk(self, client: httpx.AsyncClient, records: list[dict], watched_chunks: asyncio.Semaphore, downloads: asyncio.Semaphore):
+        """ Render a chunk of generated items and download each file as soon as it is rendered """
+        metadata_list = [{"id": record["id"], "filename": record["filename"], "attributes": record["attributes"]} for record in records]
+        response = await client.post("/render_batch", params={"should_render_fbx": True}, json={"metadata_list": metadata_list})
+        response.raise_for_status()
+        batch_id = response.json()["batch_id"]
+
+        rendered = []
+        async with watched_chunks:
+            async for record in self.stream_batch(client, batch_id):
+                self.progress.rendered += 1
+                rendered.append(asyncio.create_task(self.download(client, record, downloads)))
+        self.progress.failed += len(records) - len(rendered)
+        await asyncio.gather(*rendered)
+
+    async def run(self):
+        """ Generate the range as one batch, render it in chunks while it generates and download concurrently """
+        limits = httpx.Limits(max_connections=MAX_DOWNLOADS + MAX_WATCHED_CHUNKS + 2)
+        timeout = httpx.Timeout(60.0, read=None)
+        async with httpx.AsyncClient(base_url=API_URL, limits=limits, timeout=timeout) as client:
+            await self.wait_for_api(client)
+            response = await client.post("/generate_batch", params={"number_to_generate": self.progress.total, "starting_id": self.gen_range.start})
+            response.raise_for_status()
+            batch_id = response.json()["batch_id"]
+
+            watched_chunks = asyncio.Semaphore(MAX_WATCHED_CHUNKS)
+            downloads = asyncio.Semaphore(MAX_DOWNLOADS)
+            chunks = []
+            records = []
+            metadata_path = Path(self.basepath, self.batch_name, "metadata.jsonl")
+            with open(metadata_path, "w") as metadata_file:
+                async for record in self.stream_batch(client, batch_id):
+                    self.progress.generated += 1
+                    metadata_file.write(json.dumps(record) + "\n")
+                    records.append(record)
+                    if len(records) >= CHUNK_SIZE:
+                        chunks.append(asyncio.create_task(self.render_chunk(client, records, watched_chunks, downloads)))
+                        records = []
+            if records:
+                chunks.append(asyncio.create_task(self.render_chunk(client, records, watched_chunks, downloads)))
+            self.progress.failed += self.progress.total - self.progress.generated
+            await asyncio.gather(*chunks)
+
+    def run_in_thread(self):
+        try:
+            asyncio.run(self.run())
+        except Exception as e:
+            print(f"Batch render failed: {e}")
+            self.progress.error = str(e)
+        finally:
+            self.progress.finished = True
+
+    def report_progress(self):
+        """ Show the progress in the Batch panel, from a timer on the UI thread """
+        bpy.context.scene.shaderverse.render.status = self.progress.get_status()
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type == 'VIEW_3D':
+                    area.tag_redraw()
+        if self.progress.finished:
             return None
-
-
-        json_data = response.json()
-        # print(json_data)
-        metadata = Metadata(attributes=json_data['attributes'])
-        # print(metadata.attributes)
-        return metadata.json()
+        return PROGRESS_INTERVAL
 
     def handle_execute(self, context):
-        # object_to_render = get_parent_node()
-        # glb_temp_file = tempfile.NamedTemporaryFile()
-        
-        # filepath = "/home/mg/blender/projects/dumpster-fire/8.0.6.blend"
-        # bpy.ops.wm.open_mainfile(filepath=filepath)
+        """ Start rendering the range on a background thread and report its progress without blocking the UI """
+        global active_render
         filepath = os.path.join(self.basepath, self.batch_name)
         self.make_path_if_not_exist(filepath)
 
-
-        start_time = datetime.datetime.now()
-        count = 0
-        
-
-        for item in range(self.gen_range.start, self.gen_range.end + 1):
-            item_count = item
-            current_time = datetime.datetime.now()
-            total_items = self.gen_range.end + 1 - self.gen_range.start 
-            items_remaining = total_items - count
-            time_per_item = None if count < 1 else (current_time - start_time)/count
-            time_remaining = None if count < 1 else time_per_item * items_remaining
-
-            print("now rendering item: {}/{}, id: {}".format(item_count, total_items, item))
-            print("time per item: {}".format(time_per_item))
-            print("time remaining: {}".format(time_remaining))
-            # if (self.gen_range.start and item_count < self.gen_range.end):
-            #     continue
-            # if (self.gen_range.end and item_count > self.gen_range.end):
-            #     continue
-            
-                    
-            # self.enable_cuda()
-            # self.configure_scene()
-            # metadata = self.generate()
-            
-            # temp_dir_name = tempfile.mkdtemp(prefix='shaderverse_')
-            # temp_file_name = f"{next(tempfile._get_candidate_names())}.glb"
-            # glb_temp_file_name = os.path.join(temp_dir_name,temp_file_name)
-            # export_glb(glb_temp_file_name)
-
-            # print(glb_temp_file_name)
-            
-            # # Open binary file for reading
-            # f = open(glb_temp_file_name, 'rb')
-
-            # # Get a string from binary file
-            # d = f.read()
-
-            # # print(d)
-            # encoded_bytes = base64.urlsafe_b64encode(d)
-
-
-            # # glb_bytes = base64.urlsafe_b64encode(glb_bytes)
-            # glb = GlbFile(buffer=encoded_bytes)
-
-
-
-            # basepath = os.path.dirname(os.path.realpath(__file__))
-            # rendered_filename = f"{item}.jpg"
-
-            # rename the file to the item id    
-
-            metadata = self.generate_metadata()
-
-            # request_url = f"http://localhost:8118/render_jpeg?resolution_x={resolution}&resolution_y={resolution}&quality={quality}&samples=64"
-
-            request_url = f"http://localhost:8118/render_fbx"
-            print(f"request_url: {request_url} data: {metadata}")
-            response = requests.post(request_url, data=metadata)
-            body = response.json()
-            blend_file = Path(body["filename"])
-            rendered_file_url = body["rendered_file_url"]
-            rendered_file_response = requests.get(rendered_file_url)
-            rendered_file_content = rendered_file_response.content
-            file_extension = rendered_file_url.split(".")[-1]
-            rendered_file = Path(self.basepath, self.batch_name, f"{item}.{file_extension}")
-            rendered_file.write_bytes(rendered_file_content)
-
-            # rendered_file_path = os.path.join(self.basepath, self.batch_name, rendered_filename)
-            # self.render_scene(rendered_file_path)
-
-            # print(rendered_file_path)
-
-            # glb_filename = f"{item}.glb"
-            # glb_path = os.path.join(self.basepath, self.batch_name, glb_filename)
-            
-            # self.export_glb(glb_path)
-            
-            # print(glb_path)
-
-            # json_filename = f"{item}.json"
-            # json_path = os.path.join(self.basepath, self.batch_name, json_filename)
-
-            # self.write_json(metadata.dict(), json_path)
-
-            # self.revert_file()
-
-            # print(json_path)
-            count +=1 
-
-        
-
-
-
-
-            # return glb
-
+        self.progress = RenderProgress(self.gen_range.end + 1 - self.gen_range.start)
+        active_render = self
+        self.thread = threading.Thread(target=self.run_in_thread, daemon=True)
+        self.thread.start()
+        bpy.app.timers.register(self.report_progress, first_interval=PROGRESS_INTERVAL)
         return {'FINISHED'}
-
-
-
-    
-    if __name__ == "__main__":
-        
-        # execute()
-        pass
-
@@ -0,0 +1,334 @@
+""" Build synthetic Shaderverse scenes and time the generator against them
+
+Run inside Blender with the add-on enabled:
+
+    blender --background --factory-startup --addons shaderverse --python synthetic_scene.py -- \\
+        --trait-collections 8 --objects-per-collection 50 --restriction-density 0.2 --output scene.blend
+
+With --measure N the scene is also saved to a temporary file and N items are generated,
+inspected with get_schema and realized, reverting the file between items. Timings are
+written as JSON to --report.
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+import bpy
+from shaderverse.mesh import Mesh
+
+MAIN_OBJECT_NAME = "Shaderverse Main"
+MAIN_NODE_GROUP_NAME = "Shaderverse Main Nodes"
+TRAIT_MESH_NAME = "Synthetic Trait Mesh"
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build a synthetic Shaderverse scene")
+    parser.add_argument("--trait-collections", dest="trait_collections", type=int, default=4,
+                        help="object trait inputs, each backed by a collection of variants")
+    parser.add_argument("--objects-per-collection", dest="objects_per_collection", type=int, default=10,
+                        help="variants in every trait collection")
+    parser.add_argument("--restriction-density", dest="restriction_density", type=float, default=0.0,
+                        help="fraction of variants restricted on a variant of an earlier trait")
+    parser.add_argument("--nested-collections", dest="nested_collections", type=int, default=0,
+                        help="collection trait inputs whose variants are child collections")
+    parser.add_argument("--animated-collections", dest="animated_collections", type=int, default=0,
+                        help="collection trait inputs whose variants hold keyframed objects")
+    parser.add_argument("--value-inputs", dest="value_inputs", type=int, default=0,
+                        help="float and int inputs on the main node group")
+    parser.add_argument("--seed", dest="seed", type=int, default=0,
+                        help="seed for the restriction layout and the collection seed")
+    parser.add_argument("--output", dest="output", type=Path, default=None,
+                        help="save the scene to this blend file")
+    parser.add_argument("--measure", dest="measure", type=int, default=0,
+                        help="generate and realize this many items and time each stage")
+    parser.add_argument("--report", dest="report", type=Path, default=None,
+                        help="write the timings as JSON here instead of stdout")
+
+    python_args = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+    args, unknown = parser.parse_known_args(args=python_args)
+    return args
+
+
+def get_config(args: argparse.Namespace) -> dict:
+    return {
+        "trait_collections": args.trait_collections,
+        "objects_per_collection": args.objects_per_collection,
+        "restriction_density": args.restriction_density,
+        "nested_collections": args.nested_collections,
+        "animated_collections": args.animated_collections,
+        "value_inputs": args.value_inputs,
+        "seed": args.seed,
+    }
+
+
+def clear_scene():
+    """ Remove every object, collection, mesh and node group from the current file """
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for collection in list(bpy.data.collections):
+        bpy.data.collections.remove(collection)
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+    for node_group in list(bpy.data.node_groups):
+        bpy.data.node_groups.remove(node_group)
+
+
+def get_trait_mesh() -> bpy.types.Mesh:
+    """ A small cube shared by every variant object """
+    mesh = bpy.data.meshes.get(TRAIT_MESH_NAME)
+    if mesh is None:
+        mesh = bpy.data.meshes.new(TRAIT_MESH_NAME)
+        vertices = [(x, y, z) for x in (-0.1, 0.1) for y in (-0.1, 0.1) for z in (-0.1, 0.1)]
+        faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+        mesh.from_pydata(vertices, [], faces)
+        mesh.update()
+    return mesh
+
+
+def new_input(node_group: bpy.types.GeometryNodeTree, socket_type: str, name: str):
+    """ Add a group input on both the pre 4.0 and the interface node group API """
+    if hasattr(node_group, "interface"):
+        return node_group.interface.new_socket(name, in_out="INPUT", socket_type=socket_type)
+    return node_group.inputs.new(socket_type, name)
+
+
+def new_output(node_group: bpy.types.GeometryNodeTree, socket_type: str, name: str):
+    if hasattr(node_group, "interface"):
+        return node_group.interface.new_socket(name, in_out="OUTPUT", socket_type=socket_type)
+    return node_group.outputs.new(socket_type, name)
+
+
+def new_variant(name: str, collection: bpy.types.Collection, is_animated: bool = False) -> bpy.types.Object:
+    """ Add a hidden variant object to a trait collection """
+    obj = bpy.data.objects.new(name, get_trait_mesh())
+    collection.objects.link(obj)
+    obj.hide_set(True)
+    obj.hide_render = True
+    if is_animated:
+        obj.location = (0.0, 0.0, 0.0)
+        obj.keyframe_insert("location", frame=1)
+        obj.location = (0.0, 0.0, 1.0)
+        obj.keyframe_insert("location", frame=24)
+    return obj
+
+
+def new_trait_collection(name: str) -> bpy.types.Collection:
+    collection = bpy.data.collections.new(name)
+    bpy.context.scene.collection.children.link(collection)
+    return collection
+
+
+class SyntheticScene():
+    """ Build a main geometry node object whose inputs select from generated trait collections """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.random = random.Random(config["seed"])
+        self.object_traits: dict[str, list[bpy.types.Object]] = {}
+        self.node_group: bpy.types.GeometryNodeTree = None
+        self.main_object: bpy.types.Object = None
+        self.group_input = None
+        self.join_geometry = None
+
+    def build(self):
+        clear_scene()
+        self.build_main_object()
+        for index in range(self.config["trait_collections"]):
+            self.add_object_trait(f"Trait {index + 1}")
+        for index in range(self.config["nested_collections"]):
+            self.add_collection_trait(f"Nested {index + 1}", is_animated=False)
+        for index in range(self.config["animated_collections"]):
+            self.add_collection_trait(f"Animated {index + 1}", is_animated=True)
+        for index in range(self.config["value_inputs"]):
+            self.add_value_inputs(index + 1)
+
+        scene_properties = bpy.context.scene.shaderverse
+        scene_properties.main_geonodes_object = self.main_object
+        scene_properties.parent_node.object = self.main_object
+        scene_properties.parent_node.node_group = self.node_group
+        scene_properties.parent_node.modifier_name = self.main_object.modifiers[0].name
+        scene_properties.seed = self.config["seed"]
+        self.main_object.shaderverse.is_parent_node = True
+
+        # restrictions read their trait names from the main node group, so add them last
+        self.add_restrictions()
+
+    def build_main_object(self):
+        node_group = bpy.data.node_groups.new(MAIN_NODE_GROUP_NAME, "GeometryNodeTree")
+        new_input(node_group, "NodeSocketGeometry", "Geometry")
+        new_output(node_group, "NodeSocketGeometry", "Geometry")
+        self.group_input = node_group.nodes.new("NodeGroupInput")
+        group_output = node_group.nodes.new("NodeGroupOutput")
+        self.join_geometry = node_group.nodes.new("GeometryNodeJoinGeometry")
+        node_group.links.new(self.join_geometry.outputs[0], group_output.inputs[0])
+        self.node_group = node_group
+
+        obj = bpy.data.objects.new(MAIN_OBJECT_NAME, bpy.data.meshes.new(MAIN_OBJECT_NAME))
+        bpy.context.scene.collection.objects.link(obj)
+        modifier = obj.modifiers.new("Shaderverse", "NODES")
+        modifier.node_group = node_group
+        self.main_object = obj
+
+    def get_input_identifier(self, name: str) -> str:
+        if hasattr(self.node_group, "interface"):
+            return self.node_group.interface.items_tree[name].identifier
+        return self.node_group.inputs[name].identifier
+
+    def join(self, node_type: str, input_name: str, socket_name: str, value):
+        """ Feed a group input through an info node into the joined output """
+        info = self.node_group.nodes.new(node_type)
+        self.node_group.links.new(self.group_input.outputs[input_name], info.inputs[socket_name])
+        geometry = info.outputs["Geometry"] if "Geometry" in info.outputs else info.outputs[0]
+        self.node_group.links.new(geometry, self.join_geometry.inputs[0])
+        self.main_object.modifiers[0][self.get_input_identifier(input_name)] = value
+
+    def add_object_trait(self, name: str):
+        collection = new_trait_collection(name)
+        variants = [new_variant(f"{name} Variant {index + 1}", collection) for index in range(self.config["objects_per_collection"])]
+        self.object_traits[name] = variants
+        new_input(self.node_group, "NodeSocketObject", name)
+        self.join("GeometryNodeObjectInfo", name, "Object", variants[0])
+
+    def add_collection_trait(self, name: str, is_animated: bool):
+        collection = new_trait_collection(name)
+        first_child = None
+        for index in range(self.config["objects_per_collection"]):
+            child = bpy.data.collections.new(f"{name} Option {index + 1}")
+            collection.children.link(child)
+            new_variant(f"{name} Option {index + 1} Part", child, is_animated=is_animated)
+            first_child = first_child or child
+        new_input(self.node_group, "NodeSocketCollection", name)
+        self.join("GeometryNodeCollectionInfo", name, "Collection", first_child)
+
+    def add_value_inputs(self, index: int):
+        float_input = new_input(self.node_group, "NodeSocketFloat", f"Value {index}")
+        float_input.min_value = 0.0
+        float_input.max_value = 1.0
+        int_input = new_input(self.node_group, "NodeSocketInt", f"Count {index}")
+        int_input.min_value = 0
+        int_input.max_value = 100
+
+    def add_restrictions(self):
+        """ Restrict a share of the variants of every trait on a variant of an earlier trait
+
+        The first variant of each trait stays unrestricted so that a choice always exists.
+        """
+        trait_names = list(self.object_traits.keys())
+        for trait_index, trait_name in enumerate(trait_names[1:], start=1):
+            for obj in self.object_traits[trait_name][1:]:
+                if self.random.random() >= self.config["restriction_density"]:
+                    continue
+                restricted_trait = trait_names[self.random.randrange(trait_index)]
+                restriction = obj.shaderverse.restrictions.add()
+                restriction.trait = restricted_trait
+                restriction.restriction_object = self.random.choice(self.object_traits[restricted_trait])
+                restriction.exist_condition = "=="
+
+
+class TimedMesh(Mesh):
+    """ Mesh that accumulates the time spent evaluating restrictions """
+
+    def __init__(self, item_id: int = None):
+        super().__init__(item_id=item_id)
+        self.restriction_seconds = 0.0
+        self.restriction_checks = 0
+
+    def is_item_restriction_found(self, restrictions):
+        start_time = time.perf_counter()
+        try:
+            return super().is_item_restriction_found(restrictions)
+        finally:
+            self.restriction_seconds += time.perf_counter() - start_time
+            self.restriction_checks += 1
+
+
+def set_object_visibility(mesh: Mesh):
+    for obj in mesh.get_objects():
+        obj.hide_set(False)
+        obj.hide_render = False
+
+
+def measure_item(item_id: int) -> dict:
+    """ Generate, inspect and realize one item, timing each stage """
+    mesh = TimedMesh(item_id=item_id)
+    timings = {}
+
+    start_time = time.perf_counter()
+    mesh.create_animated_objects_collection()
+    mesh.reset_animated_objects()
+    mesh.run_metadata_generator()
+    timings["generate_seconds"] = time.perf_counter() - start_time
+    timings["restriction_seconds"] = mesh.restriction_seconds
+    timings["restriction_checks"] = mesh.restriction_checks
+
+    start_time = time.perf_counter()
+    mesh.get_schema()
+    timings["schema_seconds"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    mesh.update_geonodes_from_metadata()
+    set_object_visibility(mesh)
+    bpy.ops.shaderverse.realize()
+    timings["realize_seconds"] = time.perf_counter() - start_time
+    timings["realized_objects"] = len([obj for obj in bpy.context.view_layer.objects if obj.type == "MESH" and obj.visible_get()])
+    return timings
+
+
+def measure(items: int) -> list[dict]:
+    """ Time items against the saved scene, reverting to it after each one """
+    if not bpy.data.filepath:
+        bpy.ops.wm.save_as_mainfile(filepath=str(Path(tempfile.mkdtemp()).joinpath("synthetic.blend")))
+    results = []
+    for item_id in range(1, items + 1):
+        results.append(measure_item(item_id))
+        bpy.ops.wm.revert_mainfile()
+    return results
+
+
+def summarize(results: list[dict]) -> dict:
+    summary = {}
+    for key in ("generate_seconds", "restriction_seconds", "schema_seconds", "realize_seconds"):
+        values = sorted(result[key] for result in results)
+        summary[key] = {
+            "mean": sum(values) / len(values),
+            "min": values[0],
+            "max": values[-1],
+        }
+    summary["restriction_checks"] = sum(result["restriction_checks"] for result in results) / len(results)
+    summary["realized_objects"] = sum(result["realized_objects"] for result in results) / len(results)
+    return summary
+
+
+if __name__ == "__main__":
+    args = get_args()
+    config = get_config(args)
+    scene = SyntheticScene(config)
+    start_time = time.perf_counter()
+    scene.build()
+    build_seconds = time.perf_counter() - start_time
+    object_count = len(bpy.data.objects)
+    print(f"Built synthetic scene with {object_count} objects in {build_seconds:.2f}s")
+
+    if args.output:
+        bpy.ops.wm.save_as_mainfile(filepath=str(args.output.absolute()))
+        print(f"Saved {args.output}")
+
+    if args.measure > 0:
+        results = measure(args.measure)
+        report = {
+            "config": config,
+            "object_count": object_count,
+            "build_seconds": build_seconds,
+            "items": len(results),
+            "summary": summarize(results),
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if args.report:
+            args.report.write_text(output + "\n")
+            print(f"Wrote {args.report}")
+        else:
+            print(output)
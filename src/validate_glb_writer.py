@@ -0,0 +1,142 @@
+""" Compare the native GLB writer against the official glTF exporter
+
+Run inside Blender with the Shaderverse add-on enabled:
+
+    blender file.blend --background --python validate_glb_writer.py -- --count 10
+
+For each generated item both writers export the realized scene and the resulting files are
+compared on triangle count, world space bounds, material names and embedded images.
+"""
+import argparse
+import json
+import sys
+import tempfile
+from pathlib import Path
+import bpy
+import numpy as np
+from shaderverse.mesh import Mesh
+from shaderverse.api.celery_tasks.tasks import run_generator, handle_rendering, export_glb_file_with_exporter
+from shaderverse.api.export.glb import read_glb, read_accessor
+from shaderverse.api.export.glb_writer import GlbWriter, UnsupportedSceneError
+
+BOUNDS_TOLERANCE = 1e-3
+
+
+def quaternion_to_matrix(quaternion: list[float]) -> np.ndarray:
+    x, y, z, w = quaternion
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
+
+def get_node_matrix(node: dict) -> np.ndarray:
+    if "matrix" in node:
+        return np.array(node["matrix"]).reshape(4, 4).T
+    matrix = np.identity(4)
+    matrix[:3, :3] = quaternion_to_matrix(node.get("rotation", [0, 0, 0, 1])) * np.array(node.get("scale", [1, 1, 1]))
+    matrix[:3, 3] = node.get("translation", [0, 0, 0])
+    return matrix
+
+
+def get_stats(filepath: str) -> dict:
+    """ Summarize a GLB file in world space """
+    gltf, binary = read_glb(filepath)
+    nodes = gltf.get("nodes", [])
+    triangles = 0
+    points = []
+
+    def visit(node_index: int, parent_matrix: np.ndarray):
+        nonlocal triangles
+        node = nodes[node_index]
+        matrix = parent_matrix @ get_node_matrix(node)
+        if "mesh" in node:
+            for primitive in gltf["meshes"][node["mesh"]]["primitives"]:
+                if primitive.get("mode", 4) != 4:
+                    continue
+                positions = read_accessor(gltf, binary, primitive["attributes"]["POSITION"])
+                points.append(positions @ matrix[:3, :3].T + matrix[:3, 3])
+                if "indices" in primitive:
+                    triangles += gltf["accessors"][primitive["indices"]]["count"] // 3
+                else:
+                    triangles += len(positions) // 3
+        for child in node.get("children", []):
+            visit(child, matrix)
+
+    for node_index in gltf["scenes"][gltf.get("scene", 0)]["nodes"]:
+        visit(node_index, np.identity(4))
+
+    all_points = np.vstack(points) if points else np.zeros((1, 3))
+    return {
+        "triangles": triangles,
+        "min": all_points.min(axis=0).tolist(),
+        "max": all_points.max(axis=0).tolist(),
+        "materials": sorted(material.get("name", "") for material in gltf.get("materials", [])),
+        "images": len(gltf.get("images", [])),
+        "size": Path(filepath).stat().st_size,
+    }
+
+
+def compare(native: dict, official: dict) -> list[str]:
+    errors = []
+    if native["triangles"] != official["triangles"]:
+        errors.append(f"triangle count {native['triangles']} != {official['triangles']}")
+    for key in ("min", "max"):
+        if not np.allclose(native[key], official[key], atol=BOUNDS_TOLERANCE):
+            errors.append(f"bounds {key} {native[key]} != {official[key]}")
+    if native["materials"] != official["materials"]:
+        errors.append(f"materials {native['materials']} != {official['materials']}")
+    if native["images"] != official["images"]:
+        errors.append(f"image count {native['images']} != {official['images']}")
+    return errors
+
+
+def validate_item(output_dir: Path, item: int) -> dict:
+    mesh = Mesh()
+    run_generator(mesh)
+    mesh = Mesh()
+    handle_rendering(mesh)
+
+    native_file = str(output_dir.joinpath(f"{item}.native.glb"))
+    official_file = str(output_dir.joinpath(f"{item}.official.glb"))
+    result = {"item": item, "metadata": json.loads(bpy.context.scene.shaderverse.generated_metadata)}
+    try:
+        GlbWriter().write(native_file)
+    except UnsupportedSceneError as error:
+        result["skipped"] = str(error)
+        bpy.ops.wm.revert_mainfile()
+        return result
+    export_glb_file_with_exporter(official_file)
+    bpy.ops.wm.revert_mainfile()
+
+    result["native"] = get_stats(native_file)
+    result["official"] = get_stats(official_file)
+    result["errors"] = compare(result["native"], result["official"])
+    return result
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compare the native GLB writer against the glTF exporter')
+    parser.add_argument('--count',
+                        help='number of generated items to compare',
+                        dest='count', type=int, default=5)
+    parser.add_argument('--output',
+                        help='directory to keep the exported files in',
+                        dest='output', type=str, default=None)
+    python_args = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+    args, unknown = parser.parse_known_args(args=python_args)
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args()
+    output_dir = Path(args.output) if args.output else Path(tempfile.mkdtemp(prefix="shaderverse_glb_"))
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    results = [validate_item(output_dir, item) for item in range(1, args.count + 1)]
+    print(json.dumps(results, indent=2))
+
+    failed = [result for result in results if result.get("errors")]
+    print(f"{len(results) - len(failed)}/{len(results)} items match the glTF exporter")
+    sys.exit(1 if failed else 0)